@@ -0,0 +1,174 @@
+"""
+Compare what is sent to Speech-to-Text before and after local audio
+preprocessing, on synthetic voice notes (speech-like bursts between silent
+stretches, over background noise) recorded as 48 kHz WebM/Opus, as browsers
+send them, and as 44.1 kHz stereo WAV, as some Android recorders do:
+
+- before: the upload is sent as is and STT processes the whole recording.
+- after: the upload is decoded, downmixed to 16 kHz mono and trimmed of
+  leading/trailing silence (_preprocess_audio) and that PCM is sent.
+
+Without --live the Speech-to-Text call is a stub and its latency is modelled
+as the upload time at --uplink-kbps plus --rtf seconds per second of audio,
+added to the measured local processing time (the upload goes over the
+server's link to Google, not the user's), so the numbers are an estimate;
+"whisper" is quiet enough that no frame passes the VAD threshold and the
+whole clip is sent. With --live the real API is called (needs Google Cloud
+credentials).
+
+Run from the backend directory:
+    python benchmarks/audio_preprocess.py --runs 3
+"""
+
+import argparse
+import io
+import statistics
+import sys
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.services.audio_service import AudioService  # noqa: E402
+
+# (leading silence, speech, trailing silence) in seconds
+CLIPS = {
+    "short note": (2.0, 4.0, 3.0),
+    "question": (1.5, 12.0, 2.5),
+    "quiet": (2.0, 6.0, 2.0),
+    "whisper": (2.0, 6.0, 2.0),
+}
+LEVELS = {"quiet": 0.05, "whisper": 0.003}
+
+
+def voice_note(lead: float, speech: float, tail: float, rate: int, seed: int = 0):
+    """Syllable-like tone bursts with a moving pitch, over low noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(speech * rate)) / rate
+    pitch = 140 + 40 * np.sin(2 * np.pi * 0.7 * t)
+    voiced = np.sin(2 * np.pi * np.cumsum(pitch) / rate)
+    voiced += 0.5 * np.sin(2 * np.pi * 3 * np.cumsum(pitch) / rate)
+    syllables = (np.sin(2 * np.pi * 4 * t) > -0.3).astype(float)
+    signal = np.concatenate(
+        [np.zeros(int(lead * rate)), voiced * syllables, np.zeros(int(tail * rate))]
+    )
+    return signal + rng.normal(0, 0.003, len(signal))
+
+
+def webm_opus(signal: np.ndarray, level: float) -> bytes:
+    import av
+
+    pcm = (np.clip(signal * level, -1, 1) * 32767).astype(np.int16)
+    buffer = io.BytesIO()
+    with av.open(buffer, "w", format="webm") as container:
+        stream = container.add_stream("libopus", rate=48000)
+        stream.layout = "mono"
+        frame = av.AudioFrame.from_ndarray(
+            pcm.reshape(1, -1), format="s16", layout="mono"
+        )
+        frame.sample_rate = 48000
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buffer.getvalue()
+
+
+def wav_stereo(signal: np.ndarray, level: float) -> bytes:
+    pcm = (np.clip(signal * level, -1, 1) * 32767).astype(np.int16)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(2)
+        out.setsampwidth(2)
+        out.setframerate(44100)
+        out.writeframes(np.repeat(pcm, 2).tobytes())
+    return buffer.getvalue()
+
+
+class StubSpeechClient:
+    """Answers like recognize() and adds up the modelled time of each call."""
+
+    def __init__(self, uplink_kbps: float, rtf: float):
+        self.uplink_kbps = uplink_kbps
+        self.rtf = rtf
+        self.seconds = 0.0  # audio length of the clip being recognized
+        self.modelled = 0.0
+
+    def recognize(self, config, audio):
+        from google.cloud import speech_v1
+
+        upload = len(audio.content) * 8 / (self.uplink_kbps * 1000)
+        self.modelled += upload + self.seconds * self.rtf
+        alternative = {"transcript": "maize leaves", "confidence": 0.9}
+        return speech_v1.RecognizeResponse(results=[{"alternatives": [alternative]}])
+
+
+def measure(service: AudioService, stub, upload: bytes, seconds: float, before: bool):
+    """Bytes sent and time until the transcript is back."""
+    if stub:
+        stub.modelled = 0.0
+    t0 = time.perf_counter()
+    if before:
+        # The old path: the raw upload, trying each encoding in turn
+        payload = upload
+        if stub:
+            stub.seconds = seconds
+        service._recognize(upload, None, "en-US")
+    else:
+        payload = service._preprocess_audio(upload)
+        if stub:
+            stub.seconds = len(payload) / 32000
+        service._recognize(upload, payload, "en-US")
+    elapsed = time.perf_counter() - t0
+    return len(payload), elapsed + (stub.modelled if stub else 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--uplink-kbps", type=float, default=20000)
+    parser.add_argument("--rtf", type=float, default=0.3)
+    parser.add_argument("--live", action="store_true")
+    args = parser.parse_args()
+
+    service = AudioService()
+    stub = None
+    if not args.live:
+        stub = StubSpeechClient(args.uplink_kbps, args.rtf)
+        service._speech_client._client = stub
+        service._speech_client._initialized = True
+
+    print(
+        f"{'clip':>11} {'format':>9} {'seconds':>8}"
+        f" {'bytes before':>13} {'after':>9} {'STT s before':>13} {'after':>7}"
+    )
+    for label, (lead, speech, tail) in CLIPS.items():
+        level = LEVELS.get(label, 0.5)
+        for fmt, encode, rate in (
+            ("webm/opus", webm_opus, 48000),
+            ("wav 44k", wav_stereo, 44100),
+        ):
+            upload = encode(voice_note(lead, speech, tail, rate), level)
+            seconds = lead + speech + tail
+            rows = {}
+            for before in (True, False):
+                samples = [
+                    measure(service, stub, upload, seconds, before)
+                    for _ in range(args.runs)
+                ]
+                rows[before] = (
+                    samples[0][0],
+                    statistics.median(s[1] for s in samples),
+                )
+            print(
+                f"{label:>11} {fmt:>9} {seconds:>8.1f}"
+                f" {rows[True][0]:>13} {rows[False][0]:>9}"
+                f" {rows[True][1]:>13.2f} {rows[False][1]:>7.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
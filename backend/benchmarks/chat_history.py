@@ -0,0 +1,111 @@
+"""
+Measure how chat history access scales with the length of a session: a
+session is seeded with many messages, then loading the full history is
+compared with loading only the latest window and with appending a message.
+
+Run from the backend directory:
+    python benchmarks/chat_history.py --messages 10000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Executed in a fresh interpreter so DATABASE_URL is read by src.db
+PROBE = """
+import asyncio, json, statistics, sys, time, uuid
+from datetime import datetime, timedelta
+from src.db import SessionLocal, init_db
+from src.db.chat_models import ChatMessageDB
+from src.services.chat_service import chat_session_manager
+
+messages, window, runs = (int(a) for a in sys.argv[1:4])
+init_db()
+session_id = asyncio.run(chat_session_manager.start_session()).session_id
+start = datetime.utcnow() - timedelta(seconds=messages)
+db = SessionLocal()
+db.bulk_save_objects(
+    ChatMessageDB(
+        id=str(uuid.uuid4()),
+        session_id=session_id,
+        sender="user" if i % 2 == 0 else "llm",
+        message=f"message {i} " * 10,
+        timestamp=start + timedelta(seconds=i),
+    )
+    for i in range(messages)
+)
+db.commit()
+db.close()
+
+
+async def measure(fn):
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples)
+
+
+async def main():
+    return {
+        "full_s": await measure(lambda: chat_session_manager.get_session(session_id)),
+        "window_s": await measure(
+            lambda: chat_session_manager.get_session(session_id, message_limit=window)
+        ),
+        "append_s": await measure(
+            lambda: chat_session_manager.add_message(session_id, "user", "hello")
+        ),
+    }
+
+
+print(json.dumps(asyncio.run(main())))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--window", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        env = dict(os.environ)
+        env.setdefault("GOOGLE_API_KEY", "benchmark")
+        env.setdefault("JWT_SECRET_KEY", "benchmark")
+        env["DATABASE_URL"] = f"sqlite:///{db_dir}/chat_history.db"
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                PROBE,
+                str(args.messages),
+                str(args.window),
+                str(args.runs),
+            ],
+            cwd=BACKEND_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+
+    print(f"session with {args.messages} messages, median of {args.runs} runs")
+    for key, label in (
+        ("full_s", "full history load"),
+        ("window_s", f"last {args.window} messages"),
+        ("append_s", "append message"),
+    ):
+        print(f"  {label:>18}: {timings[key] * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Count database connection checkouts, the time a request keeps a connection
+checked out and latency per request for the main authenticated endpoints.
+The LLM is replaced by a stub that takes --llm-ms like a short Gemini call
+and the weather calendar is served from its cache. A connection held across
+the LLM call shows up as held time close to the latency.
+
+Run from the backend directory:
+    python benchmarks/db_sessions.py --requests 50
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Executed in a fresh interpreter so DATABASE_URL is read by src.db
+PROBE = """
+import asyncio, json, statistics, sys, time
+from sqlalchemy import event
+import src.main
+from fastapi.testclient import TestClient
+from src.db import async_engine, engine
+from src.routes.weather_forecast import save_weather_cache
+from src.services.llm_service import llm_service
+
+requests = int(sys.argv[1])
+llm_seconds = float(sys.argv[2]) / 1000
+
+
+def generate(prompt, **kwargs):
+    time.sleep(llm_seconds)
+    return {"response": "Plant maize."}
+
+
+llm_service._generate = generate
+
+checkouts = 0
+held = 0.0
+
+
+def count_checkout(dbapi_connection, connection_record, proxy):
+    global checkouts
+    checkouts += 1
+    connection_record.info["checked_out"] = time.perf_counter()
+
+
+def count_checkin(dbapi_connection, connection_record):
+    global held
+    started = connection_record.info.pop("checked_out", None)
+    if started is not None:
+        held += time.perf_counter() - started
+
+
+event.listen(engine.pool, "checkout", count_checkout)
+event.listen(async_engine.sync_engine.pool, "checkout", count_checkout)
+event.listen(engine.pool, "checkin", count_checkin)
+event.listen(async_engine.sync_engine.pool, "checkin", count_checkin)
+
+with TestClient(src.main.app) as client:
+    token = client.post(
+        "/api/user/complete-registration",
+        json={"email": "bench@example.com", "password": "bench", "location": "Addis"},
+    ).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    user_id = client.get("/api/user/me", headers=headers).json()["user_id"]
+    session_id = client.post(
+        "/api/chat/start-session", json={}, headers=headers
+    ).json()["session_id"]
+    client.portal.call(save_weather_cache, user_id, 9.0, 38.7, 31, {"days": []})
+
+    endpoints = {
+        "POST /api/chat/send-message": lambda: client.post(
+            "/api/chat/send-message",
+            params={"preferred_language": "en"},
+            json={"session_id": session_id, "message": "What should I plant?"},
+            headers=headers,
+        ),
+        "GET /api/chat/history": lambda: client.get(
+            "/api/chat/history",
+            params={"session_id": session_id, "limit": 10},
+            headers=headers,
+        ),
+        "GET /api/user/me": lambda: client.get("/api/user/me", headers=headers),
+        "GET /api/weather/calendar": lambda: client.get(
+            "/api/weather/calendar",
+            params={"lat": 9.0, "lon": 38.7, "days": 31},
+            headers=headers,
+        ),
+    }
+    results = {}
+    for name, call in endpoints.items():
+        call()
+        checkouts = 0
+        held = 0.0
+        samples = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = call()
+            samples.append(time.perf_counter() - started)
+            assert response.status_code == 200, (name, response.text)
+        results[name] = {
+            "checkouts": checkouts / requests,
+            "held_s": held / requests,
+            "median_s": statistics.median(samples),
+        }
+print(json.dumps(results))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--llm-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        env = dict(os.environ)
+        env.setdefault("GOOGLE_API_KEY", "benchmark")
+        env.setdefault("JWT_SECRET_KEY", "benchmark-secret-key-0123456789abcdef")
+        env["DATABASE_URL"] = f"sqlite:///{db_dir}/db_sessions.db"
+        env["WARMUP_CLIENTS"] = "false"
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE, str(args.requests), str(args.llm_ms)],
+            cwd=BACKEND_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    results = json.loads(result.stdout.strip().splitlines()[-1])
+
+    print(
+        f"{'endpoint':<30} {'checkouts/req':>14} {'held/req':>12}"
+        f" {'median latency':>16}"
+    )
+    for name, stats in results.items():
+        print(
+            f"{name:<30} {stats['checkouts']:>14.1f} "
+            f"{stats['held_s'] * 1000:>9.2f} ms {stats['median_s'] * 1000:>13.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Compare the diagnosis image handling before and after the in-memory pipeline
+on synthetic phone photos (4, 8 and 12 MP JPEGs with an EXIF orientation):
+
+- legacy: the upload is written to a temp file, read back for OpenEPI and
+  Kindwise, opened again by ensure_min_resolution and read a third time for
+  DeepLeaf; the original bytes are uploaded to all three providers.
+- in-memory: the upload is normalized once (normalize_image) and the same
+  JPEG buffer is uploaded to all three providers.
+
+Run from the backend directory:
+    python benchmarks/image_pipeline.py --runs 5
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.services import image_service  # noqa: E402
+from src.services.image_service import normalize_image  # noqa: E402
+
+# The synthetic textures are not leaves; time the I/O path, see quality_gate.py
+image_service.IMAGE_QUALITY_CHECK = False
+
+PROVIDERS = 3  # OpenEPI, Kindwise, DeepLeaf
+SIZES = {"4 MP": (2304, 1728), "8 MP": (3264, 2448), "12 MP": (4032, 3024)}
+
+
+def phone_photo(width: int, height: int, seed: int = 0) -> bytes:
+    """Leaf-like texture: smooth colour fields plus sensor noise, JPEG q92 like a phone camera."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 255, (height // 64 + 1, width // 64 + 1, 3), np.uint8)
+    base = Image.fromarray(coarse).resize((width, height), Image.BICUBIC)
+    pixels = np.asarray(base, dtype=np.int16)
+    pixels += rng.normal(0, 6, pixels.shape).astype(np.int16)
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    exif = img.getexif()
+    exif[0x0112] = 6  # rotated 90°, as portrait phone shots are stored
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=92, exif=exif)
+    return buffer.getvalue()
+
+
+def legacy(data: bytes, tmp_dir: str) -> dict:
+    """The old temp-file path, without the network calls."""
+    written = read = 0
+    with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+        tmp.write(data)
+        path = tmp.name
+    written += len(data)
+    with open(path, "rb") as f:  # predict_crop_health
+        read += len(f.read())
+    with Image.open(path) as img:  # ensure_min_resolution (large images pass)
+        img.size
+    with open(path, "rb") as f:  # DeepLeaf upload
+        read += len(f.read())
+    os.remove(path)  # the route never did this
+    return {"disk_bytes": written + read, "upload_bytes": PROVIDERS * len(data)}
+
+
+def in_memory(data: bytes) -> dict:
+    image = normalize_image(data)
+    return {"disk_bytes": 0, "upload_bytes": PROVIDERS * len(image.data)}
+
+
+def measure(fn, runs: int):
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'photo':>6} {'upload':>9} | {'legacy disk':>11} {'legacy sent':>11} {'ms':>6}"
+        f" | {'new disk':>8} {'new sent':>9} {'ms':>6} | {'sent saved':>10}"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for label, (width, height) in SIZES.items():
+            data = phone_photo(width, height)
+            old_s, old = measure(lambda: legacy(data, tmp_dir), args.runs)
+            new_s, new = measure(lambda: in_memory(data), args.runs)
+            saved = 1 - new["upload_bytes"] / old["upload_bytes"]
+            print(
+                f"{label:>6} {len(data) / 1e6:>7.2f}MB"
+                f" | {old['disk_bytes'] / 1e6:>9.2f}MB {old['upload_bytes'] / 1e6:>9.2f}MB"
+                f" {old_s * 1000:>6.1f}"
+                f" | {new['disk_bytes'] / 1e6:>6.2f}MB {new['upload_bytes'] / 1e6:>7.2f}MB"
+                f" {new_s * 1000:>6.1f} | {saved:>10.0%}"
+            )
+
+
+if __name__ == "__main__":
+    main()
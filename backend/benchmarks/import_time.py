@@ -0,0 +1,100 @@
+"""
+Profile `import src.main` with `python -X importtime` and fail when the
+cumulative import time exceeds the budget, or when a module that should only
+be loaded on first use is imported eagerly.
+
+Run from the backend directory:
+    python benchmarks/import_time.py --budget-ms 1200
+
+Exits with status 1 when the budget is exceeded so it can gate a CI job.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Heavy modules that must only be imported on the code paths that use them
+DEFERRED_MODULES = [
+    "google.genai",
+    "google.cloud.speech_v1",
+    "google.cloud.texttospeech",
+    "google.cloud.translate_v2",
+    "deep_translator",
+    "requests",
+    "PIL",
+    "numpy",
+]
+
+
+def profile_import(db_dir: str) -> dict:
+    """Return {module: cumulative_us} for one cold `import src.main`."""
+    env = dict(os.environ)
+    env.setdefault("GOOGLE_API_KEY", "benchmark")
+    env.setdefault("JWT_SECRET_KEY", "benchmark")
+    env.setdefault("DATABASE_URL", f"sqlite:///{db_dir}/import_time.db")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import src.main"],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:") :].split("|")
+        timings[module.strip()] = int(cumulative)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=float(os.getenv("IMPORT_TIME_BUDGET_MS", "1200")),
+        help="Maximum median cumulative import time of src.main",
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        profiles = [profile_import(db_dir) for _ in range(args.runs)]
+
+    total_ms = statistics.median(p["src.main"] for p in profiles) / 1000
+    last = profiles[-1]
+
+    print("Slowest imports (cumulative, last run):")
+    for module, cumulative in sorted(last.items(), key=lambda kv: -kv[1])[: args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {module}")
+
+    failed = False
+    eager = [
+        module
+        for module in DEFERRED_MODULES
+        if any(name == module or name.startswith(module + ".") for name in last)
+    ]
+    if eager:
+        print(f"FAIL: deferred modules imported eagerly: {', '.join(eager)}")
+        failed = True
+
+    print(f"import src.main: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    if total_ms > args.budget_ms:
+        print("FAIL: import time budget exceeded")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
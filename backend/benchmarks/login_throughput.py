@@ -0,0 +1,137 @@
+"""
+Measure login throughput under a burst of concurrent logins, and how
+responsive the event loop stays meanwhile (latency of /health/live sampled
+during the burst). Compares bcrypt in the process pool with running it in
+the default threadpool.
+
+Run from the backend directory:
+    python benchmarks/login_throughput.py --logins 200 --concurrency 50
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Executed in a fresh interpreter so DATABASE_URL and pool settings are read
+PROBE = """
+import asyncio, json, statistics, sys, time
+import httpx
+import src.main
+from src.auth.passwords import password_hasher
+from src.db import init_db
+
+mode, logins, concurrency = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+if mode == "thread":
+    password_hasher._run = lambda fn, *args: asyncio.to_thread(fn, *args)
+
+credentials = {"email": "bench@example.com", "password": "correct horse battery"}
+
+
+async def main():
+    init_db()
+    transport = httpx.ASGITransport(app=src.main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/api/user/complete-registration", json=credentials)
+        await client.post("/api/user/login", json=credentials)  # start workers
+
+        limit = asyncio.Semaphore(concurrency)
+        latencies, statuses, probes = [], [], []
+        done = asyncio.Event()
+
+        async def login():
+            async with limit:
+                started = time.perf_counter()
+                response = await client.post("/api/user/login", json=credentials)
+                latencies.append(time.perf_counter() - started)
+                statuses.append(response.status_code)
+
+        async def probe_loop():
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get("/health/live")
+                probes.append(time.perf_counter() - started)
+                await asyncio.sleep(0.01)
+
+        prober = asyncio.create_task(probe_loop())
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await prober
+
+    latencies.sort()
+    probes.sort()
+    password_hasher.shutdown()
+    return {
+        "elapsed_s": elapsed,
+        "ok": statuses.count(200),
+        "rejected": statuses.count(503),
+        "p50_s": latencies[len(latencies) // 2],
+        "p95_s": latencies[int(len(latencies) * 0.95)],
+        "probe_p95_s": probes[int(len(probes) * 0.95)] if probes else 0.0,
+        "probe_max_s": probes[-1] if probes else 0.0,
+    }
+
+
+print(json.dumps(asyncio.run(main())))
+"""
+
+
+def run(mode: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as db_dir:
+        env = dict(os.environ)
+        env.setdefault("GOOGLE_API_KEY", "benchmark")
+        env.setdefault("JWT_SECRET_KEY", "benchmark-secret-key-0123456789abcdef")
+        env["DATABASE_URL"] = f"sqlite:///{db_dir}/login.db"
+        env["PASSWORD_HASH_WORKERS"] = str(args.workers)
+        env["PASSWORD_HASH_MAX_QUEUE"] = str(args.max_queue)
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                PROBE,
+                mode,
+                str(args.logins),
+                str(args.concurrency),
+            ],
+            cwd=BACKEND_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-queue", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(
+        f"{args.logins} logins, {args.concurrency} concurrent, "
+        f"{args.workers} hash worker(s)"
+    )
+    for mode in ("thread", "process"):
+        r = run(mode, args)
+        per_second = r["ok"] / r["elapsed_s"]
+        cores = min(args.workers, os.cpu_count() or 1)
+        print(
+            f"  {mode:>7}: {per_second:6.1f} logins/s ({per_second / cores:5.1f} per core), "
+            f"p50 {r['p50_s'] * 1000:.0f} ms, p95 {r['p95_s'] * 1000:.0f} ms, "
+            f"503s {r['rejected']}, /health/live p95 {r['probe_p95_s'] * 1000:.0f} ms "
+            f"max {r['probe_max_s'] * 1000:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Measure the local crop-health pre-screen: latency of a prediction through the
+process pool, and how many remote provider calls it saves on a mix of
+healthy and diseased leaf photos at several confidence thresholds.
+
+Without --model, a tiny stand-in classifier (average colour -> healthy/not
+healthy logits) is written to a temp file; it needs the onnx package. Pass a
+real model to measure that instead. Both need onnxruntime.
+
+Run from the backend directory:
+    python benchmarks/prescreen.py --photos 40 --healthy-share 0.6
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.services.image_service import normalize_image  # noqa: E402
+from src.services.prescreen_service import LocalPrescreen  # noqa: E402
+
+PROVIDERS = 3  # OpenEPI, Kindwise, DeepLeaf
+THRESHOLDS = (0.8, 0.9, 0.95, 0.99)
+
+
+def tiny_model(path: str):
+    """Global average colour through a linear layer: green leaves score healthy."""
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    # Input is ImageNet-normalized RGB; brown lesions lower the mean green
+    # of the leaf photos below from about 0.10 to under 0.06
+    weights = np.array([[0.0, 0.0], [250.0, 0.0], [0.0, 0.0]], dtype=np.float32)
+    bias = np.array([-19.5, 0.0], dtype=np.float32)
+    graph = helper.make_graph(
+        [
+            helper.make_node("GlobalAveragePool", ["image"], ["pooled"]),
+            helper.make_node("Flatten", ["pooled"], ["features"]),
+            helper.make_node("Gemm", ["features", "weights", "bias"], ["logits"]),
+        ],
+        "tiny_prescreen",
+        [helper.make_tensor_value_info("image", TensorProto.FLOAT, [1, 3, 64, 64])],
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, [1, 2])],
+        [
+            numpy_helper.from_array(weights, "weights"),
+            numpy_helper.from_array(bias, "bias"),
+        ],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+def leaf_photo(lesions: int, seed: int, width: int = 3000, height: int = 2250):
+    """A veined leaf filling most of the frame, with brown lesions, as a JPEG."""
+    rng = np.random.default_rng(seed)
+    img = Image.new("RGB", (width, height), (110, 90, 65))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse(
+        (width * 0.05, height * 0.05, width * 0.95, height * 0.95),
+        fill=(55 + int(rng.integers(0, 30)), 140, 40),
+    )
+    for i in range(14):
+        draw.line(
+            (width * 0.5, height * 0.5, width * (0.15 + 0.05 * i), height * 0.1),
+            fill=(130, 185, 85),
+            width=6,
+        )
+    for _ in range(lesions):
+        x, y = rng.uniform(0.15, 0.8) * width, rng.uniform(0.15, 0.8) * height
+        r = rng.uniform(0.02, 0.06) * width
+        draw.ellipse((x, y, x + r, y + r), fill=(115, 75, 30))
+    pixels = np.asarray(img, dtype=np.int16)
+    pixels += rng.normal(0, 4, pixels.shape).astype(np.int16)
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    img = img.filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+async def run(args, model_path: str):
+    photos = []
+    for i in range(args.photos):
+        healthy = i < round(args.photos * args.healthy_share)
+        lesions = 0 if healthy else int(np.random.default_rng(i).integers(8, 40))
+        photos.append((healthy, normalize_image(leaf_photo(lesions, seed=i))))
+
+    screener = LocalPrescreen(model_path=model_path, workers=args.workers)
+    t0 = time.perf_counter()
+    await asyncio.to_thread(screener.load)
+    load_s = time.perf_counter() - t0
+
+    latencies, probabilities = [], []
+    for healthy, image in photos:
+        t0 = time.perf_counter()
+        probability = await screener.healthy_probability(image)
+        latencies.append(time.perf_counter() - t0)
+        probabilities.append((healthy, probability))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(screener.healthy_probability(img) for _, img in photos))
+    burst_s = time.perf_counter() - t0
+    screener.shutdown()
+
+    latencies.sort()
+    print(f"model:            {os.path.basename(model_path)}")
+    print(f"pool start+load:  {load_s * 1000:.0f} ms ({args.workers} worker(s))")
+    print(
+        f"latency:          p50 {statistics.median(latencies) * 1000:.1f} ms,"
+        f" p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms"
+    )
+    print(f"burst of {len(photos)}:      {burst_s * 1000:.0f} ms")
+    print()
+    print(
+        f"{'threshold':>9} {'local':>6} {'wrong':>6}"
+        f" {'provider calls':>15} {'saved':>6}"
+    )
+    baseline = PROVIDERS * len(photos)
+    for threshold in THRESHOLDS:
+        local = [healthy for healthy, p in probabilities if p >= threshold]
+        calls = PROVIDERS * (len(photos) - len(local))
+        print(
+            f"{threshold:>9.2f} {len(local):>6} {local.count(False):>6}"
+            f" {calls:>6} of {baseline:<5} {1 - calls / baseline:>6.0%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", help="ONNX model (default: tiny stand-in)")
+    parser.add_argument("--photos", type=int, default=40)
+    parser.add_argument("--healthy-share", type=float, default=0.6)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = args.model
+        if model_path is None:
+            model_path = os.path.join(tmp_dir, "tiny_prescreen.onnx")
+            tiny_model(model_path)
+        asyncio.run(run(args, model_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Time the local photo quality gate (assess_image_quality) and show what it
+reports for synthetic 12 MP leaf photos: sharp, blurred, dark, overexposed,
+a photo with no leaf in it and a thumbnail. Like normalize_image, each JPEG
+is draft-decoded at reduced scale before the checks run.
+
+Run from the backend directory:
+    python benchmarks/quality_gate.py --runs 20
+"""
+
+import argparse
+import io
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.services.image_service import (  # noqa: E402
+    _target_size,
+    assess_image_quality,
+)
+
+
+def leaf_photo(width: int = 4000, height: int = 3000, seed: int = 0) -> Image.Image:
+    """A veined leaf with lesions on cluttered soil, with sensor noise."""
+    rng = np.random.default_rng(seed)
+    img = Image.new("RGB", (width, height), (120, 95, 70))
+    draw = ImageDraw.Draw(img)
+    for _ in range(200):
+        x, y, r = rng.integers(0, width), rng.integers(0, height), rng.integers(5, 60)
+        colour = tuple(int(c) for c in rng.integers(60, 160, 3))
+        draw.ellipse((x, y, x + r, y + r), fill=colour)
+    draw.ellipse(
+        (width * 0.2, height * 0.25, width * 0.8, height * 0.75), fill=(60, 140, 40)
+    )
+    for i in range(12):
+        draw.line(
+            (width * 0.5, height * 0.5, width * (0.25 + 0.05 * i), height * 0.3),
+            fill=(140, 190, 90),
+            width=max(2, width // 500),
+        )
+    for _ in range(40):
+        x, y = rng.uniform(0.3, 0.7) * width, rng.uniform(0.35, 0.65) * height
+        r = rng.uniform(0.005, 0.02) * width
+        draw.ellipse((x, y, x + r, y + r), fill=(110, 70, 30))
+    pixels = np.asarray(img, dtype=np.int16)
+    pixels += rng.normal(0, 4, pixels.shape).astype(np.int16)
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    return img.filter(ImageFilter.GaussianBlur(1))
+
+
+def variants() -> dict:
+    leaf = leaf_photo()
+    wall = np.full((3000, 4000, 3), (150, 160, 185), np.int16)
+    wall += np.random.default_rng(1).normal(0, 12, wall.shape).astype(np.int16)
+    return {
+        "sharp": leaf,
+        "blurred": leaf.filter(ImageFilter.GaussianBlur(8)),
+        "dark": ImageEnhance.Brightness(leaf).enhance(0.2),
+        "overexposed": ImageEnhance.Brightness(leaf).enhance(2.6),
+        "no leaf": Image.fromarray(np.clip(wall, 0, 255).astype(np.uint8)),
+        "thumbnail": leaf.resize((120, 90)),
+    }
+
+
+def decoded(img: Image.Image) -> Image.Image:
+    """The image normalize_image would check for this photo taken as a JPEG."""
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=92)
+    jpeg = Image.open(buffer)
+    jpeg.draft("RGB", _target_size(jpeg.width, jpeg.height))
+    return jpeg.convert("RGB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'photo':>12} {'checked':>10} {'ms':>6}  issues")
+    for label, photo in variants().items():
+        img = decoded(photo)
+        samples = []
+        for _ in range(args.runs):
+            t0 = time.perf_counter()
+            issues = assess_image_quality(img, photo.size)
+            samples.append(time.perf_counter() - t0)
+        found = ", ".join(f"{i['code']} ({i['value']})" for i in issues) or "-"
+        print(
+            f"{label:>12} {img.width:>4}x{img.height:<5}"
+            f" {statistics.median(samples) * 1000:>6.1f}  {found}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Measure the offline reverse geocoder: gazetteer load time, lookup latency of
+the k-d tree against a brute-force NumPy scan, and the share of random points
+in a bounding box that resolve without falling back to Photon.
+
+Run from the backend directory:
+    python benchmarks/reverse_geocode.py --bbox 3.4 14.9 33.0 48.0
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.services.gazetteer import Gazetteer, to_unit_vectors  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        default=[3.4, 14.9, 33.0, 48.0],  # Ethiopia
+        metavar=("MIN_LAT", "MAX_LAT", "MIN_LON", "MAX_LON"),
+    )
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    gazetteer = Gazetteer()
+    t0 = time.perf_counter()
+    gazetteer.load()
+    load_s = time.perf_counter() - t0
+
+    min_lat, max_lat, min_lon, max_lon = args.bbox
+    points = [
+        (random.uniform(min_lat, max_lat), random.uniform(min_lon, max_lon))
+        for _ in range(args.lookups)
+    ]
+
+    t0 = time.perf_counter()
+    resolved = sum(
+        gazetteer.reverse_geocode(lat, lon) is not None for lat, lon in points
+    )
+    tree_us = (time.perf_counter() - t0) / len(points) * 1e6
+
+    # Brute force over the same unit vectors, for comparison
+    all_points = np.array(gazetteer._tree._points)
+    sample = points[:1000]
+    t0 = time.perf_counter()
+    for lat, lon in sample:
+        query = to_unit_vectors(lat, lon)[0]
+        int(np.argmin(((all_points - query) ** 2).sum(axis=1)))
+    brute_us = (time.perf_counter() - t0) / len(sample) * 1e6
+
+    print(f"places:            {len(gazetteer.places)}")
+    print(f"load:              {load_s * 1000:.0f} ms")
+    print(f"k-d tree lookup:   {tree_us:.1f} µs")
+    print(f"brute-force scan:  {brute_us:.1f} µs")
+    print(
+        f"resolved offline:  {resolved / len(points):.0%} "
+        f"(within {gazetteer.max_distance_km:g} km)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Measure cold-start time of the API: how long a fresh interpreter takes to
+import src.main, until the app answers its first request, and until
+/health/ready reports that client warm-up has finished.
+
+Run from the backend directory:
+    python benchmarks/startup_time.py --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Executed in a fresh interpreter for every run so module caches are cold
+PROBE = """
+import json, time
+started = time.perf_counter()
+import src.main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(src.main.app) as client:
+    client.get("/health/live")
+    serving = time.perf_counter()
+    while client.get("/health/ready").status_code != 200:
+        time.sleep(0.01)
+    ready = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - started,
+    "serving_s": serving - started,
+    "ready_s": ready - started,
+}))
+"""
+
+
+def run_once(db_dir: str) -> dict:
+    env = dict(os.environ)
+    env.setdefault("GOOGLE_API_KEY", "benchmark")
+    env.setdefault("JWT_SECRET_KEY", "benchmark")
+    env.setdefault("DATABASE_URL", f"sqlite:///{db_dir}/startup.db")
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        runs = [run_once(db_dir) for _ in range(args.runs)]
+    for key, label in (
+        ("import_s", "import src.main"),
+        ("serving_s", "first response"),
+        ("ready_s", "import-to-ready"),
+    ):
+        values = [r[key] for r in runs]
+        print(
+            f"{label:>16}: median {statistics.median(values) * 1000:.0f} ms, "
+            f"min {min(values) * 1000:.0f} ms, max {max(values) * 1000:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,105 @@
 import os
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 import jwt
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from src.db import SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.db import get_db, use_session
 from src.db.chat_models import User as UserDB
+from src.auth.user_cache import AuthenticatedUser, user_cache
+from src.services.llm_scheduler import set_llm_caller
 
 SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 1 week
+# Embed the user profile in access tokens so a cache miss needs no DB lookup.
+# The claims are only trusted for AUTH_USER_CACHE_TTL after the token was
+# issued, so edits and deletes reach every instance as fast as via the cache.
+AUTH_PROFILE_CLAIMS = os.getenv("AUTH_PROFILE_CLAIMS", "false").lower() == "true"
 
 security = HTTPBearer()
 
 
-def create_access_token(user_id: str) -> str:
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode = {"sub": user_id, "exp": expire}
+def create_access_token(user_id: str, user=None) -> str:
+    now = datetime.utcnow()
+    expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode = {"sub": user_id, "exp": expire, "iat": now}
+    if AUTH_PROFILE_CLAIMS and user is not None:
+        to_encode["profile"] = AuthenticatedUser.from_orm(user).to_claims()
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def decode_access_token(token: str) -> Optional[str]:
+def decode_token_payload(token: str) -> Optional[dict]:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload.get("sub")
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.PyJWTError:
         return None
 
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    print(f"🔐 Processing token: {token[:20]}...")
+def decode_access_token(token: str) -> Optional[str]:
+    payload = decode_token_payload(token)
+    return payload.get("sub") if payload else None
+
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_db),
+):
+    return await get_user_from_token(credentials.credentials, db)
+
 
+async def get_user_from_token(
+    token: str, db: Optional[AsyncSession] = None
+) -> AuthenticatedUser:
+    """Resolve a bearer token to the user, raising 401 if it is not valid.
+    Shared by the HTTP dependency (on the request session) and WebSocket
+    endpoints, which cannot send an Authorization header from the browser.
+    The user comes from the in-memory cache, then from the token's profile
+    claims, and only then from the database."""
     if not SECRET_KEY:
         print("❌ JWT_SECRET_KEY not set!")
         raise HTTPException(status_code=500, detail="Server configuration error")
 
-    user_id = decode_access_token(token)
-    print(f"👤 Decoded user_id: {user_id}")
-
+    payload = decode_token_payload(token)
+    user_id = payload.get("sub") if payload else None
     if not user_id:
         print("❌ Invalid or expired token")
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-    db = SessionLocal()
-    user = db.query(UserDB).filter_by(user_id=user_id).first()
-    db.close()
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await _load_user(user_id, payload, db)
+    # The request's LLM calls queue as this user (see services.llm_scheduler)
+    set_llm_caller(user.user_id, user.account_tier)
+    return user
+
+
+async def _load_user(
+    user_id: str, payload: dict, db: Optional[AsyncSession] = None
+) -> AuthenticatedUser:
+    """The user from the token's profile claims while they are fresh, else from the database."""
+    profile = payload.get("profile")
+    issued_at = payload.get("iat", 0)
+    age = time.time() - issued_at
+    if (
+        profile
+        and age < user_cache.ttl
+        and not user_cache.changed_since(user_id, issued_at)
+    ):
+        user = AuthenticatedUser.from_claims({**profile, "user_id": user_id})
+        # Cached no longer than the claims themselves are trusted
+        user_cache.put(user, ttl=user_cache.ttl - age)
+        return user
+
+    async with use_session(db) as db:
+        db_user = await db.get(UserDB, user_id)
 
-    if not user:
+    if not db_user:
         print(f"❌ User not found for user_id: {user_id}")
         raise HTTPException(status_code=401, detail="User not found")
 
-    print(f"✅ Authenticated user: {user.email}")
-    return user  # Return the actual User object
+    user = AuthenticatedUser.from_orm(db_user)
+    user_cache.put(user)
+    return user
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+# How long an authenticated user is served from memory, and how many are kept
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "300"))
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "1024"))
+
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """
+    Read-only snapshot of a users row, without the password hash. Has the same
+    attribute names as the ORM User, so routes use it the same way.
+    """
+
+    user_id: str
+    name: Optional[str] = None
+    email: Optional[str] = None
+    location: Optional[str] = None
+    location_name: Optional[str] = None
+    preferred_language: Optional[str] = None
+    crops_grown: Optional[str] = None  # comma-separated, as stored
+    user_type: Optional[str] = None
+    years_experience: Optional[int] = None
+    main_goal: Optional[str] = None
+    account_tier: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    @classmethod
+    def from_orm(cls, user) -> "AuthenticatedUser":
+        return cls(
+            user_id=user.user_id,
+            name=user.name,
+            email=user.email,
+            location=user.location,
+            location_name=user.location_name,
+            preferred_language=user.preferred_language,
+            crops_grown=user.crops_grown,
+            user_type=user.user_type,
+            years_experience=user.years_experience,
+            main_goal=user.main_goal,
+            account_tier=user.account_tier,
+            created_at=user.created_at,
+            updated_at=user.updated_at,
+        )
+
+    def to_claims(self) -> Dict[str, Any]:
+        """Profile as JSON-serialisable token claims."""
+        claims = asdict(self)
+        for field in ("created_at", "updated_at"):
+            if claims[field] is not None:
+                claims[field] = claims[field].isoformat()
+        return claims
+
+    @classmethod
+    def from_claims(cls, claims: Dict[str, Any]) -> "AuthenticatedUser":
+        values = {k: v for k, v in claims.items() if k in cls.__dataclass_fields__}
+        for field in ("created_at", "updated_at"):
+            if values.get(field):
+                values[field] = datetime.fromisoformat(values[field])
+        return cls(**values)
+
+
+class UserCache:
+    """
+    TTL + LRU cache of AuthenticatedUser keyed by user_id. Profile updates and
+    deletes invalidate the entry. The invalidation time is remembered so
+    profile claims in tokens issued before the change are not trusted by this
+    process; other processes stop trusting them after the TTL.
+    """
+
+    def __init__(
+        self, ttl: float = AUTH_USER_CACHE_TTL, maxsize: int = AUTH_USER_CACHE_SIZE
+    ):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._changed_at: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str) -> Optional[AuthenticatedUser]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user: AuthenticatedUser, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[user.user_id] = (user, time.monotonic() + ttl)
+            self._entries.move_to_end(user.user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._changed_at[user_id] = time.time()
+            self._changed_at.move_to_end(user_id)
+            while len(self._changed_at) > self.maxsize:
+                self._changed_at.popitem(last=False)
+
+    def changed_since(self, user_id: str, issued_at: float) -> bool:
+        """True if the user was updated or deleted after `issued_at` (epoch seconds)."""
+        with self._lock:
+            changed_at = self._changed_at.get(user_id)
+        return changed_at is not None and changed_at >= issued_at
+
+
+user_cache = UserCache()
@@ -1,4 +1,9 @@
-from sqlalchemy import create_engine
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from .chat_models import Base
 import os
@@ -6,16 +11,172 @@ import os
 # Get database URL from environment variable, fallback to SQLite for local development
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./chat.db")
 
-# Configure engine based on database type
+# Connection pool settings (PostgreSQL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",  # readers don't block the writer
+    "synchronous": "NORMAL",  # safe with WAL, fsync only at checkpoints
+    "busy_timeout": 5000,  # wait for the write lock instead of failing
+    "cache_size": -20000,  # 20 MB page cache
+    "temp_store": "MEMORY",
+}
+
+
+def _async_url(url: str):
+    """Map the configured URL to the asyncpg / aiosqlite driver."""
+    url = make_url(url)
+    if url.get_backend_name() == "postgresql":
+        # asyncpg takes ssl as a connect argument instead of sslmode
+        query = dict(url.query)
+        query.pop("sslmode", None)
+        return url.set(drivername="postgresql+asyncpg", query=query)
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    return url
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+# Configure engines based on database type
 if DATABASE_URL.startswith("postgresql"):
+    pool_options = dict(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
     # PostgreSQL configuration
-    engine = create_engine(DATABASE_URL)
+    engine = create_engine(DATABASE_URL, **pool_options)
+    sslmode = make_url(DATABASE_URL).query.get("sslmode")
+    async_connect_args = {"ssl": sslmode} if sslmode else {}
+    async_engine = create_async_engine(
+        _async_url(DATABASE_URL), connect_args=async_connect_args, **pool_options
+    )
     print("db initiallized with postgress")
 else:
     # SQLite configuration (for local development)
     engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    async_engine = create_async_engine(_async_url(DATABASE_URL))
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Objects stay usable after commit/close, like the detached rows routes use today
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
+
+@asynccontextmanager
+async def session_scope() -> AsyncIterator[AsyncSession]:
+    """
+    One unit of work: commits when the block exits cleanly, rolls back on error.
+    For code outside a request (WebSockets, background tasks, streaming bodies).
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    """
+    FastAPI dependency: one session per request, shared by auth, services and
+    cache helpers (FastAPI caches the dependency within a request) and
+    committed once after the handler returns.
+    """
+    async with session_scope() as db:
+        yield db
+
+
+async def release_session(db: AsyncSession):
+    """
+    Commit the request session and hand its connection back to the pool
+    before slow non-database work (LLM, upstream APIs), so waiting requests
+    don't hold a connection each. Write the results in a session_scope().
+    """
+    await db.commit()
+    await db.close()
+
+
+@asynccontextmanager
+async def use_session(db: Optional[AsyncSession] = None) -> AsyncIterator[AsyncSession]:
+    """
+    Run on the caller's session if one is passed (the caller commits), otherwise
+    in a unit of work of its own.
+    """
+    if db is not None:
+        yield db
+    else:
+        async with session_scope() as own:
+            yield own
+
+
+def _ensure_columns():
+    """
+    Add nullable columns that were added to a model after its table was
+    created (create_all never alters existing tables).
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                    )
+                )
+                print(f"Added column {table.name}.{column.name}")
+
+
+# Indexes superseded by one under a new name (e.g. made unique): old -> new
+REPLACED_INDEXES = {
+    "ix_jobs_user_id_idempotency_key": "ux_jobs_user_id_idempotency_key"
+}
+
+
+def init_db():
+    """Create tables if they don't exist. Called once from the app lifespan."""
+    Base.metadata.create_all(bind=engine)
+    _ensure_columns()
+    # create_all only adds indexes together with a new table, so create any
+    # index added since an existing database was set up
+    failed = set()
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except IntegrityError as e:
+                # Rows from before a unique index was added break it; it is
+                # created on a later start, once they have expired
+                print(f"Could not create index {index.name}: {e}")
+                failed.add(index.name)
+    with engine.begin() as connection:
+        for old, new in REPLACED_INDEXES.items():
+            if new not in failed:
+                connection.execute(text(f"DROP INDEX IF EXISTS {old}"))
+
 
-# Create tables if they don't exist
-Base.metadata.create_all(bind=engine)
+async def dispose_engines():
+    """Close pooled connections on shutdown."""
+    await async_engine.dispose()
+    engine.dispose()
@@ -1,4 +1,13 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Text, Integer
+from sqlalchemy import (
+    Column,
+    String,
+    DateTime,
+    ForeignKey,
+    Text,
+    Integer,
+    Index,
+    LargeBinary,
+)
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
@@ -14,7 +23,10 @@ class ChatSessionDB(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user_id = Column(String, nullable=True)
     messages = relationship(
-        "ChatMessageDB", back_populates="session", cascade="all, delete-orphan"
+        "ChatMessageDB",
+        back_populates="session",
+        cascade="all, delete-orphan",
+        order_by="ChatMessageDB.timestamp",
     )
 
 
@@ -27,6 +39,23 @@ class ChatMessageDB(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
     session = relationship("ChatSessionDB", back_populates="messages")
 
+    # History is always read as "latest N messages of a session"
+    __table_args__ = (
+        Index("ix_chat_messages_session_id_timestamp", "session_id", "timestamp"),
+    )
+
+
+class ChatSummaryDB(Base):
+    """Rolling summary of a session's older messages, kept next to chat_sessions."""
+
+    __tablename__ = "chat_summaries"
+    session_id = Column(
+        String, ForeignKey("chat_sessions.session_id"), primary_key=True
+    )
+    summary = Column(Text)
+    summarized_until = Column(DateTime)  # timestamp of the last folded message
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -34,16 +63,29 @@ class User(Base):
     name = Column(String)
     email = Column(String, unique=True)
     location = Column(String)
+    location_name = Column(String, nullable=True)  # place name resolved from location
     preferred_language = Column(String)
     crops_grown = Column(String)
     user_type = Column(String)  # aspiring, beginner, experienced, explorer
     years_experience = Column(Integer, nullable=True)
     main_goal = Column(String, nullable=True)
+    # standard, premium, enterprise; weighs the user's share of LLM capacity
+    account_tier = Column(String, nullable=True)
     password_hash = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class GeocodeCache(Base):
+    """Reverse geocoding results, keyed by a rounded coordinate grid cell."""
+
+    __tablename__ = "geocode_cache"
+    grid_key = Column(String, primary_key=True)  # "lat,lon" rounded to the grid
+    place_name = Column(String, nullable=True)  # None: nothing found there
+    properties = Column(Text)  # JSON string of the provider's properties
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 class WeatherCache(Base):
     __tablename__ = "weather_cache"
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -67,3 +109,57 @@ class AITaskCache(Base):
     weather_context = Column(Text)  # JSON string of weather data used
     created_at = Column(DateTime, default=datetime.utcnow)
     expires_at = Column(DateTime)  # Cache expires after 24 hours
+
+
+class DiagnosisCache(Base):
+    """Crop diagnosis results keyed by perceptual hashes of the photo and location."""
+
+    __tablename__ = "diagnosis_cache"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    location_key = Column(String)  # rounded "lat,lon", "" when unknown
+    phash = Column(String)  # 64-bit hashes of the normalized image, hex
+    dhash = Column(String)
+    result_data = Column(Text)  # JSON of the diagnosis_flow result
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime)
+
+    __table_args__ = (
+        Index(
+            "ix_diagnosis_cache_location_key_expires_at", "location_key", "expires_at"
+        ),
+    )
+
+
+class JobDB(Base):
+    """A queued diagnosis or recommendation run, polled by the client (see services.job_queue)."""
+
+    __tablename__ = "jobs"
+    job_id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey("users.user_id"))
+    job_type = Column(String)  # diagnosis, recommend_crops, recommend_fertilizer
+    account_tier = Column(String, nullable=True)  # submitter's, for LLM fair share
+    status = Column(String, default="queued")  # queued, running, succeeded, failed
+    idempotency_key = Column(String, nullable=True)  # client's retry key
+    params = Column(Text)  # JSON arguments of the flow
+    payload = Column(LargeBinary, nullable=True)  # image, cleared once finished
+    result_data = Column(Text, nullable=True)  # JSON result of the flow
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_jobs_job_type_status_created_at", "job_type", "status", "created_at"),
+        # A retried submission racing the first can't insert a second job
+        Index(
+            "ux_jobs_user_id_idempotency_key",
+            "user_id",
+            "idempotency_key",
+            unique=True,
+            postgresql_where=idempotency_key.isnot(None),
+            sqlite_where=idempotency_key.isnot(None),
+        ),
+        Index("ix_jobs_expires_at", "expires_at"),
+    )
@@ -1,13 +1,19 @@
 from dotenv import load_dotenv
 import os
-import tempfile
-from PIL import Image
 import httpx
 import asyncio
 import time
+from src.ext_apis.provider_registry import PROVIDER_TIMEOUT, provider_registry
+from src.ext_apis.rate_limiter import BATCH, priority
 
 load_dotenv()
 
+# Requests in flight per provider when diagnosing a batch of images
+BATCH_PROVIDER_CONCURRENCY = int(os.getenv("BATCH_PROVIDER_CONCURRENCY", "4"))
+# Seconds each image of a batch may spend on its provider calls, counted from
+# when it is sent rather than from the start of the batch
+BATCH_ITEM_BUDGET = float(os.getenv("BATCH_ITEM_BUDGET", "25"))
+
 def simplify_prediction_result(prediction: dict) -> dict:
     kindwise = prediction.get("kindwise_result", {})
     openepi_raw = prediction.get("openEPI_result", {})
@@ -90,25 +96,12 @@ def simplify_prediction_result(prediction: dict) -> dict:
 
 
 
-def ensure_min_resolution(image_path: str) -> str:
-    MIN_SIZE = 200
-    MAX_SIZE = 2000
-    with Image.open(image_path) as img:
-        width, height = img.size
-        if width >= MIN_SIZE and height >= MIN_SIZE:
-            return image_path
-        scale = MIN_SIZE / min(width, height)
-        new_width = int(width * scale)
-        new_height = int(height * scale)
-        if new_width > MAX_SIZE or new_height > MAX_SIZE:
-            scale = min(MAX_SIZE / new_width, MAX_SIZE / new_height)
-            new_width = int(new_width * scale)
-            new_height = int(new_height * scale)
-        resized_img = img.resize((new_width, new_height), Image.LANCZOS)
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg")
-        resized_img.save(temp_file.name, format="JPEG")
-        temp_file.close()
-        return temp_file.name
+def http_status(response) -> dict:
+    """Status (and Retry-After) of a failed provider response, for provider_registry."""
+    status = {"status": response.status_code}
+    if response.headers.get("Retry-After", "").isdigit():
+        status["retry_after"] = int(response.headers["Retry-After"])
+    return status
 
 
 async def async_openEPI_api(client, image_data, model_type="binary"):
@@ -121,7 +114,7 @@ async def async_openEPI_api(client, image_data, model_type="binary"):
         return {"api": "openEPI", "result": response.json()}
     except httpx.HTTPStatusError as e:
         print(f"HTTP error occurred: {e}")
-        return {"api": "openEPI", "error": str(e), "details": e.response.text}
+        return {"api": "openEPI", "error": str(e), "details": e.response.text, **http_status(e.response)}
     except httpx.RequestError as e:
         print(f"Network error occurred: {e}")
         return {"api": "openEPI", "error": "Network error", "details": str(e)}
@@ -131,11 +124,11 @@ async def async_openEPI_api(client, image_data, model_type="binary"):
 
 
 
-async def async_kindwise_api(client, image_path, image_data, latitude=49.5, longitude=45, similar_images=True):
+async def async_kindwise_api(client, image_data, latitude=49.5, longitude=45, similar_images=True):
     url = "https://crop.kindwise.com/api/v1/identification"
     headers = {"Api-Key": os.getenv("KINDWISE_API_KEY")}
     form_data = {"latitude": str(latitude), "longitude": str(longitude), "similar_images": str(similar_images).lower()}
-    files = {"images": (image_path, image_data, "image/jpeg")}
+    files = {"images": ("image.jpg", image_data, "image/jpeg")}
     try:
         response = await client.post(url, headers=headers, data=form_data, files=files)
         response.raise_for_status()
@@ -145,7 +138,7 @@ async def async_kindwise_api(client, image_path, image_data, latitude=49.5, long
         return {"api": "kindwise", "result": result}
     except httpx.HTTPStatusError as e:
         print(f"HTTP error occurred: {e}")
-        return {"api": "kindwise", "error": str(e), "details": e.response.text}
+        return {"api": "kindwise", "error": str(e), "details": e.response.text, **http_status(e.response)}
     except httpx.RequestError as e:
         print(f"Network error occurred: {e}")
         return {"api": "kindwise", "error": "Network error", "details": str(e)}
@@ -155,97 +148,158 @@ async def async_kindwise_api(client, image_path, image_data, latitude=49.5, long
     
     
 
-async def async_deepl_analyze_leaf(client, image_path, lat, lon, language="en"):
-    valid_image_path = ensure_min_resolution(image_path)
+async def async_deepl_analyze_leaf(client, image_data, lat, lon, language="en"):
     params = {"api_key": os.getenv("DEEPL_API_KEY"), "language": language, "lat": lat, "lon": lon}
     try:
-        with open(valid_image_path, "rb") as img_file:
-            files = {"image": (valid_image_path, img_file, "image/jpeg")}
-            response = await client.post("https://api.deepleaf.io/analyze", params=params, files=files)
+        files = {"image": ("image.jpg", image_data, "image/jpeg")}
+        response = await client.post("https://api.deepleaf.io/analyze", params=params, files=files)
         if response.status_code != 200:
-            return {"api": "deepl", "error": f"Request failed: {response.status_code}", "details": response.text}
+            return {"api": "deepl", "error": f"Request failed: {response.status_code}", "details": response.text, **http_status(response)}
         return {"api": "deepl", "result": response.json()}
-    except FileNotFoundError:
-        return {"api": "deepl", "error": "Image file not found"}
     except httpx.HTTPStatusError as e:
-        return {"api": "deepl", "error": str(e), "details": e.response.text}
+        return {"api": "deepl", "error": str(e), "details": e.response.text, **http_status(e.response)}
     except httpx.RequestError as e:
         return {"api": "deepl", "error": "Network error", "details": str(e)}
     except Exception as e:
         return {"api": "deepl", "error": "Unexpected error", "details": str(e)}
-    finally:
-        if valid_image_path != image_path:
-            try:
-                os.remove(valid_image_path)
-            except Exception:
-                pass
 
 
 
-async def predict_crop_health(image_path: str, model_type: str = "binary", latitude: float = 49.5, longitude: float = 45, similar_images: bool = True) -> dict:
-    try:
-        with open(image_path, "rb") as f:
-            image_data = f.read()
-    except FileNotFoundError:
-        raise RuntimeError("Image file not found")
-    
-    
+def provider_calls(client, image_data, model_type="binary", latitude=49.5, longitude=45, similar_images=True, deadline=None) -> list:
+    """
+    One call per provider, each through provider_registry: skipped while the
+    provider's breaker is open, bounded by the time left until `deadline`
+    (time.monotonic(), None for PROVIDER_TIMEOUT per call).
+    """
+    return [
+        provider_registry.call("openEPI", lambda: async_openEPI_api(client, image_data, model_type), deadline),
+        provider_registry.call("kindwise", lambda: async_kindwise_api(client, image_data, latitude, longitude, similar_images), deadline),
+        provider_registry.call("deepl", lambda: async_deepl_analyze_leaf(client, image_data, latitude, longitude), deadline)
+    ]
+
+
+def combine_provider_results(results: list) -> dict:
+    """
+    Simplified combined result of the three providers, with "unavailable"
+    listing the ones that failed, were skipped or timed out (if any). Raises
+    RuntimeError if both Kindwise and DeepLeaf failed.
+    """
+    # Extract results and check for errors
+    openEPI_result = {}
+    kindwise_result = {}
+    deepl_result = {}
+    kindwise_failed = False
+    deepl_failed = False
+    unavailable = []
+
+    for result in results:
+        if "error" in result:
+            unavailable.append(PROVIDER_KEYS[result["api"]][1])
+        if result["api"] == "openEPI":
+            openEPI_result = result.get("result", {})
+            if "error" in result:
+                print(f"[OpenEPI Failed] {result['error']}: {result.get('details', '')}")
+        elif result["api"] == "kindwise":
+            kindwise_result = result.get("result", {})
+            if "error" in result:
+                kindwise_failed = True
+                print(f"[Kindwise Failed] {result['error']}: {result.get('details', '')}")
+        elif result["api"] == "deepl":
+            deepl_result = result.get("result", {})
+            if "error" in result:
+                deepl_failed = True
+                print(f"[DeepLeaf Failed] {result['error']}: {result.get('details', '')}")
+
+    if kindwise_failed and deepl_failed:
+        raise RuntimeError("Both Kindwise and DeepLeaf APIs failed. Unable to analyze crop health.")
+
+    combined = simplify_prediction_result({
+        "kindwise_result": kindwise_result,
+        "openEPI_result": openEPI_result,
+        "deepl_result": deepl_result
+    })
+    if unavailable:
+        combined["unavailable"] = sorted(unavailable)
+    return combined
+
+
+# Provider name in raw results -> (key for simplify_prediction_result, key in its output)
+PROVIDER_KEYS = {
+    "openEPI": ("openEPI_result", "openepi"),
+    "kindwise": ("kindwise_result", "kindwise"),
+    "deepl": ("deepl_result", "deepl"),
+}
+
+
+def simplify_provider_result(result: dict) -> tuple:
+    """(provider key, simplified section) for one provider's raw result."""
+    raw_key, key = PROVIDER_KEYS[result["api"]]
+    return key, simplify_prediction_result({raw_key: result.get("result", {})})[key]
+
+
+async def predict_crop_health(image_data: bytes, model_type: str = "binary", latitude: float = 49.5, longitude: float = 45, similar_images: bool = True, deadline: float = None) -> dict:
+    """
+    Send one JPEG buffer (see services.image_service.normalize_image) to
+    OpenEPI, Kindwise and DeepLeaf concurrently and combine their results.
+    """
     begin_time = time.time()
 
-    async with httpx.AsyncClient() as client:
+    # Calls are bounded by provider_registry, not httpx's 5 s default
+    async with httpx.AsyncClient(timeout=PROVIDER_TIMEOUT) as client:
+        tasks = provider_calls(client, image_data, model_type, latitude, longitude, similar_images, deadline)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    ans = combine_provider_results(results)
+    print("total time it takes",  time.time() - begin_time)
+    return ans
+
+
+async def stream_crop_health(image_data: bytes, model_type: str = "binary", latitude: float = 49.5, longitude: float = 45, similar_images: bool = True, deadline: float = None):
+    """
+    Like predict_crop_health, but yields each provider's raw result
+    ({"api": ..., "result" or "error": ...}) as soon as it arrives.
+    """
+    async with httpx.AsyncClient(timeout=PROVIDER_TIMEOUT) as client:
         tasks = [
-            async_openEPI_api(client, image_data, model_type),
-            async_kindwise_api(client, image_path, image_data, latitude, longitude, similar_images),
-            async_deepl_analyze_leaf(client, image_path, latitude, longitude)
+            asyncio.create_task(call)
+            for call in provider_calls(client, image_data, model_type, latitude, longitude, similar_images, deadline)
         ]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            # The consumer may stop early; don't leave requests running
+            for task in tasks:
+                task.cancel()
 
-        # Extract results and check for errors
-        openEPI_result = {}
-        kindwise_result = {}
-        deepl_result = {}
-        kindwise_failed = False
-        deepl_failed = False
-
-        for result in results:
-            if result["api"] == "openEPI":
-                openEPI_result = result.get("result", {})
-                if "error" in result:
-                    print(f"[OpenEPI Failed] {result['error']}: {result.get('details', '')}")
-            elif result["api"] == "kindwise":
-                kindwise_result = result.get("result", {})
-                if "error" in result:
-                    kindwise_failed = True
-                    print(f"[Kindwise Failed] {result['error']}: {result.get('details', '')}")
-            elif result["api"] == "deepl":
-                deepl_result = result.get("result", {})
-                if "error" in result:
-                    deepl_failed = True
-                    print(f"[DeepLeaf Failed] {result['error']}: {result.get('details', '')}")
-
-        if kindwise_failed and deepl_failed:
-            raise RuntimeError("Both Kindwise and DeepLeaf APIs failed. Unable to analyze crop health.")
-
-
-        # print("before ------------------")
-        
-        # print(deepl_result)
-        
-        ans = simplify_prediction_result({
-            "kindwise_result": kindwise_result,
-            "openEPI_result": openEPI_result,
-            "deepl_result": deepl_result
-        })
-        
-        
-        print("total time it takes",  time.time() - begin_time)
-        # print()
-        # print()
-        
-        # print("after ------------------")
-        # print()
-        # print(ans["deepl"])
 
-        return ans
+async def predict_crop_health_batch(images: list, model_type: str = "binary", latitude: float = 49.5, longitude: float = 45, similar_images: bool = True, concurrency: int = BATCH_PROVIDER_CONCURRENCY, item_budget: float = BATCH_ITEM_BUDGET):
+    """
+    predict_crop_health for several JPEG buffers over one client, with at most
+    `concurrency` images (so requests per provider) in flight, each given
+    `item_budget` seconds once sent. Yields (index, combined result) as each
+    image completes; the result is the RuntimeError instead if both Kindwise
+    and DeepLeaf failed for that image.
+    """
+    slots = asyncio.Semaphore(concurrency)
 
+    async def diagnose(index, image_data):
+        async with slots:
+            deadline = time.monotonic() + item_budget
+            calls = provider_calls(client, image_data, model_type, latitude, longitude, similar_images, deadline)
+            # Rate-limited providers serve interactive diagnoses first
+            with priority(BATCH):
+                results = await asyncio.gather(*calls)
+        try:
+            return index, combine_provider_results(results)
+        except RuntimeError as e:
+            return index, e
 
+    async with httpx.AsyncClient(timeout=PROVIDER_TIMEOUT) as client:
+        tasks = [asyncio.create_task(diagnose(index, image_data)) for index, image_data in enumerate(images)]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            for task in tasks:
+                task.cancel()
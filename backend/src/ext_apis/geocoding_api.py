@@ -0,0 +1,38 @@
+import os
+from typing import Optional
+from dotenv import load_dotenv
+from src.ext_apis.resilience import upstream
+
+load_dotenv()
+
+PHOTON_URL = os.getenv("PHOTON_URL", "https://photon.komoot.io/reverse")
+# Seconds before a reverse geocoding request is given up
+GEOCODE_TIMEOUT = float(os.getenv("GEOCODE_TIMEOUT", "5"))
+
+photon = upstream("photon", timeout=GEOCODE_TIMEOUT)
+
+
+async def photon_reverse(lat: float, lon: float) -> Optional[dict]:
+    """
+    Properties of the nearest place to the coordinates from the Photon API,
+    or None if Photon found nothing there. Raises on network/HTTP errors.
+    """
+    params = {"lat": lat, "lon": lon}
+    response = await photon.get(PHOTON_URL, params=params)
+    response.raise_for_status()
+    features = response.json().get("features") or []
+    return features[0].get("properties", {}) if features else None
+
+
+def format_place_name(properties: dict) -> Optional[str]:
+    """Readable "city, district, country" from Photon properties."""
+    location_parts = []
+    if properties.get("city"):
+        location_parts.append(properties["city"])
+    elif properties.get("name"):
+        location_parts.append(properties["name"])
+    if properties.get("district"):
+        location_parts.append(properties["district"])
+    if properties.get("country"):
+        location_parts.append(properties["country"])
+    return ", ".join(location_parts) if location_parts else None
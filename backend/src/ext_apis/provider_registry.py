@@ -0,0 +1,220 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+from dotenv import load_dotenv
+from src.ext_apis.rate_limiter import RATE_LIMIT_PAUSE, RateLimited, rate_limiter
+from src.ext_apis.resilience import CircuitBreaker, current_deadline
+
+load_dotenv()
+
+# Longest a single crop-health provider call may take, whatever the budget
+PROVIDER_TIMEOUT = float(os.getenv("PROVIDER_TIMEOUT", "20"))
+# Recent calls per provider the latency percentiles and error rate cover
+PROVIDER_WINDOW = int(os.getenv("PROVIDER_WINDOW", "100"))
+# Calls needed before the percentiles are used for skipping and hedging
+PROVIDER_MIN_SAMPLES = int(os.getenv("PROVIDER_MIN_SAMPLES", "10"))
+# Consecutive failures that open a provider's breaker, and for how long
+PROVIDER_BREAKER_FAILURES = int(os.getenv("PROVIDER_BREAKER_FAILURES", "5"))
+PROVIDER_BREAKER_COOLDOWN = float(os.getenv("PROVIDER_BREAKER_COOLDOWN", "30"))
+# Providers that get a second, hedged request when the first is slower than
+# their p95 latency. Only free ones by default: a hedge can double the bill.
+PROVIDER_HEDGE = os.getenv("PROVIDER_HEDGE", "openEPI")
+
+
+class ProviderStats:
+    """Rolling latency and outcome window of one provider, plus its breaker."""
+
+    def __init__(self, name: str, hedge: bool = False):
+        self.name = name
+        self.hedge = hedge
+        self.breaker = CircuitBreaker(
+            PROVIDER_BREAKER_FAILURES, PROVIDER_BREAKER_COOLDOWN
+        )
+        self.samples = deque(maxlen=PROVIDER_WINDOW)  # (seconds, ok)
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.skipped_open = 0
+        self.skipped_budget = 0
+        self.skipped_rate = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def record(self, seconds: float, ok: bool):
+        self.samples.append((seconds, ok))
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+        self.breaker.record(ok)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Latency percentile of successful calls in the window, in seconds."""
+        latencies = sorted(seconds for seconds, ok in self.samples if ok)
+        if len(latencies) < PROVIDER_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(not ok for _, ok in self.samples) / len(self.samples)
+
+    def metrics(self) -> dict:
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "breaker": self.breaker.state,
+            "breaker_opened": self.breaker.opened,
+            "p50_ms": round(p50 * 1000) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000) if p95 is not None else None,
+            "error_rate": round(self.error_rate(), 4),
+            "window": len(self.samples),
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "skipped_open": self.skipped_open,
+            "skipped_budget": self.skipped_budget,
+            "skipped_rate": self.skipped_rate,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+class ProviderRegistry:
+    """
+    Wraps every crop-health provider call: skips providers whose breaker is
+    open or that typically answer slower than the request has left, queues
+    calls to rate-limited providers (see ext_apis.rate_limiter), bounds each
+    call by the remaining budget, hedges slow calls to providers listed in
+    PROVIDER_HEDGE, and records latency and errors for those decisions.
+    """
+
+    def __init__(self, timeout: float = PROVIDER_TIMEOUT, hedge: str = PROVIDER_HEDGE):
+        self.timeout = timeout
+        self.hedge = {name.strip() for name in hedge.split(",") if name.strip()}
+        self.providers: Dict[str, ProviderStats] = {}
+
+    def stats(self, name: str) -> ProviderStats:
+        if name not in self.providers:
+            self.providers[name] = ProviderStats(name, hedge=name in self.hedge)
+        return self.providers[name]
+
+    async def call(
+        self,
+        name: str,
+        make_call: Callable[[], Awaitable[dict]],
+        deadline: Optional[float] = None,
+    ) -> dict:
+        """
+        Run `make_call()` (a provider function returning {"api": ..., "result"
+        or "error": ...}) within the budget left until `deadline`
+        (time.monotonic()) or the request deadline, whichever is sooner.
+        Skipped and timed-out calls return an error result.
+        """
+        provider = self.stats(name)
+        remaining = self.timeout
+        request_deadline = current_deadline()
+        if request_deadline is not None:
+            deadline = min(deadline or request_deadline, request_deadline)
+        if deadline is not None:
+            remaining = min(remaining, deadline - time.monotonic())
+        p50 = provider.percentile(50)
+        if remaining <= 0 or (p50 is not None and remaining < p50):
+            provider.skipped_budget += 1
+            return {
+                "api": name,
+                "error": "Skipped",
+                "details": f"{max(remaining, 0):.1f}s left, provider usually needs longer",
+            }
+        if not provider.breaker.allow():
+            provider.skipped_open += 1
+            return {
+                "api": name,
+                "error": "Skipped",
+                "details": "Provider is failing, circuit breaker open",
+            }
+        limiter = rate_limiter(name)
+        if limiter is not None:
+            # Queued behind higher-priority callers of the same credential
+            try:
+                await limiter.acquire(deadline=deadline)
+            except RateLimited as e:
+                provider.breaker.trial_running = False
+                provider.skipped_rate += 1
+                return {"api": name, "error": "Skipped", "details": str(e)}
+            except asyncio.CancelledError:
+                provider.breaker.trial_running = False
+                raise
+            if deadline is not None:
+                remaining = min(remaining, deadline - time.monotonic())
+                if remaining <= 0:
+                    provider.breaker.trial_running = False
+                    provider.skipped_rate += 1
+                    return {
+                        "api": name,
+                        "error": "Skipped",
+                        "details": "No time left after waiting for the rate limit",
+                    }
+
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(
+                self._hedged(provider, make_call), remaining
+            )
+        except asyncio.TimeoutError:
+            provider.timeouts += 1
+            result = {
+                "api": name,
+                "error": "Timed out",
+                "details": f"No answer within {remaining:.1f}s",
+            }
+        except asyncio.CancelledError:
+            # The caller gave up; this says nothing about the provider
+            provider.breaker.trial_running = False
+            raise
+        except Exception as e:
+            # Provider functions return errors as results; this is a bug or
+            # an error they don't handle, counted against the provider
+            print(f"{name} call raised {e!r}")
+            result = {"api": name, "error": "Unexpected error", "details": str(e)}
+        provider.record(time.monotonic() - started, "error" not in result)
+        if limiter is not None and result.get("status") == 429:
+            limiter.pause(result.get("retry_after", RATE_LIMIT_PAUSE))
+        return result
+
+    async def _hedged(
+        self, provider: ProviderStats, make_call: Callable[[], Awaitable[dict]]
+    ) -> dict:
+        delay = provider.percentile(95) if provider.hedge else None
+        first = asyncio.ensure_future(make_call())
+        if delay is None:
+            return await first
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                limiter = rate_limiter(provider.name)
+                if limiter is not None and not limiter.try_acquire():
+                    # A hedge never queues for a token ahead of real calls
+                    return await first
+                provider.hedged += 1
+                tasks.append(asyncio.ensure_future(make_call()))
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                if first not in done:
+                    provider.hedge_wins += 1
+            return done.pop().result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def metrics(self) -> dict:
+        return {
+            "timeout_seconds": self.timeout,
+            "providers": {
+                name: provider.metrics() for name, provider in self.providers.items()
+            },
+        }
+
+
+provider_registry = ProviderRegistry()
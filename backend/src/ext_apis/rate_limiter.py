@@ -0,0 +1,316 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+from dotenv import load_dotenv
+from src.ext_apis.resilience import current_deadline
+
+load_dotenv()
+
+# Requests per second and burst of each paid upstream credential, as
+# "name:rate/burst,..."; upstreams not listed are not limited
+UPSTREAM_RATE_LIMITS = os.getenv(
+    "UPSTREAM_RATE_LIMITS",
+    "kindwise:5/10,deepl:5/10,gemini:25/50,google_translate:50/100",
+)
+# Refuse a call at once (instead of queueing it) when its expected wait in
+# the queue would run past the caller's deadline
+RATE_LIMIT_FAIL_FAST = os.getenv("RATE_LIMIT_FAIL_FAST", "true").lower() != "false"
+# Seconds an upstream gets no calls after answering 429 without Retry-After
+RATE_LIMIT_PAUSE = float(os.getenv("RATE_LIMIT_PAUSE", "5"))
+
+# Queue priorities, lowest first: what a user waits on goes ahead of
+# background work, which goes ahead of batch jobs
+INTERACTIVE = 0
+BACKGROUND = 1
+BATCH = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background", BATCH: "batch"}
+
+_priority: ContextVar[int] = ContextVar("upstream_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int) -> Iterator[int]:
+    """Queue the upstream calls made in the block (and tasks it creates) at `level`."""
+    token = _priority.set(level)
+    try:
+        yield level
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def parse_rate_limits(spec: str) -> Dict[str, tuple]:
+    limits = {}
+    for item in spec.split(","):
+        name, _, limit = item.partition(":")
+        if not name.strip() or not limit.strip():
+            continue
+        rate, _, burst = limit.partition("/")
+        limits[name.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class RateLimited(RuntimeError):
+    """A call was refused: its queue wait would run past the caller's deadline."""
+
+    def __init__(self, name: str, wait: float):
+        self.name = name
+        self.wait = wait
+        super().__init__(f"{name} rate limit: about {wait:.1f}s queue wait")
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "granted", "loop", "future", "event")
+
+    def __init__(self, priority: int, seq: int):
+        self.priority = priority
+        self.seq = seq
+        self.granted = False
+        self.loop = None
+        self.future = None
+        self.event = None
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self):
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        if self.event is not None:
+            self.event.set()
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class RateLimiter:
+    """
+    Token bucket of one upstream credential with a priority queue in front.
+    A call takes a token at once when none is queued; otherwise it queues
+    by priority (then arrival) and is granted the next free token in that
+    order. Async callers await acquire(), code running in a worker thread
+    calls acquire_sync(). A sync caller on the event loop thread can't wait
+    without stalling the server, so it takes its token on credit: the bucket
+    goes negative and queued calls wait longer instead.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: float,
+        fail_fast: bool = RATE_LIMIT_FAIL_FAST,
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.fail_fast = fail_fast
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self.granted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.on_credit = 0
+        self.paused = 0  # times an upstream 429 paused the bucket
+        self.waited = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _dispatch(self):
+        """Hand free tokens to queued callers in priority order. Holds the lock."""
+        self._refill()
+        while self._waiters and self.tokens >= 1:
+            waiter = heapq.heappop(self._waiters)
+            self.tokens -= 1
+            waiter.granted = True
+            waiter.wake()
+
+    def _next_token_in(self) -> float:
+        return max((1 - self.tokens) / self.rate, 0.001)
+
+    def _enqueue(self, level: int, deadline: Optional[float]) -> Optional[_Waiter]:
+        """None when a token was taken at once, else the queued waiter."""
+        with self._lock:
+            self._refill()
+            if not self._waiters and self.tokens >= 1:
+                self.tokens -= 1
+                self.granted += 1
+                return None
+            ahead = sum(1 for waiter in self._waiters if waiter.priority <= level)
+            wait = (ahead + 1 - self.tokens) / self.rate
+            if (
+                self.fail_fast
+                and deadline is not None
+                and time.monotonic() + wait > deadline
+            ):
+                self.rejected += 1
+                raise RateLimited(self.name, wait)
+            waiter = _Waiter(level, next(self._seq))
+            heapq.heappush(self._waiters, waiter)
+            self.queued += 1
+            return waiter
+
+    def _poll(self, waiter: _Waiter) -> float:
+        """0 once the waiter holds a token, else seconds until the next one."""
+        with self._lock:
+            self._dispatch()
+            return 0 if waiter.granted else self._next_token_in()
+
+    def _leave(self, waiter: _Waiter):
+        """A queued caller gave up; pass on a token it was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                self.tokens += 1
+            else:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+            self._dispatch()
+
+    def _record(self, waited: float):
+        with self._lock:
+            self.granted += 1
+            self.waited += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is free and nobody is queued for it."""
+        with self._lock:
+            self._refill()
+            if self._waiters or self.tokens < 1:
+                return False
+            self.tokens -= 1
+            self.granted += 1
+            return True
+
+    async def acquire(
+        self, level: Optional[int] = None, deadline: Optional[float] = None
+    ):
+        """
+        Wait for a token at `level` (default: the current priority). Raises
+        RateLimited when failing fast and the wait would pass `deadline`
+        (default: the request deadline).
+        """
+        level = current_priority() if level is None else level
+        deadline = current_deadline() if deadline is None else deadline
+        started = time.monotonic()
+        waiter = self._enqueue(level, deadline)
+        if waiter is None:
+            return
+        waiter.loop = asyncio.get_running_loop()
+        try:
+            while True:
+                waiter.future = waiter.loop.create_future()
+                wait = self._poll(waiter)
+                if wait == 0:
+                    break
+                try:
+                    await asyncio.wait_for(waiter.future, wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._leave(waiter)
+            raise
+        self._record(time.monotonic() - started)
+
+    def acquire_sync(
+        self, level: Optional[int] = None, deadline: Optional[float] = None
+    ):
+        """acquire() for blocking code; on the event loop thread it never waits."""
+        level = current_priority() if level is None else level
+        deadline = current_deadline() if deadline is None else deadline
+        if _on_event_loop():
+            with self._lock:
+                self._refill()
+                if self.tokens < 1:
+                    self.on_credit += 1
+                self.tokens -= 1
+                self.granted += 1
+            return
+        started = time.monotonic()
+        waiter = self._enqueue(level, deadline)
+        if waiter is None:
+            return
+        waiter.event = threading.Event()
+        try:
+            while True:
+                wait = self._poll(waiter)
+                if wait == 0:
+                    break
+                waiter.event.wait(wait)
+                waiter.event.clear()
+        except BaseException:
+            self._leave(waiter)
+            raise
+        self._record(time.monotonic() - started)
+
+    def pause(self, seconds: float = RATE_LIMIT_PAUSE):
+        """The upstream answered 429: grant nothing for `seconds`."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+            self.paused += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            self._refill()
+            waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+            for waiter in self._waiters:
+                waiting[PRIORITY_NAMES.get(waiter.priority, str(waiter.priority))] += 1
+            return {
+                "rate_per_second": self.rate,
+                "burst": self.burst,
+                "tokens": round(self.tokens, 2),
+                "waiting": waiting,
+                "granted": self.granted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "on_credit": self.on_credit,
+                "paused": self.paused,
+                "avg_wait_ms": (
+                    round(self.wait_total / self.waited * 1000) if self.waited else 0
+                ),
+                "max_wait_ms": round(self.wait_max * 1000),
+            }
+
+
+rate_limiters: Dict[str, RateLimiter] = {
+    name: RateLimiter(name, rate, burst)
+    for name, (rate, burst) in parse_rate_limits(UPSTREAM_RATE_LIMITS).items()
+}
+
+
+def rate_limiter(name: str) -> Optional[RateLimiter]:
+    """The limiter of an upstream credential, None if it is not limited."""
+    return rate_limiters.get(name)
+
+
+def rate_limit_metrics() -> dict:
+    return {name: limiter.metrics() for name, limiter in rate_limiters.items()}
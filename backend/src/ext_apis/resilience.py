@@ -0,0 +1,221 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Default budget of a request for all the upstream calls it makes
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "30"))
+# Consecutive failures that open an upstream's breaker, and for how long
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_COOLDOWN = float(os.getenv("UPSTREAM_BREAKER_COOLDOWN", "30"))
+# Extra attempts for idempotent GETs after a network error, 429 or 5xx, with
+# full-jitter exponential backoff starting at UPSTREAM_RETRY_BACKOFF seconds
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.25"))
+
+# time.monotonic() by which the current request must be done, if any
+_deadline: ContextVar[Optional[float]] = ContextVar("upstream_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[float]:
+    """
+    Give the code in the block, and every upstream call it makes (tasks it
+    creates included), at most `seconds`. Never extends an outer deadline.
+    """
+    current = _deadline.get()
+    new = time.monotonic() + seconds
+    if current is not None:
+        new = min(new, current)
+    token = _deadline.set(new)
+    try:
+        yield new
+    finally:
+        _deadline.reset(token)
+
+
+def current_deadline() -> Optional[float]:
+    return _deadline.get()
+
+
+def remaining(default: float) -> float:
+    """Seconds left until the current deadline, capped at `default`."""
+    current = _deadline.get()
+    if current is None:
+        return default
+    return min(default, current - time.monotonic())
+
+
+class UpstreamUnavailable(RuntimeError):
+    """An upstream call was not made: its breaker is open or no time is left."""
+
+    def __init__(self, upstream: str, reason: str):
+        self.upstream = upstream
+        super().__init__(f"{upstream} unavailable: {reason}")
+
+
+class CircuitBreaker:
+    """
+    Closed: calls pass. After `failures` consecutive failures it opens and
+    rejects calls for `cooldown` seconds, then lets one trial call through
+    (half-open): success closes it again, failure reopens it.
+    """
+
+    def __init__(
+        self,
+        failures: int = UPSTREAM_BREAKER_FAILURES,
+        cooldown: float = UPSTREAM_BREAKER_COOLDOWN,
+    ):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+        self.opened = 0  # times the breaker opened
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record(self, ok: bool):
+        self.trial_running = False
+        if ok:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            return
+        self.consecutive_failures += 1
+        if self.opened_at is not None or self.consecutive_failures >= self.failures:
+            if self.opened_at is None:
+                self.opened += 1
+            self.opened_at = time.monotonic()
+
+
+def _retryable(response: httpx.Response) -> bool:
+    return response.status_code == 429 or response.status_code >= 500
+
+
+class Upstream:
+    """
+    One external API. request() fails fast with UpstreamUnavailable while the
+    breaker is open or the request deadline has passed, bounds every attempt
+    by the time left, and retries GETs (and only GETs) with jittered backoff.
+    Network errors, timeouts, 429 and 5xx count as failures for the breaker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        retries: int = UPSTREAM_RETRIES,
+        backoff: float = UPSTREAM_RETRY_BACKOFF,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker()
+        self.calls = 0
+        self.failures = 0
+        self.retried = 0
+        self.rejected = 0  # not sent: breaker open or deadline passed
+
+    def _check(self) -> float:
+        """Time for the next attempt, or UpstreamUnavailable."""
+        budget = remaining(self.timeout)
+        if budget <= 0:
+            self.rejected += 1
+            raise UpstreamUnavailable(self.name, "request deadline exceeded")
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise UpstreamUnavailable(self.name, "circuit breaker open")
+        return budget
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        attempts = 1 + (self.retries if method.upper() == "GET" else 0)
+        for attempt in range(attempts):
+            budget = self._check()
+            self.calls += 1
+            try:
+                async with httpx.AsyncClient(timeout=budget) as client:
+                    response = await client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                # Covers connect/read timeouts and network errors
+                self.failures += 1
+                self.breaker.record(False)
+                if attempt == attempts - 1:
+                    raise
+                print(f"{self.name} request failed ({e!r}), retrying")
+            except asyncio.CancelledError:
+                self.breaker.trial_running = False
+                raise
+            except Exception:
+                # Not retried (e.g. InvalidURL, TooManyRedirects), but it must
+                # still settle a half-open breaker's trial call
+                self.failures += 1
+                self.breaker.record(False)
+                raise
+            else:
+                failed = _retryable(response)
+                self.breaker.record(not failed)
+                if not failed or attempt == attempts - 1:
+                    if failed:
+                        self.failures += 1
+                    return response
+                self.failures += 1
+                print(f"{self.name} returned {response.status_code}, retrying")
+
+            delay = random.uniform(0, self.backoff * 2**attempt)
+            if remaining(self.timeout) <= delay:
+                raise UpstreamUnavailable(self.name, "no time left to retry")
+            self.retried += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def metrics(self) -> dict:
+        return {
+            "breaker": self.breaker.state,
+            "breaker_opened": self.breaker.opened,
+            "calls": self.calls,
+            "failures": self.failures,
+            "retried": self.retried,
+            "rejected": self.rejected,
+        }
+
+
+upstreams: Dict[str, Upstream] = {}
+
+
+def upstream(name: str, timeout: float, **kwargs) -> Upstream:
+    """The shared Upstream for `name`, created on first use."""
+    if name not in upstreams:
+        upstreams[name] = Upstream(name, timeout, **kwargs)
+    return upstreams[name]
+
+
+def upstream_metrics() -> dict:
+    return {name: u.metrics() for name, u in upstreams.items()}
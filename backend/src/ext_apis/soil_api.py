@@ -1,18 +1,21 @@
-import httpx
 import os
 from dotenv import load_dotenv
 import asyncio
+from src.ext_apis.resilience import upstream
 
 load_dotenv()
 
+openepi_soil = upstream("openepi_soil", timeout=20.0)
+isda_login = upstream("isda_login", timeout=10.0)
+isda = upstream("isda", timeout=10.0)
+
 
 async def openepi_soil_type(lat, lon, top_k=5):
     url = "https://api.openepi.io/soil/type"
     params = {"lat": lat, "lon": lon, "top_k": top_k}
-    async with httpx.AsyncClient(timeout=20.0) as client:
-        response = await client.get(url, params=params)
-        response.raise_for_status()
-        return response.json()
+    response = await openepi_soil.get(url, params=params)
+    response.raise_for_status()
+    return response.json()
 
 
 async def get_isda_access_token(username: str, password: str) -> str:
@@ -29,10 +32,9 @@ async def get_isda_access_token(username: str, password: str) -> str:
         "client_id": "string",
         "client_secret": "string",
     }
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        response = await client.post(url, headers=headers, data=data)
-        response.raise_for_status()
-        return response.json()["access_token"]
+    response = await isda_login.post(url, headers=headers, data=data)
+    response.raise_for_status()
+    return response.json()["access_token"]
 
 
 async def fetch_isda_soil_property(lat: float, lon: float, depth: str = "0-20") -> dict:
@@ -42,10 +44,9 @@ async def fetch_isda_soil_property(lat: float, lon: float, depth: str = "0-20")
     url = "https://api.isda-africa.com/isdasoil/v2/soilproperty"
     params = {"lat": lat, "lon": lon, "depth": depth}
     headers = {"accept": "application/json", "Authorization": f"Bearer {access_token}"}
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        response = await client.get(url, params=params, headers=headers)
-        response.raise_for_status()
-        return response.json()
+    response = await isda.get(url, params=params, headers=headers)
+    response.raise_for_status()
+    return response.json()
 
 
 def simplify_soil_response(soil_type: dict, isda_property: dict) -> dict:
@@ -97,5 +98,16 @@ async def get_soil_summary_async(
 ) -> dict:
     soil_type_task = openepi_soil_type(lat, lon, top_k)
     isda_property_task = fetch_isda_soil_property(lat, lon, depth)
-    soil_type, isda_property = await asyncio.gather(soil_type_task, isda_property_task)
+    soil_type, isda_property = await asyncio.gather(
+        soil_type_task, isda_property_task, return_exceptions=True
+    )
+    # One source is enough for a (partial) summary
+    if isinstance(soil_type, Exception) and isinstance(isda_property, Exception):
+        raise soil_type
+    if isinstance(soil_type, Exception):
+        print(f"OpenEPI soil type unavailable: {soil_type}")
+        soil_type = {}
+    if isinstance(isda_property, Exception):
+        print(f"iSDA soil properties unavailable: {isda_property}")
+        isda_property = {}
     return simplify_soil_response(soil_type, isda_property)
@@ -1,5 +1,7 @@
-import httpx
 from statistics import mean
+from src.ext_apis.resilience import upstream
+
+open_meteo = upstream("open_meteo", timeout=20.0)
 
 
 async def fetch_weather_summary(
@@ -26,19 +28,16 @@ async def fetch_weather_summary(
     print(f"Weather API request: {url}")
     print(f"Weather API params: {params}")
 
-    async with httpx.AsyncClient(timeout=20.0) as client:
-        response = await client.get(url, params=params)
-        print(f"Weather API response status: {response.status_code}")
+    response = await open_meteo.get(url, params=params)
+    print(f"Weather API response status: {response.status_code}")
 
-        if response.status_code != 200:
-            error_text = await response.text()
-            print(f"Weather API error response: {error_text}")
-            raise Exception(
-                f"OpenMeteo API error: {response.status_code} - {error_text}"
-            )
+    if response.status_code != 200:
+        error_text = response.text
+        print(f"Weather API error response: {error_text}")
+        raise Exception(f"OpenMeteo API error: {response.status_code} - {error_text}")
 
-        data = response.json()
-        print(f"Weather API response data keys: {list(data.keys())}")
+    data = response.json()
+    print(f"Weather API response data keys: {list(data.keys())}")
 
     # Extract daily data
     daily = data.get("daily", {})
@@ -1,24 +1,167 @@
-from src.services.llm_service import LLMService
-from src.ext_apis.crop_health_api import predict_crop_health
+from src.ext_apis.crop_health_api import (
+    combine_provider_results,
+    predict_crop_health,
+    predict_crop_health_batch,
+    simplify_provider_result,
+    stream_crop_health,
+)
+from src.ext_apis.rate_limiter import BATCH, priority
 from src.ext_apis.soil_api import get_soil_summary_async
 from src.ext_apis.weather_api import fetch_weather_summary, simplify_weather_response
 import asyncio
+import json
+import os
+import re
+import time
 from src.services.llm_service import llm_service
-from typing import Optional
+from src.services.image_service import (
+    ImageQualityError,
+    NormalizedImage,
+    normalize_image,
+)
+from src.services.diagnosis_cache import diagnosis_cache
+from src.services.prescreen_service import prescreen
+from typing import AsyncIterator, List, Optional, Set, Tuple
+
+# Providers whose results are enough to start the LLM synthesis in streaming
+# diagnosis: comma-separated groups that must all be met, "|" separates
+# alternatives within a group. Default: (Kindwise or DeepLeaf) and OpenEPI.
+DIAGNOSIS_QUORUM = os.getenv("DIAGNOSIS_QUORUM", "kindwise|deepl,openepi")
+# Seconds a single diagnosis may spend waiting for providers; each provider
+# call gets what is left of it (see ext_apis.provider_registry)
+DIAGNOSIS_BUDGET = float(os.getenv("DIAGNOSIS_BUDGET", "25"))
+# Most photos accepted in one field-scouting batch
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "50"))
+# Photos of a batch decoded and normalized at the same time
+BATCH_DECODE_CONCURRENCY = int(os.getenv("BATCH_DECODE_CONCURRENCY", "4"))
+
+
+def parse_quorum(spec: str) -> List[Set[str]]:
+    return [
+        {name.strip().lower() for name in group.split("|") if name.strip()}
+        for group in spec.split(",")
+        if group.strip()
+    ]
+
+
+def quorum_met(quorum: List[Set[str]], arrived: Set[str]) -> bool:
+    return all(group & arrived for group in quorum)
 
 
 async def diagnosis_flow(
-    image_path: str,
+    image_data: bytes,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
 ) -> dict:
     """
     Orchestrates the crop health diagnosis flow:
-    - Calls OpenEPI and Kindwise APIs with the given image.
+    - Normalizes the uploaded image once in memory (raises ValueError if it is
+      not an image).
+    - Reuses the result for a resent or near-identical photo from the same
+      area (see services.diagnosis_cache).
+    - Otherwise diagnoses it with diagnose_image.
+    """
+
+    image = await asyncio.to_thread(normalize_image, image_data)
+    return await cached_diagnosis(image, latitude, longitude)
+
+
+async def cached_diagnosis(
+    image: NormalizedImage,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+) -> dict:
+    """diagnose_image, reusing the result for a resent or near-identical photo."""
+    return await diagnosis_cache.get_or_run(
+        image,
+        latitude,
+        longitude,
+        lambda: diagnose_image(image, latitude, longitude),
+    )
+
+
+async def diagnose_image(
+    image: NormalizedImage,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+) -> dict:
+    """
+    - Answers clearly healthy leaves with the local pre-screen model, if one
+      is configured (see services.prescreen_service).
+    - Otherwise calls OpenEPI, Kindwise and DeepLeaf APIs with the same JPEG buffer.
     - Simplifies and combines the results.
     - Passes the results to the LLM for a human-readable, farmer-friendly insight.
     - Returns both the LLM's insight and the raw API results.
     """
+    healthy_probability = await prescreen.screen(image)
+    if healthy_probability is not None:
+        return prescreen_diagnosis(healthy_probability)
+
+    location = {}
+    if latitude is not None and longitude is not None:
+        location = {"latitude": latitude, "longitude": longitude}
+    combined_result = await predict_crop_health(
+        image.data, deadline=time.monotonic() + DIAGNOSIS_BUDGET, **location
+    )
+    return await asyncio.to_thread(synthesize_diagnosis, combined_result)
+
+
+def prescreen_diagnosis(healthy_probability: float) -> dict:
+    """Diagnosis for a leaf the local pre-screen model found clearly healthy."""
+    return {
+        "structured_insight": {
+            "identified_problems": ["No disease detected"],
+            "symptoms_noticed": ["The leaf looks healthy"],
+            "probable_causes": ["None"],
+            "severity_level": "low",
+            "recommended_actions": [
+                "Keep up your current care: regular watering, weeding and feeding",
+                "Check the crop again in a week, and send a new photo if spots, "
+                "yellowing or wilting appear",
+            ],
+            "prevention_tips": [
+                "Remove fallen and diseased leaves from the field",
+                "Rotate crops and avoid watering the leaves late in the day",
+            ],
+            "crop_identified": "Not identified",
+            "overall_health": "healthy",
+            "confidence_level": "high",
+        },
+        "raw_results": {
+            "prescreen": {
+                "healthy": round(healthy_probability, 4),
+                "not_healthy": round(1 - healthy_probability, 4),
+            }
+        },
+    }
+
+
+def extract_json_object(response_text: str) -> dict:
+    """
+    Parse the JSON object in an LLM response, tolerating markdown fences and
+    extra text around it. Raises json.JSONDecodeError.
+    """
+    # Try to extract JSON from the response (in case it's wrapped in markdown or has extra text)
+    json_match = re.search(r"\{.*\}", response_text, re.DOTALL)
+    if json_match:
+        response_text = json_match.group(0)
+
+    # Clean up common JSON formatting issues
+    response_text = response_text.strip()
+    if response_text.startswith("```json"):
+        response_text = response_text[7:]
+    if response_text.endswith("```"):
+        response_text = response_text[:-3]
+    response_text = response_text.strip()
+
+    return json.loads(response_text)
+
 
-    combined_result = await predict_crop_health(image_path)
+def synthesize_diagnosis(combined_result: dict) -> dict:
+    """
+    Turn simplified provider results into the farmer-facing insight with the
+    LLM. Blocking; run it in a worker thread.
+    """
 
     # If Kindwise confidently indicates this is not a plant, short-circuit with a clear message
     try:
@@ -72,25 +215,7 @@ async def diagnosis_flow(
 
     # Try to parse the response as JSON
     try:
-        import json
-        import re
-
-        response_text = llm_response.get("response", "{}")
-
-        # Try to extract JSON from the response (in case it's wrapped in markdown or has extra text)
-        json_match = re.search(r"\{.*\}", response_text, re.DOTALL)
-        if json_match:
-            response_text = json_match.group(0)
-
-        # Clean up common JSON formatting issues
-        response_text = response_text.strip()
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-        response_text = response_text.strip()
-
-        structured_response = json.loads(response_text)
+        structured_response = extract_json_object(llm_response.get("response", "{}"))
 
         # Validate that we have the expected structure
         required_fields = [
@@ -124,6 +249,360 @@ async def diagnosis_flow(
         return {"insight": llm_response.get("response"), "raw_results": combined_result}
 
 
+async def diagnosis_stream(
+    image: NormalizedImage,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Streaming diagnosis_flow for an already normalized image. Yields
+    (event, data) pairs:
+    - "provider": a provider's simplified result (or error) as it arrives.
+    - "insight": the LLM synthesis, started as soon as DIAGNOSIS_QUORUM is met
+      (or every provider has answered); "based_on" lists the providers used.
+    - "refinement": a provider result that arrived after the synthesis started.
+    - "result": the complete diagnosis_flow result, cached if every provider
+      and the LLM answered.
+    - "error": no usable result.
+    A cached diagnosis, or one answered by the local pre-screen model, is
+    returned as a single "result" event.
+    """
+    location_key = diagnosis_cache.location_key(latitude, longitude)
+    caching = diagnosis_cache.ttl > 0
+    if caching:
+        cached = await diagnosis_cache.lookup(image, location_key)
+        if cached is not None:
+            yield "result", {**cached, "cached": True}
+            return
+    diagnosis_cache.misses += 1
+
+    healthy_probability = await prescreen.screen(image)
+    if healthy_probability is not None:
+        result = prescreen_diagnosis(healthy_probability)
+        if caching:
+            await diagnosis_cache.store(image, location_key, result)
+        yield "result", result
+        return
+
+    location = {}
+    if latitude is not None and longitude is not None:
+        location = {"latitude": latitude, "longitude": longitude}
+    quorum = parse_quorum(DIAGNOSIS_QUORUM)
+    raw_results = []
+    sections = {}  # provider -> simplified result, successful providers only
+    insight, based_on = None, []
+
+    providers = stream_crop_health(
+        image.data, deadline=time.monotonic() + DIAGNOSIS_BUDGET, **location
+    )
+    next_result = asyncio.ensure_future(anext(providers))
+    synthesis = None
+    try:
+        while next_result is not None or synthesis is not None:
+            done, _ = await asyncio.wait(
+                [task for task in (next_result, synthesis) if task is not None],
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+
+            if next_result in done:
+                try:
+                    raw = next_result.result()
+                except StopAsyncIteration:
+                    next_result = None
+                else:
+                    next_result = asyncio.ensure_future(anext(providers))
+                    raw_results.append(raw)
+                    provider, section = simplify_provider_result(raw)
+                    event = (
+                        "provider"
+                        if synthesis is None and not based_on
+                        else "refinement"
+                    )
+                    if "error" in raw:
+                        yield event, {"provider": provider, "error": raw["error"]}
+                    else:
+                        sections[provider] = section
+                        yield event, {"provider": provider, "result": section}
+
+                started = synthesis is not None or based_on
+                ready = quorum_met(quorum, set(sections)) or next_result is None
+                if not started and ready and ({"kindwise", "deepl"} & set(sections)):
+                    based_on = sorted(sections)
+                    synthesis = asyncio.ensure_future(
+                        asyncio.to_thread(synthesize_diagnosis, dict(sections))
+                    )
+
+            if synthesis is not None and synthesis in done:
+                insight = synthesis.result()
+                synthesis = None
+                yield "insight", {
+                    **{k: v for k, v in insight.items() if k != "raw_results"},
+                    "based_on": based_on,
+                }
+    finally:
+        if next_result is not None:
+            next_result.cancel()
+            await asyncio.wait([next_result])
+        await providers.aclose()
+
+    try:
+        combined_result = combine_provider_results(raw_results)
+    except RuntimeError as e:
+        yield "error", {"detail": str(e)}
+        return
+    if insight is None:
+        yield "error", {"detail": "Unable to analyze crop health."}
+        return
+
+    result = {**insight, "raw_results": combined_result}
+    if caching:
+        await diagnosis_cache.store(image, location_key, result)
+    yield "result", {**result, "based_on": based_on}
+
+
+def normalize_upload(data: bytes):
+    """normalize_image, returning the ValueError instead of raising it."""
+    try:
+        return normalize_image(data)
+    except ValueError as e:
+        return e
+
+
+def summarize_findings(combined_result: dict) -> dict:
+    """Compact version of one photo's combined result for the field report prompt."""
+    finding = {}
+    if "prescreen" in combined_result:
+        finding["healthy_probability"] = combined_result["prescreen"]["healthy"]
+        return finding
+    kindwise = combined_result.get("kindwise", {})
+    if kindwise.get("crops"):
+        finding["crop"] = kindwise["crops"][0]["name"]
+    finding["diseases"] = [
+        {"name": disease["name"], "probability": round(disease["probability"], 2)}
+        for disease in kindwise.get("diseases", [])
+    ] + [
+        {"name": diag["common_name"], "likelihood": diag["diagnosis_likelihood"]}
+        for diag in combined_result.get("deepl", {}).get("diagnoses", [])
+    ]
+    if combined_result.get("openepi"):
+        finding["healthy_probability"] = combined_result["openepi"].get("healthy")
+    return finding
+
+
+def synthesize_field_report(findings: List[dict]) -> dict:
+    """
+    One LLM synthesis over the findings for every photo of a field scouting
+    visit. Blocking; run it in a worker thread.
+    """
+    prompt = (
+        "You are an expert agricultural advisor helping an extension officer.\n"
+        "The officer photographed several plants in one farmer's field. You will receive\n"
+        "the crop health findings for each photo ('photos' counts near-identical shots).\n"
+        "Summarize the field as a whole: how widespread each problem is, how severe the\n"
+        "situation is and what the farmer should do.\n"
+        "\n"
+        "IMPORTANT: You must respond with ONLY a valid JSON object, no additional text or explanations.\n"
+        "\n"
+        "Provide a JSON response with this exact structure:\n"
+        "{\n"
+        '  "crop_identified": "name of the crop",\n'
+        '  "overall_health": "healthy/unhealthy/mixed",\n'
+        '  "plants_affected": "how many of the photographed plants show problems, e.g. 7 of 20",\n'
+        '  "identified_problems": ["each problem and how many plants show it"],\n'
+        '  "symptoms_noticed": ["list of visible symptoms"],\n'
+        '  "probable_causes": ["list of likely causes"],\n'
+        '  "severity_level": "low/medium/high/critical",\n'
+        '  "recommended_actions": ["list of specific actions for the whole field"],\n'
+        '  "prevention_tips": ["list of prevention measures"],\n'
+        '  "scouting_notes": ["what to check on the next visit"],\n'
+        '  "confidence_level": "high/medium/low"\n'
+        "}\n"
+        "\n"
+        "Guidelines:\n"
+        "- Use simple language for farmers\n"
+        "- Don't mention technical probabilities or API sources\n"
+        "- Base severity on how many plants are affected and the spread potential\n"
+        "- Ensure all arrays have at least one item\n"
+        "- Use proper JSON syntax with double quotes\n"
+        "\n"
+        f"Findings per photo (JSON):\n{json.dumps(findings)}\n"
+        "\n"
+        "CRITICAL: Return ONLY the JSON object, no markdown formatting, no code blocks, no explanations."
+    )
+
+    llm_response = llm_service.send_message(prompt)
+    try:
+        return {
+            "structured_insight": extract_json_object(
+                llm_response.get("response", "{}")
+            )
+        }
+    except (json.JSONDecodeError, TypeError) as e:
+        print(f"JSON parsing failed: {e}")
+        return {"insight": llm_response.get("response")}
+
+
+async def batch_diagnosis_stream(
+    uploads: List[bytes],
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Field-scouting diagnosis of several photos of one field. Yields (event,
+    data) pairs, "index" being the position of the photo in `uploads`:
+    - "rejected": not an image, or failed the quality gate.
+    - "duplicate": near-identical to an earlier photo ("duplicate_of"); not
+      sent to the providers, but counted in the summary.
+    - "image": a photo's combined provider result (or "error"). Cached and
+      pre-screened photos come first, then the others as they complete, with
+      at most BATCH_PROVIDER_CONCURRENCY requests in flight per provider.
+    - "summary": a single LLM synthesis over all diagnosed photos.
+    - "error": none of the photos could be diagnosed.
+    """
+    decode_slots = asyncio.Semaphore(BATCH_DECODE_CONCURRENCY)
+
+    async def decode(data: bytes):
+        async with decode_slots:
+            return await asyncio.to_thread(normalize_upload, data)
+
+    # Decoded in upload order, a few at a time, so a large batch doesn't hold
+    # every full-size photo in memory or take every worker thread
+    decoding = [asyncio.ensure_future(decode(data)) for data in uploads]
+
+    unique = {}  # index -> NormalizedImage sent for diagnosis
+    photos = {}  # index of a unique photo -> photos it stands for
+    rejected = 0
+    try:
+        for index, task in enumerate(decoding):
+            image = await task
+            if isinstance(image, ValueError):
+                rejected += 1
+                detail = (
+                    image.detail
+                    if isinstance(image, ImageQualityError)
+                    else {"message": str(image)}
+                )
+                yield "rejected", {"index": index, **detail}
+                continue
+            original = next(
+                (
+                    i
+                    for i, seen in unique.items()
+                    if diagnosis_cache.distance(image, seen.phash, seen.dhash)
+                    <= diagnosis_cache.max_distance
+                ),
+                None,
+            )
+            if original is not None:
+                photos[original] += 1
+                yield "duplicate", {"index": index, "duplicate_of": original}
+                continue
+            unique[index] = image
+            photos[index] = 1
+    finally:
+        for task in decoding:
+            task.cancel()
+
+    results = {}  # index -> combined provider result
+    location_key = diagnosis_cache.location_key(latitude, longitude)
+    pending = []
+    for index, image in unique.items():
+        cached = None
+        if diagnosis_cache.ttl > 0:
+            cached = await diagnosis_cache.lookup(image, location_key)
+        if cached is not None:
+            results[index] = cached["raw_results"]
+            yield "image", {"index": index, "result": results[index], "cached": True}
+            continue
+        healthy_probability = await prescreen.screen(image)
+        if healthy_probability is not None:
+            results[index] = prescreen_diagnosis(healthy_probability)["raw_results"]
+            yield "image", {"index": index, "result": results[index]}
+            continue
+        diagnosis_cache.misses += 1
+        pending.append(index)
+
+    if pending:
+        location = {}
+        if latitude is not None and longitude is not None:
+            location = {"latitude": latitude, "longitude": longitude}
+        batch = predict_crop_health_batch(
+            [unique[index].data for index in pending], **location
+        )
+        try:
+            async for position, combined in batch:
+                index = pending[position]
+                if isinstance(combined, RuntimeError):
+                    yield "image", {"index": index, "error": str(combined)}
+                else:
+                    results[index] = combined
+                    yield "image", {"index": index, "result": combined}
+        finally:
+            await batch.aclose()
+
+    if not results:
+        yield "error", {"detail": "None of the photos could be diagnosed."}
+        return
+    findings = [
+        {"photo": index + 1, "photos": photos[index], **summarize_findings(result)}
+        for index, result in sorted(results.items())
+    ]
+    with priority(BATCH):
+        report = await asyncio.to_thread(synthesize_field_report, findings)
+    yield "summary", {
+        **report,
+        "photos": len(uploads),
+        "diagnosed": sum(photos[index] for index in results),
+        "duplicates": sum(photos.values()) - len(unique),
+        "rejected": rejected,
+    }
+
+
+async def fetch_field_conditions(
+    lat: float,
+    lon: float,
+    depth: str,
+    top_k: int,
+    past_days: int,
+    forecast_days: int,
+) -> Tuple[dict, dict, List[str]]:
+    """
+    Soil and weather summaries for a field, fetched in parallel. When one of
+    the two upstreams fails (or its breaker is open) its summary is empty and
+    it is listed as unavailable, so recommendations degrade to the data that
+    arrived instead of failing; only when both fail is the error raised.
+    """
+    soil_summary, weather_raw = await asyncio.gather(
+        get_soil_summary_async(lat, lon, depth, top_k),
+        fetch_weather_summary(lat, lon, past_days, forecast_days),
+        return_exceptions=True,
+    )
+    if isinstance(soil_summary, Exception) and isinstance(weather_raw, Exception):
+        raise soil_summary
+    unavailable = []
+    if isinstance(soil_summary, Exception):
+        print(f"Soil data unavailable: {soil_summary}")
+        soil_summary = {}
+        unavailable.append("soil")
+    if isinstance(weather_raw, Exception):
+        print(f"Weather data unavailable: {weather_raw}")
+        weather_summary = {}
+        unavailable.append("weather")
+    else:
+        weather_summary = simplify_weather_response(weather_raw)
+    return soil_summary, weather_summary, unavailable
+
+
+def unavailable_note(unavailable: List[str]) -> str:
+    if not unavailable:
+        return ""
+    return (
+        f"\nNote: {' and '.join(unavailable)} data could not be fetched right now; "
+        "base the advice on the data above and general good practice for the region, "
+        "and say which measurements would make it more precise.\n"
+    )
+
+
 async def recommend_crops_flow(
     lat: float,
     lon: float,
@@ -139,10 +618,9 @@ async def recommend_crops_flow(
     - Returns the LLM's crop recommendation and the input data.
     """
     # Fetch soil and weather summaries in parallel
-    soil_task = get_soil_summary_async(lat, lon, depth, top_k)
-    weather_task = fetch_weather_summary(lat, lon, past_days, forecast_days)
-    soil_summary, weather_raw = await asyncio.gather(soil_task, weather_task)
-    weather_summary = simplify_weather_response(weather_raw)
+    soil_summary, weather_summary, unavailable = await fetch_field_conditions(
+        lat, lon, depth, top_k, past_days, forecast_days
+    )
 
     # Build LLM prompt
     prompt = (
@@ -163,16 +641,17 @@ async def recommend_crops_flow(
         f"- Average sunshine hours: {weather_summary.get('avg_sunshine_hours')}\n"
         f"- Average wind speed: {weather_summary.get('avg_wind_speed_kph')} kph\n"
         f"- Average evapotranspiration: {weather_summary.get('avg_evapotranspiration')}\n"
+        f"{unavailable_note(unavailable)}"
         "\nBased on this information, recommend the 2-3 most suitable crops to plant now. For each crop, explain why it is suitable, and give 1-2 practical tips for success. Be specific, practical, and use simple language for a smallholder farmer."
     )
-    llm_services = LLMService()
-    llm_response = llm_services.send_message(prompt)
+    llm_response = await llm_service.asend_message(prompt)
     print("llm: ", llm_response, llm_response.get("response"))
 
     return {
         "recommendation": llm_response.get("response"),
         "soil_summary": soil_summary,
         "weather_summary": weather_summary,
+        "unavailable": unavailable,
     }
 
 
@@ -196,16 +675,15 @@ async def recommend_fertilizer_flow(
     """
 
     # Fetch soil and weather summaries in parallel
-    soil_task = get_soil_summary_async(lat, lon, depth, top_k)
-    weather_task = fetch_weather_summary(lat, lon, past_days, forecast_days)
-    soil_summary, weather_raw = await asyncio.gather(soil_task, weather_task)
-    weather_summary = simplify_weather_response(weather_raw)
+    soil_summary, weather_summary, unavailable = await fetch_field_conditions(
+        lat, lon, depth, top_k, past_days, forecast_days
+    )
 
     # --- Rule-based deficiency detection if NPK missing ---
     deficiency_notes = []
     # Nitrogen
     if soil_summary.get("nitrogen_total_g_per_kg") is None:
-        if soil_summary.get("texture_class", "").lower() == "sandy":
+        if (soil_summary.get("texture_class") or "").lower() == "sandy":
             deficiency_notes.append(
                 "Sandy soil: likely poor nitrogen retention. Consider more nitrogen fertilizer."
             )
@@ -299,10 +777,11 @@ async def recommend_fertilizer_flow(
         f"- Cation Exchange Capacity: {soil_summary.get('cation_exchange_capacity_cmol_per_kg')} cmol(+)/kg\n"
         f"- Organic Carbon: {soil_summary.get('carbon_organic_g_per_kg')} g/kg\n"
         f"\nDeficiency notes: {deficiency_text}\n"
+        f"{unavailable_note(unavailable)}"
         f"\n"
     )
 
-    llm_response = llm_service.send_message(prompt)
+    llm_response = await llm_service.asend_message(prompt)
 
     return {
         "recommendation": llm_response.get("response"),
@@ -311,4 +790,5 @@ async def recommend_fertilizer_flow(
         "deficiency_notes": deficiency_notes,
         "rotation_note": rotation_note,
         "growth_stage_note": growth_stage_note,
+        "unavailable": unavailable,
     }
@@ -6,7 +6,18 @@ env_path = Path(__file__).resolve().parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
 
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, APIRouter
+from fastapi.responses import JSONResponse
+from src.auth.passwords import password_hasher
+from src.db import dispose_engines, init_db
+from src.ext_apis.rate_limiter import rate_limit_metrics
+from src.ext_apis.resilience import upstream_metrics
+from src.services.location_service import backfill_location_names
+from src.services.prescreen_service import prescreen
 from src.routes.crop_health import router as crop_health_router
 from src.routes.soil_data import router as soil_router
 from src.routes.weather_forecast import router as weather_router
@@ -14,12 +25,70 @@ from src.routes.recommend import router as recommend_router
 from src.routes.chat import router as chat_router
 from src.routes.user import router as user_router
 from src.routes.maps import router as maps_router
+from src.routes.jobs import router as jobs_router
+from src.services.job_queue import job_queue
 
 
 from fastapi.middleware.cors import CORSMiddleware
 
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+def warm_up_clients():
+    """
+    Construct the external API clients (and import their heavy libraries) ahead
+    of the first request instead of on it.
+    """
+    from src.services.llm_service import llm_service
+    from src.services.transalation_service import translation_service
+    from src.services.tts_service import tts_service
+    from src.services.audio_service import audio_service
+    from src.services.gazetteer import gazetteer
+
+    warmups = {
+        "gemini": lambda: llm_service.client,
+        "translate": lambda: translation_service.translate_client,
+        "tts": lambda: tts_service.client,
+        "speech": lambda: audio_service.speech_client,
+        "gazetteer": gazetteer.load,
+        "prescreen": prescreen.load,
+    }
+    for name, warm_up in warmups.items():
+        try:
+            warm_up()
+        except Exception as e:
+            logger.warning(f"Warm-up of {name} client failed: {e}")
+
+
+async def warm_up(app: FastAPI):
+    try:
+        if os.getenv("WARMUP_CLIENTS", "true").lower() != "false":
+            await asyncio.to_thread(warm_up_clients)
+    finally:
+        app.state.ready = True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    # Schema creation has to finish before requests are served
+    await asyncio.to_thread(init_db)
+    # Client warm-up runs in the background; /health/ready reports when it is done
+    warmup_task = asyncio.create_task(warm_up(app))
+    # Place names for users stored before they were resolved on save
+    backfill_task = asyncio.create_task(backfill_location_names())
+    # Workers for queued diagnosis and recommendation jobs
+    job_queue.start()
+    yield
+    await job_queue.stop()
+    warmup_task.cancel()
+    backfill_task.cancel()
+    await dispose_engines()
+    password_hasher.shutdown()
+    prescreen.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 origins = [
@@ -36,6 +105,30 @@ app.add_middleware(
 )
 
 
+@app.get("/health/live", tags=["Health"])
+def liveness():
+    return {"status": "ok"}
+
+
+@app.get("/health/ready", tags=["Health"])
+def readiness():
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ready"}
+
+
+@app.get("/health/upstreams", tags=["Health"])
+def upstreams():
+    """Circuit breaker state and call counts of the soil, weather and geocoding APIs"""
+    return upstream_metrics()
+
+
+@app.get("/health/rate-limits", tags=["Health"])
+def rate_limits():
+    """Token buckets and priority queues of the paid upstream credentials"""
+    return rate_limit_metrics()
+
+
 app.include_router(crop_health_router)
 app.include_router(soil_router)
 app.include_router(weather_router)
@@ -43,3 +136,4 @@ app.include_router(recommend_router)
 app.include_router(chat_router)
 app.include_router(user_router)
 app.include_router(maps_router)
+app.include_router(jobs_router)
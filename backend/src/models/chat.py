@@ -15,6 +15,7 @@ class ChatSession(BaseModel):
     created_at: datetime
     updated_at: datetime
     user_id: Optional[str] = None
+    summary: Optional[str] = None  # rolling summary of older messages
 
 
 class User(BaseModel):
@@ -22,11 +23,13 @@ class User(BaseModel):
     name: Optional[str] = None
     email: Optional[str] = None
     location: Optional[str] = None
+    location_name: Optional[str] = None  # place name resolved from location
     preferred_language: Optional[str] = None
     crops_grown: Optional[List[str]] = None
     user_type: Optional[str] = None  # aspiring, beginner, experienced, explorer
     years_experience: Optional[int] = None
     main_goal: Optional[str] = None
+    account_tier: Optional[str] = None  # standard, premium, enterprise
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
 
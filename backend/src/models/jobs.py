@@ -0,0 +1,17 @@
+from pydantic import BaseModel
+from typing import Optional
+
+
+class CropRecommendationJob(BaseModel):
+    lat: float
+    lon: float
+    depth: str = "0-20"
+    top_k: int = 5
+    past_days: int = 30
+    forecast_days: int = 0
+
+
+class FertilizerRecommendationJob(CropRecommendationJob):
+    target_crop: str
+    previous_crop: Optional[str] = None
+    growth_stage: Optional[str] = None  # germination, vegetative, flowering, fruiting
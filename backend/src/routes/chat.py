@@ -1,8 +1,12 @@
 import re
 import json
-import requests
+import asyncio
+import contextvars
+import threading
+from collections import deque
 from fastapi import (
     APIRouter,
+    BackgroundTasks,
     HTTPException,
     Query,
     Depends,
@@ -10,22 +14,36 @@ from fastapi import (
     File,
     Form,
     Request,
+    WebSocket,
+    WebSocketDisconnect,
 )
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.db import get_db, release_session, session_scope
 from src.services.chat_service import chat_session_manager
+from src.services.conversation_memory import conversation_memory
+from src.services.location_service import (
+    clean_location_for_display,
+    parse_lat_lon_from_location,
+)
 from src.services.transalation_service import (
     translation_service,
     translation_fallback_service,
 )
+from src.services.llm_scheduler import llm_scheduler
 from src.services.llm_service import llm_service
 from src.services.audio_service import audio_service
 from src.services.tts_service import tts_service
-from src.auth.auth_utils import get_current_user
+from src.auth.auth_utils import get_current_user, get_user_from_token
+from src.ext_apis.resilience import REQUEST_DEADLINE, deadline
 from src.flows import diagnosis_flow, recommend_crops_flow
-import tempfile
-import os
+from src.services.image_service import ImageQualityError
+
+# Voice turns synthesize this many sentences ahead of the one being sent, so
+# a barge-in leaves at most that many TTS calls running
+VOICE_TTS_AHEAD = 2
 
 
 def clean_text_for_tts(text: str) -> str:
@@ -65,6 +83,15 @@ def _sse(event: str, data: dict) -> bytes:
     return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
 
 
+async def save_messages(session_id: str, *messages: Tuple[str, str]):
+    """Store the (sender, message) pairs of a turn in one short unit of work."""
+    async with session_scope() as db:
+        for sender, message in messages:
+            await chat_session_manager.add_message(
+                session_id, sender=sender, message=message, db=db
+            )
+
+
 def auto_compact_text(
     text: str, max_sentences: int = 3, max_bullets: int = 5, max_chars: int = 800
 ) -> str:
@@ -99,114 +126,82 @@ def auto_compact_text(
     return compact
 
 
-def reverse_geocode(lat: float, lon: float) -> dict:
-    """
-    Takes latitude and longitude and returns the location info using Photon API.
-    """
-    try:
-        url = "https://photon.komoot.io/reverse"
-        params = {"lat": lat, "lon": lon}
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences so each can be translated/spoken as it is ready."""
+    if not text:
+        return []
+    parts = re.split(r"(?<=[.!?።])\s+", text.strip())
+    return [p for p in parts if p.strip()]
 
-        response = requests.get(url, params=params)
-        response.raise_for_status()  # Throws error if status code is not 200
 
-        data = response.json()
+def to_english(text: str) -> str:
+    try:
+        return translation_service.translate_to_english(text)
+    except Exception:
+        return translation_fallback_service.translate_to_english(text)
 
-        if data["features"]:
-            return data["features"][0]["properties"]
-        else:
-            return {"error": "No location found for given coordinates."}
-    except Exception as e:
-        return {"error": f"Failed to get location: {str(e)}"}
 
+def from_english(text: str, dest_lang: str) -> str:
+    try:
+        return translation_service.translate_from_english(text, dest_lang)
+    except Exception:
+        return translation_fallback_service.translate_from_english(text, dest_lang)
 
-def clean_location_for_display(location: str) -> str:
+
+async def iterate_in_thread(
+    make_iterator: Callable[[], Iterator[str]],
+) -> AsyncIterator[str]:
     """
-    Clean location string to remove GPS coordinates and return only the location name.
+    Consume a blocking iterator (e.g. LLM token stream) on a worker thread and
+    yield its items to async code as they arrive. Stops the thread early if the
+    consumer goes away.
     """
-    if not location:
-        return "Unknown location"
-
-    # Check if location contains coordinates (numbers with decimals)
-    import re
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
 
-    coord_pattern = r"([\d.-]+),\s*([\d.-]+)"
-    match = re.search(coord_pattern, location)
-
-    if match:
+    def produce():
         try:
-            lat = float(match.group(1))
-            lon = float(match.group(2))
-
-            # Get location name from coordinates
-            location_info = reverse_geocode(lat, lon)
-
-            if "error" not in location_info:
-                # Build a readable location string
-                location_parts = []
-
-                if location_info.get("city"):
-                    location_parts.append(location_info["city"])
-                elif location_info.get("name"):
-                    location_parts.append(location_info["name"])
-
-                if location_info.get("district"):
-                    location_parts.append(location_info["district"])
-
-                if location_info.get("country"):
-                    location_parts.append(location_info["country"])
-
-                if location_parts:
-                    return ", ".join(location_parts)
-                else:
-                    return "Unknown location"
-            else:
-                # Fallback: remove coordinates and clean up
-                location = re.sub(r",?\s*lat:\s*[\d.-]+", "", location)
-                location = re.sub(r",?\s*lon:\s*[\d.-]+", "", location)
-                location = re.sub(r"\s*\([\d.-]+,\s*[\d.-]+\)", "", location)
-                location = re.sub(r"\s*[\d.-]+,\s*[\d.-]+", "", location)
-
-                # Clean up any remaining artifacts
-                location = re.sub(r"\s+", " ", location)
-                location = location.strip()
-                location = re.sub(r"^,\s*", "", location)
-                location = re.sub(r",\s*$", "", location)
-
-                return location if location else "Unknown location"
-        except (ValueError, Exception):
-            # If coordinate parsing fails, just clean up the string
-            location = re.sub(r",?\s*lat:\s*[\d.-]+", "", location)
-            location = re.sub(r",?\s*lon:\s*[\d.-]+", "", location)
-            location = re.sub(r"\s*\([\d.-]+,\s*[\d.-]+\)", "", location)
-            location = re.sub(r"\s*[\d.-]+,\s*[\d.-]+", "", location)
-
-            location = re.sub(r"\s+", " ", location)
-            location = location.strip()
-            location = re.sub(r"^,\s*", "", location)
-            location = re.sub(r",\s*$", "", location)
-
-            return location if location else "Unknown location"
-    else:
-        # No coordinates found, return as is
-        return location.strip()
-
+            for item in make_iterator():
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as exc:
+            loop.call_soon_threadsafe(queue.put_nowait, exc)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
 
-def parse_lat_lon_from_location(location: str) -> tuple[float, float] | None:
-    """Parse latitude and longitude from a location string like '9.145, 40.489'."""
-    if not location:
-        return None
+    # The thread sees the request's context (LLM caller, deadline, priority),
+    # which run_in_executor does not pass on by itself
+    context = contextvars.copy_context()
+    worker = loop.run_in_executor(None, context.run, produce)
     try:
-        import re
-
-        m = re.search(r"([+-]?[0-9]*\.?[0-9]+)\s*,\s*([+-]?[0-9]*\.?[0-9]+)", location)
-        if not m:
-            return None
-        lat = float(m.group(1))
-        lon = float(m.group(2))
-        return (lat, lon)
-    except Exception:
-        return None
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Let the worker notice the stop flag without blocking the loop on it
+        worker.add_done_callback(lambda f: f.exception())
+
+
+def build_farmer_info(user) -> str:
+    """Farmer profile block included in chat prompts."""
+    return f"""
+Farmer Profile:
+- Name: {user.name}
+- Location: {user.location_name or clean_location_for_display(user.location)}
+- Experience: {user.years_experience} years
+- User Type: {user.user_type}
+- Main Goal: {user.main_goal}
+- Preferred Language: {user.preferred_language}
+- Crops Grown: {user.crops_grown}
+"""
 
 
 def detect_intent(message_en: str) -> str:
@@ -299,8 +294,12 @@ class SendAudioMessageRequest(BaseModel):
 
 
 @router.post("/start-session")
-def start_session(req: StartSessionRequest, current_user=Depends(get_current_user)):
-    session = chat_session_manager.start_session(user_id=req.user_id)
+async def start_session(
+    req: StartSessionRequest,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    session = await chat_session_manager.start_session(user_id=req.user_id, db=db)
     return {"session_id": session.session_id, "created_at": session.created_at}
 
 
@@ -314,6 +313,8 @@ async def send_message(
         None, description="Preferred language for conversation"
     ),
     current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    background_tasks: BackgroundTasks = None,
 ):
     # Support both JSON body and multipart form
     session_id: Optional[str] = session_id_form
@@ -329,9 +330,12 @@ async def send_message(
     if not session_id:
         raise HTTPException(status_code=400, detail="session_id is required")
 
-    session = chat_session_manager.get_session(session_id)
+    session = await chat_session_manager.get_session(
+        session_id, message_limit=10, db=db
+    )
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
+    await release_session(db)
 
     # Use preferred language if provided, otherwise detect
     if preferred_language:
@@ -355,49 +359,25 @@ async def send_message(
                 message_for_llm
             )
 
-    # Add user message
-    if message_for_llm:
-        chat_session_manager.add_message(
-            session_id, sender="user", message=message_for_llm
-        )
+    # The user message is stored together with the reply
+    user_turn = [("user", message_for_llm)] if message_for_llm else []
 
-    messages_formatted = "\n".join(
-        [f"{m.sender}: {m.message}" for m in session.messages[-10:]]
-    )
+    messages_formatted = conversation_memory.history_for_session(session)
 
     # Get farmer's personalized information
-    farmer_info = f"""
-Farmer Profile:
-- Name: {current_user.name}
-- Location: {clean_location_for_display(current_user.location)}
-- Experience: {current_user.years_experience} years
-- User Type: {current_user.user_type}
-- Main Goal: {current_user.main_goal}
-- Preferred Language: {current_user.preferred_language}
-- Crops Grown: {current_user.crops_grown}
-"""
+    farmer_info = build_farmer_info(current_user)
 
     # If an image is provided, run the diagnosis flow (function-calling behavior)
-    temp_image_path = None
     if image is not None:
         if not image.content_type or not image.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="File must be an image")
+        coords = parse_lat_lon_from_location(current_user.location) or (None, None)
         try:
-            suffix = os.path.splitext(image.filename or "upload.jpg")[1] or ".jpg"
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-                tmp.write(await image.read())
-                temp_image_path = tmp.name
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Error saving image: {str(e)}")
-
-        try:
-            result = await diagnosis_flow(temp_image_path)
-        finally:
-            try:
-                if temp_image_path and os.path.exists(temp_image_path):
-                    os.remove(temp_image_path)
-            except Exception:
-                pass
+            result = await diagnosis_flow(await image.read(), *coords)
+        except ImageQualityError as e:
+            raise HTTPException(status_code=422, detail=e.detail)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
         structured = result.get("structured_insight")
         if structured:
@@ -449,9 +429,8 @@ Farmer Profile:
                 assistant_text = translation_fallback_service.translate_from_english(
                     assistant_text, user_lang
                 )
-        chat_session_manager.add_message(
-            session_id, sender="llm", message=assistant_text
-        )
+        await save_messages(session_id, *user_turn, ("llm", assistant_text))
+        background_tasks.add_task(conversation_memory.run_update, session_id)
 
         raw_results = result.get("raw_results", {})
         kindwise = raw_results.get("kindwise", {})
@@ -485,7 +464,7 @@ Farmer Profile:
 
     # General answer when no image is provided
     # LLM-based intent detection
-    intent = detect_intent(message_for_llm or "")
+    intent = await asyncio.to_thread(detect_intent, message_for_llm or "")
     if intent == "crop_recommendation":
         coords = parse_lat_lon_from_location(current_user.location)
         if not coords:
@@ -494,7 +473,10 @@ Farmer Profile:
         lat, lon = coords
 
         try:
-            reco = await recommend_crops_flow(lat, lon, past_days=30, forecast_days=14)
+            with deadline(REQUEST_DEADLINE):
+                reco = await recommend_crops_flow(
+                    lat, lon, past_days=30, forecast_days=14
+                )
             print("reco", reco)
             assistant_text = (
                 reco.get("recommendation")
@@ -515,9 +497,8 @@ Farmer Profile:
                 )
 
         print("assi: ", assistant_text)
-        chat_session_manager.add_message(
-            session_id, sender="llm", message=assistant_text
-        )
+        await save_messages(session_id, *user_turn, ("llm", assistant_text))
+        background_tasks.add_task(conversation_memory.run_update, session_id)
         return {"response": assistant_text}
 
     prompt = f"""You are an agricultural assistant helping farmers.
@@ -537,12 +518,13 @@ User message:
 
 Provide a brief, helpful answer tailored to the farmer's context."""
 
-    llm_response = llm_service.send_message(
+    llm_response = await llm_service.asend_message(
         prompt, temperature=0.2, max_output_tokens=280
     )
     llm_text = llm_response.get("response", "")
 
-    chat_session_manager.add_message(session_id, sender="llm", message=llm_text)
+    await save_messages(session_id, *user_turn, ("llm", llm_text))
+    background_tasks.add_task(conversation_memory.run_update, session_id)
     # Translate LLM response back if needed
     if needs_translation and llm_text:
         try:
@@ -563,13 +545,18 @@ async def send_voice_message(
         None, description="Preferred language for conversation"
     ),
     current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    background_tasks: BackgroundTasks = None,
 ):
     """
     Send a message and get both text and audio response
     """
-    session = chat_session_manager.get_session(req.session_id)
+    session = await chat_session_manager.get_session(
+        req.session_id, message_limit=10, db=db
+    )
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
+    await release_session(db)
 
     # Use preferred language if provided, otherwise detect
     if preferred_language:
@@ -593,26 +580,10 @@ async def send_voice_message(
                 req.message
             )
 
-    # Add user message
-    chat_session_manager.add_message(
-        req.session_id, sender="user", message=message_for_llm
-    )
-
-    messages_formatted = "\n".join(
-        [f"{m.sender}: {m.message}" for m in session.messages[-10:]]
-    )
+    messages_formatted = conversation_memory.history_for_session(session)
 
     # Get farmer's personalized information
-    farmer_info = f"""
-Farmer Profile:
-- Name: {current_user.name}
-- Location: {clean_location_for_display(current_user.location)}
-- Experience: {current_user.years_experience} years
-- User Type: {current_user.user_type}
-- Main Goal: {current_user.main_goal}
-- Preferred Language: {current_user.preferred_language}
-- Crops Grown: {current_user.crops_grown}
-"""
+    farmer_info = build_farmer_info(current_user)
 
     prompt = f"""You are an agricultural assistant helping farmers.
 Reply policy:
@@ -630,12 +601,13 @@ User message:
 
 Provide a brief, helpful answer tailored to the farmer's context."""
 
-    llm_response = llm_service.send_message(
+    llm_response = await llm_service.asend_message(
         prompt, temperature=0.2, max_output_tokens=280
     )
     llm_text = llm_response.get("response", "")
 
-    chat_session_manager.add_message(req.session_id, sender="llm", message=llm_text)
+    await save_messages(req.session_id, ("user", message_for_llm), ("llm", llm_text))
+    background_tasks.add_task(conversation_memory.run_update, req.session_id)
 
     # Translate LLM response back if needed
     if needs_translation and llm_text:
@@ -670,6 +642,8 @@ async def send_audio_message(
         None, description="Language code (en, am, no, sw, es, id)"
     ),
     current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    background_tasks: BackgroundTasks = None,
 ):
     """
     Send audio message and get LLM response
@@ -687,9 +661,12 @@ async def send_audio_message(
         )
 
     # Get chat session
-    session = chat_session_manager.get_session(session_id)
+    session = await chat_session_manager.get_session(
+        session_id, message_limit=10, db=db
+    )
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
+    await release_session(db)
 
     # Process audio to text with specified language or auto-detect
     if language:
@@ -735,25 +712,11 @@ async def send_audio_message(
                 transcribed_text
             )
 
-    # Add user message to chat session
-    chat_session_manager.add_message(session_id, sender="user", message=message_for_llm)
-
     # Format conversation history
-    messages_formatted = "\n".join(
-        [f"{m.sender}: {m.message}" for m in session.messages[-10:]]
-    )
+    messages_formatted = conversation_memory.history_for_session(session)
 
     # Get farmer's personalized information
-    farmer_info = f"""
-Farmer Profile:
-- Name: {current_user.name}
-- Location: {clean_location_for_display(current_user.location)}
-- Experience: {current_user.years_experience} years
-- User Type: {current_user.user_type}
-- Main Goal: {current_user.main_goal}
-- Preferred Language: {current_user.preferred_language}
-- Crops Grown: {current_user.crops_grown}
-"""
+    farmer_info = build_farmer_info(current_user)
 
     # Use the same prompt as text messages
     prompt = f"""You are an agricultural assistant helping farmers.
@@ -775,13 +738,14 @@ User message:
 Provide a brief, helpful answer tailored to the farmer's context."""
 
     # Get LLM response
-    llm_response = llm_service.send_message(
+    llm_response = await llm_service.asend_message(
         prompt, temperature=0.2, max_output_tokens=280
     )
     llm_text = llm_response.get("response", "")
 
-    # Add LLM response to chat session
-    chat_session_manager.add_message(session_id, sender="llm", message=llm_text)
+    # Store the exchange
+    await save_messages(session_id, ("user", message_for_llm), ("llm", llm_text))
+    background_tasks.add_task(conversation_memory.run_update, session_id)
 
     # Translate LLM response back if needed
     if needs_translation and llm_text:
@@ -813,6 +777,8 @@ async def voice_conversation(
         description="If true, stream SSE events: detected_language, response_text, audio, done",
     ),
     current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    background_tasks: BackgroundTasks = None,
 ):
     """
     Real-time voice conversation: Speak to AI and get voice response
@@ -830,9 +796,12 @@ async def voice_conversation(
         )
 
     # Get chat session
-    session = chat_session_manager.get_session(session_id)
+    session = await chat_session_manager.get_session(
+        session_id, message_limit=10, db=db
+    )
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
+    await release_session(db)
 
     # Process audio to text with specified language or auto-detect
     if language:
@@ -868,7 +837,7 @@ async def voice_conversation(
     # If streaming is requested, send SSE events progressively
     if stream:
 
-        def event_generator():
+        async def event_generator():
             try:
                 # Initial language/transcript event
                 yield _sse(
@@ -885,33 +854,14 @@ async def voice_conversation(
                 message_for_llm_local = transcribed_text
                 needs_translation_local = user_lang != "en"
                 if needs_translation_local:
-                    try:
-                        message_for_llm_local = (
-                            translation_service.translate_to_english(transcribed_text)
-                        )
-                    except Exception:
-                        message_for_llm_local = (
-                            translation_fallback_service.translate_to_english(
-                                transcribed_text
-                            )
-                        )
-
-                chat_session_manager.add_message(
-                    session_id, sender="user", message=message_for_llm_local
-                )
-                messages_formatted_local = "\n".join(
-                    [f"{m.sender}: {m.message}" for m in session.messages[-10:]]
+                    message_for_llm_local = await asyncio.to_thread(
+                        to_english, transcribed_text
+                    )
+
+                messages_formatted_local = conversation_memory.history_for_session(
+                    session
                 )
-                farmer_info_local = f"""
-Farmer Profile:
-- Name: {current_user.name}
-- Location: {clean_location_for_display(current_user.location)}
-- Experience: {current_user.years_experience} years
-- User Type: {current_user.user_type}
-- Main Goal: {current_user.main_goal}
-- Preferred Language: {current_user.preferred_language}
-- Crops Grown: {current_user.crops_grown}
-"""
+                farmer_info_local = build_farmer_info(current_user)
                 prompt_local = f"""You are an agricultural assistant helping farmers.
 Reply policy:
 - Be concise by default.
@@ -929,30 +879,26 @@ current user message:
 
 Respond as the agricultural assistant, taking into account the farmer's specific profile, location, experience level, and crops. Provide personalized advice that considers their farming context."""
 
-                llm_response_local = llm_service.send_message(prompt_local)
+                llm_response_local = await llm_service.asend_message(prompt_local)
                 llm_text_local = llm_response_local.get("response", "")
-                chat_session_manager.add_message(
-                    session_id, sender="llm", message=llm_text_local
+                await save_messages(
+                    session_id,
+                    ("user", message_for_llm_local),
+                    ("llm", llm_text_local),
                 )
+                conversation_memory.schedule_update(session_id)
 
                 if needs_translation_local and llm_text_local:
-                    try:
-                        llm_text_local = translation_service.translate_from_english(
-                            llm_text_local, user_lang
-                        )
-                    except Exception:
-                        llm_text_local = (
-                            translation_fallback_service.translate_from_english(
-                                llm_text_local, user_lang
-                            )
-                        )
+                    llm_text_local = await asyncio.to_thread(
+                        from_english, llm_text_local, user_lang
+                    )
 
                 llm_text_local = auto_compact_text(llm_text_local)
                 yield _sse("response_text", {"response": llm_text_local})
 
                 cleaned_text_local = clean_text_for_tts(llm_text_local)
-                tts_result_local = tts_service.text_to_speech(
-                    cleaned_text_local, user_lang
+                tts_result_local = await asyncio.to_thread(
+                    tts_service.text_to_speech, cleaned_text_local, user_lang
                 )
 
                 yield _sse(
@@ -982,20 +928,8 @@ Respond as the agricultural assistant, taking into account the farmer's specific
                 transcribed_text
             )
 
-    chat_session_manager.add_message(session_id, sender="user", message=message_for_llm)
-    messages_formatted = "\n".join(
-        [f"{m.sender}: {m.message}" for m in session.messages[-10:]]
-    )
-    farmer_info = f"""
-Farmer Profile:
-- Name: {current_user.name}
-- Location: {clean_location_for_display(current_user.location)}
-- Experience: {current_user.years_experience} years
-- User Type: {current_user.user_type}
-- Main Goal: {current_user.main_goal}
-- Preferred Language: {current_user.preferred_language}
-- Crops Grown: {current_user.crops_grown}
-"""
+    messages_formatted = conversation_memory.history_for_session(session)
+    farmer_info = build_farmer_info(current_user)
     prompt = f"""You are an agricultural assistant helping farmers.
 Reply policy:
 - Be concise by default.
@@ -1013,9 +947,10 @@ current user message:
 {message_for_llm}
 
 Respond as the agricultural assistant, taking into account the farmer's specific profile, location, experience level, and crops. Provide personalized advice that considers their farming context."""
-    llm_response = llm_service.send_message(prompt)
+    llm_response = await llm_service.asend_message(prompt)
     llm_text = llm_response.get("response", "")
-    chat_session_manager.add_message(session_id, sender="llm", message=llm_text)
+    await save_messages(session_id, ("user", message_for_llm), ("llm", llm_text))
+    background_tasks.add_task(conversation_memory.run_update, session_id)
     if needs_translation and llm_text:
         try:
             llm_text = translation_service.translate_from_english(llm_text, user_lang)
@@ -1039,8 +974,484 @@ Respond as the agricultural assistant, taking into account the farmer's specific
 
 
 @router.get("/history")
-def get_history(session_id: str = Query(...), current_user=Depends(get_current_user)):
-    history = chat_session_manager.get_history(session_id)
+async def get_history(
+    session_id: str = Query(...),
+    limit: Optional[int] = Query(None, ge=1),
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    history = await chat_session_manager.get_history(session_id, limit=limit, db=db)
     if history is None:
         raise HTTPException(status_code=404, detail="Session not found")
     return {"messages": [m.dict() for m in history]}
+
+
+@router.get("/llm/metrics")
+def llm_metrics(current_user=Depends(get_current_user)):
+    """LLM slots in use and the caller's own queue wait (see services.llm_scheduler)"""
+    return llm_scheduler.metrics(current_user.user_id)
+
+
+class ChatConnection:
+    """
+    State for one persistent chat WebSocket. The user is authenticated and the
+    session, farmer profile and recent history are loaded once per connection
+    instead of once per message.
+    """
+
+    def __init__(self, websocket: WebSocket, user, session, language: Optional[str]):
+        self.websocket = websocket
+        self.user = user
+        self.session_id = session.session_id
+        self.language = language
+        self.farmer_info = build_farmer_info(user)
+        self.summary = session.summary
+        self.history = deque(
+            (f"{m.sender}: {m.message}" for m in session.messages[-10:]), maxlen=10
+        )
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, event: str, data: dict):
+        async with self._send_lock:
+            await self.websocket.send_json({"type": event, **data})
+
+    async def remember(self, *messages: Tuple[str, str]):
+        """
+        Append (sender, message) pairs to the in-memory history and persist them
+        in one unit of work. The write is shielded so a barge-in that cancels
+        the turn cannot interrupt it halfway.
+        """
+        for sender, message in messages:
+            self.history.append(f"{sender}: {message}")
+        await asyncio.shield(save_messages(self.session_id, *messages))
+
+    def update_summary(self):
+        """Refresh the rolling summary in the background once a turn is stored."""
+        update = conversation_memory.schedule_update(self.session_id)
+        if update is not None:
+            update.add_done_callback(self._on_summary_updated)
+
+    def _on_summary_updated(self, update):
+        if update.cancelled():
+            return
+        summary = update.result()
+        if summary:
+            self.summary = summary
+
+    def history_text(self) -> str:
+        """Summary plus recent messages, trimmed to the prompt budget."""
+        return conversation_memory.format_history(self.summary, self.history)
+
+
+async def open_chat_connection(
+    websocket: WebSocket,
+    session_id: str,
+    token: Optional[str],
+    language: Optional[str],
+) -> Optional[ChatConnection]:
+    """Authenticate and load the session once, then accept the WebSocket."""
+    if not token:
+        await websocket.close(code=1008, reason="Missing token")
+        return None
+    try:
+        async with session_scope() as db:
+            user = await get_user_from_token(token, db)
+            session = await chat_session_manager.get_session(
+                session_id, message_limit=10, db=db
+            )
+    except HTTPException as exc:
+        await websocket.close(code=1008, reason=str(exc.detail))
+        return None
+
+    if not session:
+        await websocket.close(code=1008, reason="Session not found")
+        return None
+
+    await websocket.accept()
+    return ChatConnection(websocket, user, session, language)
+
+
+async def run_voice_turn(conn: ChatConnection, audio_content: bytes):
+    """
+    One voice turn: STT -> translation -> LLM -> TTS. Text and audio are
+    streamed back sentence by sentence, with TTS running up to
+    VOICE_TTS_AHEAD sentences ahead of the one being sent.
+    """
+    stop = threading.Event()
+    try:
+        await _voice_turn(conn, audio_content, stop)
+    except asyncio.CancelledError:
+        # Barge-in: keep the worker threads from starting any further
+        # (billed) STT chunks, translations or TTS sentences
+        stop.set()
+        raise
+
+
+async def _in_thread(stop: threading.Event, func, *args):
+    """asyncio.to_thread, except the call is skipped once the turn is stopped."""
+
+    def run():
+        if stop.is_set():
+            return None
+        return func(*args)
+
+    return await asyncio.to_thread(run)
+
+
+async def _voice_turn(conn: ChatConnection, audio_content: bytes, stop):
+    if conn.language:
+        audio_result = await asyncio.to_thread(
+            audio_service.process_audio_message_with_language,
+            audio_content,
+            conn.language,
+            stop,
+        )
+    else:
+        audio_result = await asyncio.to_thread(
+            audio_service.process_audio_message, audio_content, stop
+        )
+
+    if not audio_result["success"]:
+        await conn.send(
+            "error",
+            {
+                "message": f"Audio processing failed: {audio_result.get('error', 'Unknown error')}"
+            },
+        )
+        return
+
+    transcribed_text = audio_result["text"]
+    detected_language = audio_result["detected_language"]
+    confidence = audio_result["confidence"]
+    if confidence < 0.2:
+        await conn.send(
+            "error",
+            {
+                "message": f"Audio quality too low (confidence: {confidence:.2f}). Please speak more clearly."
+            },
+        )
+        return
+
+    user_lang = conn.language or detected_language
+    await conn.send(
+        "transcript",
+        {
+            "transcribed_text": transcribed_text,
+            "detected_language": detected_language,
+            "confidence": confidence,
+            "original_language": user_lang,
+        },
+    )
+
+    needs_translation = user_lang != "en"
+    message_for_llm = transcribed_text
+    if needs_translation:
+        message_for_llm = await _in_thread(stop, to_english, transcribed_text)
+
+    messages_formatted = conn.history_text()
+
+    prompt = f"""You are an agricultural assistant helping farmers.
+Reply policy:
+- Be concise by default (1–3 sentences). Avoid small talk and generic disclaimers.
+- If the user asks for diagnosis or mentions disease/symptoms, instruct them briefly to attach or take a clear photo of the affected plant using the camera button in the chat, then wait for the image.
+- If the question is vague, ask one brief clarifying question.
+- Use simple, direct language suited for farmers.
+
+{conn.farmer_info}
+
+Conversation history:
+{messages_formatted}
+
+User message:
+{message_for_llm}
+
+Provide a brief, helpful answer tailored to the farmer's context."""
+
+    llm_response = await llm_service.asend_message(
+        prompt, temperature=0.2, max_output_tokens=280
+    )
+    llm_text = llm_response.get("response") or ""
+    # Stored together with the reply, so a cancelled turn leaves no
+    # unanswered message in the history
+    await conn.remember(("user", message_for_llm), ("llm", llm_text))
+    conn.update_summary()
+
+    if needs_translation and llm_text:
+        llm_text = await _in_thread(stop, from_english, llm_text, user_lang)
+    llm_text = auto_compact_text(llm_text)
+
+    sentences = split_sentences(llm_text)
+
+    def synthesize(sentence: str) -> asyncio.Task:
+        return asyncio.create_task(
+            _in_thread(
+                stop,
+                tts_service.text_to_speech,
+                clean_text_for_tts(sentence),
+                user_lang,
+            )
+        )
+
+    tts_tasks = [synthesize(sentence) for sentence in sentences[:VOICE_TTS_AHEAD]]
+    try:
+        for index, sentence in enumerate(sentences):
+            await conn.send("response_text", {"index": index, "text": sentence})
+            tts_result = await tts_tasks[index]
+            if index + VOICE_TTS_AHEAD < len(sentences):
+                tts_tasks.append(synthesize(sentences[index + VOICE_TTS_AHEAD]))
+            await conn.send(
+                "audio",
+                {
+                    "index": index,
+                    "audio_base64": tts_result.get("audio_base64"),
+                    "audio_format": tts_result.get("audio_format"),
+                    "language": user_lang,
+                    "tts_success": tts_result.get("success", False),
+                },
+            )
+    finally:
+        for tts_task in tts_tasks:
+            tts_task.cancel()
+
+    await conn.send("done", {"response": llm_text, "language": user_lang})
+
+
+async def _run_turn_safely(conn: ChatConnection, turn):
+    try:
+        await turn
+    except asyncio.CancelledError:
+        raise
+    except Exception as exc:
+        print(f"❌ WebSocket turn failed: {exc}")
+        try:
+            await conn.send("error", {"message": str(exc)})
+        except Exception:
+            pass
+
+
+@router.websocket("/voice-ws")
+async def voice_websocket(
+    websocket: WebSocket,
+    session_id: str = Query(...),
+    token: Optional[str] = Query(None, description="Access token (JWT)"),
+    language: Optional[str] = Query(
+        None, description="Language code (en, am, no, sw, es, id)"
+    ),
+):
+    """
+    Full-duplex voice conversation over one socket.
+
+    Client -> server: binary frames carry audio for the current utterance;
+    {"type": "end_of_utterance"} runs the turn, {"type": "cancel"} aborts it and
+    {"type": "set_language", "language": ...} switches language. Sending new
+    audio while a turn is still running cancels it (barge-in).
+
+    Server -> client: ready, transcript, response_text, audio (one per
+    sentence), done, cancelled and error events.
+    """
+    conn = await open_chat_connection(websocket, session_id, token, language)
+    if conn is None:
+        return
+    await conn.send("ready", {"session_id": conn.session_id})
+
+    audio_buffer = bytearray()
+    turn: Optional[asyncio.Task] = None
+
+    async def cancel_turn(reason: str):
+        if turn and not turn.done():
+            turn.cancel()
+            await conn.send("cancelled", {"reason": reason})
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+
+            if message.get("bytes") is not None:
+                await cancel_turn("barge_in")
+                audio_buffer.extend(message["bytes"])
+                continue
+
+            try:
+                data = json.loads(message.get("text") or "{}")
+            except ValueError:
+                await conn.send("error", {"message": "Invalid JSON message"})
+                continue
+
+            kind = data.get("type")
+            if kind == "end_of_utterance":
+                if not audio_buffer:
+                    await conn.send("error", {"message": "No audio received"})
+                    continue
+                await cancel_turn("barge_in")
+                turn = asyncio.create_task(
+                    _run_turn_safely(conn, run_voice_turn(conn, bytes(audio_buffer)))
+                )
+                audio_buffer.clear()
+            elif kind == "cancel":
+                audio_buffer.clear()
+                await cancel_turn("client")
+            elif kind == "set_language":
+                conn.language = data.get("language") or None
+            else:
+                await conn.send("error", {"message": f"Unknown message type: {kind}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if turn and not turn.done():
+            turn.cancel()
+
+
+async def run_text_turn(conn: ChatConnection, message: str, preferred_language=None):
+    """
+    One text chat turn. Gemini tokens are forwarded as they arrive; for
+    non-English users complete sentences are translated before being sent.
+    Both messages are persisted once the turn completes.
+    """
+    user_lang = preferred_language or conn.language
+    if not user_lang:
+        try:
+            user_lang = await asyncio.to_thread(
+                translation_service.detect_language, message
+            )
+        except Exception:
+            user_lang = await asyncio.to_thread(
+                translation_fallback_service.detect_language, message
+            )
+    needs_translation = user_lang != "en"
+
+    message_for_llm = message
+    if needs_translation:
+        message_for_llm = await asyncio.to_thread(to_english, message)
+
+    intent = await asyncio.to_thread(detect_intent, message_for_llm)
+    if intent == "crop_recommendation":
+        lat, lon = parse_lat_lon_from_location(conn.user.location) or (9.145, 40.489)
+        try:
+            with deadline(REQUEST_DEADLINE):
+                reco = await recommend_crops_flow(
+                    lat, lon, past_days=30, forecast_days=14
+                )
+            llm_text = (
+                reco.get("recommendation")
+                or "Here are crop suggestions based on your area."
+            )
+        except Exception:
+            llm_text = "I couldn't fetch crop recommendations right now. Please try again shortly."
+        response_text = llm_text
+        if needs_translation:
+            response_text = await asyncio.to_thread(from_english, llm_text, user_lang)
+        await conn.send("token", {"text": response_text})
+    else:
+        messages_formatted = conn.history_text()
+        prompt = f"""You are an agricultural assistant helping farmers.
+Reply policy:
+- Be concise by default.
+- If the user asks for diagnosis or mentions disease/symptoms, instruct them briefly to attach or take a clear photo of the affected plant using the camera button in the chat, then wait for the image.
+- If the question is vague, ask one brief clarifying question.
+- Use simple, direct language suited for farmers.
+
+{conn.farmer_info}
+
+Conversation history:
+{messages_formatted}
+
+User message:
+{message_for_llm}
+
+Provide a brief, helpful answer tailored to the farmer's context."""
+
+        llm_text = ""
+        translated_parts = []
+        pending = ""
+        async for chunk in iterate_in_thread(
+            lambda: llm_service.stream_message(
+                prompt, temperature=0.2, max_output_tokens=280
+            )
+        ):
+            llm_text += chunk
+            if not needs_translation:
+                await conn.send("token", {"text": chunk})
+                continue
+            # Translate only complete sentences; keep the tail for the next chunk
+            pending += chunk
+            sentences = split_sentences(pending)
+            if len(sentences) > 1:
+                pending = sentences[-1]
+                for sentence in sentences[:-1]:
+                    translated = await asyncio.to_thread(
+                        from_english, sentence, user_lang
+                    )
+                    translated_parts.append(translated)
+                    await conn.send("token", {"text": translated + " "})
+        if needs_translation and pending.strip():
+            translated = await asyncio.to_thread(from_english, pending, user_lang)
+            translated_parts.append(translated)
+            await conn.send("token", {"text": translated})
+        response_text = " ".join(translated_parts) if needs_translation else llm_text
+
+    await conn.remember(("user", message_for_llm), ("llm", llm_text))
+    conn.update_summary()
+    await conn.send("done", {"response": response_text, "language": user_lang})
+
+
+@router.websocket("/ws")
+async def chat_websocket(
+    websocket: WebSocket,
+    session_id: str = Query(...),
+    token: Optional[str] = Query(None, description="Access token (JWT)"),
+    preferred_language: Optional[str] = Query(
+        None, description="Preferred language for conversation"
+    ),
+):
+    """
+    Persistent text chat channel with token streaming.
+
+    Client -> server: {"type": "message", "message": "...", "preferred_language": "sw"}
+    and {"type": "cancel"}. A new message cancels a response still streaming.
+
+    Server -> client: ready, token (incremental text), done (final text),
+    cancelled and error events.
+    """
+    conn = await open_chat_connection(websocket, session_id, token, preferred_language)
+    if conn is None:
+        return
+    await conn.send("ready", {"session_id": conn.session_id})
+
+    turn: Optional[asyncio.Task] = None
+
+    async def cancel_turn(reason: str):
+        if turn and not turn.done():
+            turn.cancel()
+            await conn.send("cancelled", {"reason": reason})
+
+    try:
+        while True:
+            try:
+                data = json.loads(await websocket.receive_text())
+            except ValueError:
+                await conn.send("error", {"message": "Invalid JSON message"})
+                continue
+            kind = data.get("type", "message")
+            if kind == "message":
+                message = (data.get("message") or "").strip()
+                if not message:
+                    await conn.send("error", {"message": "message is required"})
+                    continue
+                await cancel_turn("new_message")
+                turn = asyncio.create_task(
+                    _run_turn_safely(
+                        conn,
+                        run_text_turn(conn, message, data.get("preferred_language")),
+                    )
+                )
+            elif kind == "cancel":
+                await cancel_turn("client")
+            else:
+                await conn.send("error", {"message": f"Unknown message type: {kind}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if turn and not turn.done():
+            turn.cancel()
@@ -1,17 +1,109 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends
-import tempfile
-from src.flows import diagnosis_flow
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+from typing import List
+from src.flows import (
+    BATCH_MAX_IMAGES,
+    batch_diagnosis_stream,
+    diagnosis_flow,
+    diagnosis_stream,
+)
 from src.auth.auth_utils import get_current_user
+from src.ext_apis.provider_registry import provider_registry
+from src.ext_apis.resilience import REQUEST_DEADLINE, deadline
+from src.services.diagnosis_cache import diagnosis_cache
+from src.services.image_service import ImageQualityError, normalize_image
+from src.services.location_service import parse_lat_lon_from_location
+from src.services.prescreen_service import prescreen
 
 router = APIRouter(prefix="/api/crop-health", tags=["Crop Health"])
 
 
+@router.post("/diagnose")
+async def analyze_crop_health(
+    image: UploadFile = File(...), current_user=Depends(get_current_user)
+):
+    lat, lon = parse_lat_lon_from_location(current_user.location) or (None, None)
+    data = await image.read()
+    try:
+        with deadline(REQUEST_DEADLINE):
+            result = await diagnosis_flow(data, lat, lon)
+    except ImageQualityError as e:
+        raise HTTPException(status_code=422, detail=e.detail)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return result
 
-@router.post("/diagnose", dependencies=[Depends(get_current_user)])
-async def analyze_crop_health(image: UploadFile = File(...)):
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp.write(await image.read())
-        tmp_path = tmp.name
 
-    result = await diagnosis_flow(tmp_path)
-    return result
\ No newline at end of file
+@router.post("/diagnose/stream")
+async def analyze_crop_health_stream(
+    image: UploadFile = File(...), current_user=Depends(get_current_user)
+):
+    """
+    Server-sent events version of /diagnose: provider results as they arrive,
+    the insight once enough providers answered, late results as refinements,
+    then the complete result (see flows.diagnosis_stream).
+    """
+    lat, lon = parse_lat_lon_from_location(current_user.location) or (None, None)
+    try:
+        normalized = await asyncio.to_thread(normalize_image, await image.read())
+    except ImageQualityError as e:
+        raise HTTPException(status_code=422, detail=e.detail)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def event_generator():
+        try:
+            async for event, data in diagnosis_stream(normalized, lat, lon):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            print(f"Streaming diagnosis failed: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+
+@router.post("/diagnose/batch")
+async def analyze_field_batch(
+    images: List[UploadFile] = File(...), current_user=Depends(get_current_user)
+):
+    """
+    Field-scouting diagnosis of up to BATCH_MAX_IMAGES photos, streamed as
+    NDJSON: one {"event": ...} object per line for each photo as it is
+    rejected, skipped as a duplicate or diagnosed, then one "summary" for the
+    whole field (see flows.batch_diagnosis_stream).
+    """
+    if len(images) > BATCH_MAX_IMAGES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Send at most {BATCH_MAX_IMAGES} photos per batch",
+        )
+    lat, lon = parse_lat_lon_from_location(current_user.location) or (None, None)
+    uploads = [await image.read() for image in images]
+
+    async def ndjson_generator():
+        try:
+            async for event, data in batch_diagnosis_stream(uploads, lat, lon):
+                yield json.dumps({"event": event, **data}) + "\n"
+        except Exception as e:
+            print(f"Batch diagnosis failed: {e}")
+            yield json.dumps({"event": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(ndjson_generator(), media_type="application/x-ndjson")
+
+
+@router.get("/cache/metrics", dependencies=[Depends(get_current_user)])
+def diagnosis_cache_metrics():
+    return diagnosis_cache.metrics()
+
+
+@router.get("/prescreen/metrics", dependencies=[Depends(get_current_user)])
+def prescreen_metrics():
+    return prescreen.metrics()
+
+
+@router.get("/providers/metrics", dependencies=[Depends(get_current_user)])
+def provider_metrics():
+    """Latency, error rate, breaker state and skip/hedge decisions per provider."""
+    return provider_registry.metrics()
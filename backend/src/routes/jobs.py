@@ -0,0 +1,155 @@
+from fastapi import APIRouter, Depends, File, Header, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+from typing import Optional
+from src.auth.auth_utils import get_current_user
+from src.flows import cached_diagnosis, recommend_crops_flow, recommend_fertilizer_flow
+from src.models.jobs import CropRecommendationJob, FertilizerRecommendationJob
+from src.services.image_service import (
+    ImageQualityError,
+    NormalizedImage,
+    normalize_image,
+)
+from src.services.job_queue import TERMINAL_STATUSES, job_queue, job_response
+from src.services.location_service import parse_lat_lon_from_location
+
+router = APIRouter(prefix="/api/jobs", tags=["Jobs"])
+
+
+async def run_diagnosis_job(params: dict, payload: Optional[bytes]) -> dict:
+    image = NormalizedImage(data=payload, **params["image"])
+    return await cached_diagnosis(image, params["latitude"], params["longitude"])
+
+
+async def run_crop_recommendation_job(params: dict, payload: Optional[bytes]) -> dict:
+    return await recommend_crops_flow(**params)
+
+
+async def run_fertilizer_recommendation_job(
+    params: dict, payload: Optional[bytes]
+) -> dict:
+    return await recommend_fertilizer_flow(**params)
+
+
+job_queue.register("diagnosis", run_diagnosis_job)
+job_queue.register("recommend_crops", run_crop_recommendation_job)
+job_queue.register("recommend_fertilizer", run_fertilizer_recommendation_job)
+
+
+def submitted(job) -> dict:
+    return {
+        **job_response(job),
+        "status_url": f"{router.prefix}/{job.job_id}",
+        "events_url": f"{router.prefix}/{job.job_id}/events",
+    }
+
+
+@router.post("/diagnose", status_code=202)
+async def submit_diagnosis(
+    image: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None),
+    current_user=Depends(get_current_user),
+):
+    """
+    Queue a crop diagnosis (see /api/crop-health/diagnose) and return its job
+    at once. Poll status_url or subscribe to events_url for the result. Send
+    the same Idempotency-Key header when retrying to get the same job back.
+    """
+    try:
+        normalized = await asyncio.to_thread(normalize_image, await image.read())
+    except ImageQualityError as e:
+        raise HTTPException(status_code=422, detail=e.detail)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    lat, lon = parse_lat_lon_from_location(current_user.location) or (None, None)
+    params = {
+        "image": {
+            "width": normalized.width,
+            "height": normalized.height,
+            "original_size": normalized.original_size,
+            "phash": normalized.phash,
+            "dhash": normalized.dhash,
+        },
+        "latitude": lat,
+        "longitude": lon,
+    }
+    job = await job_queue.submit(
+        current_user.user_id,
+        "diagnosis",
+        params,
+        normalized.data,
+        idempotency_key,
+        account_tier=current_user.account_tier,
+    )
+    return submitted(job)
+
+
+@router.post("/recommend/crops", status_code=202)
+async def submit_crop_recommendation(
+    request: CropRecommendationJob,
+    idempotency_key: Optional[str] = Header(None),
+    current_user=Depends(get_current_user),
+):
+    """Queue a crop recommendation (see /api/recommend/crops)."""
+    job = await job_queue.submit(
+        current_user.user_id,
+        "recommend_crops",
+        request.model_dump(),
+        idempotency_key=idempotency_key,
+        account_tier=current_user.account_tier,
+    )
+    return submitted(job)
+
+
+@router.post("/recommend/fertilizer", status_code=202)
+async def submit_fertilizer_recommendation(
+    request: FertilizerRecommendationJob,
+    idempotency_key: Optional[str] = Header(None),
+    current_user=Depends(get_current_user),
+):
+    """Queue a fertilizer recommendation (see /api/recommend/fertilizer)."""
+    job = await job_queue.submit(
+        current_user.user_id,
+        "recommend_fertilizer",
+        request.model_dump(),
+        idempotency_key=idempotency_key,
+        account_tier=current_user.account_tier,
+    )
+    return submitted(job)
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, current_user=Depends(get_current_user)):
+    job = await job_queue.get(job_id, current_user.user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job_response(job)
+
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str, current_user=Depends(get_current_user)):
+    """
+    Server-sent events for a job: "status" whenever it changes, then "result"
+    or "error" once it finished. Reconnecting replays the current state.
+    """
+    job = await job_queue.get(job_id, current_user.user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+
+    async def event_generator():
+        job_snapshot, status = job, None
+        while job_snapshot is not None:
+            response = job_response(job_snapshot)
+            if response["status"] != status:
+                status = response["status"]
+                yield f"event: status\ndata: {json.dumps({'job_id': job_id, 'status': status})}\n\n"
+            if status in TERMINAL_STATUSES:
+                event = "result" if status == "succeeded" else "error"
+                yield f"event: {event}\ndata: {json.dumps(response, default=str)}\n\n"
+                return
+            await job_queue.wait_for_change(job_queue.poll_interval)
+            job_snapshot = await job_queue.get(job_id, current_user.user_id)
+        yield f"event: error\ndata: {json.dumps({'detail': 'Job expired'})}\n\n"
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Query, HTTPException, Depends
+from src.ext_apis.resilience import REQUEST_DEADLINE, UpstreamUnavailable, deadline
 from src.flows import recommend_fertilizer_flow, recommend_crops_flow
 from src.auth.auth_utils import get_current_user
 
@@ -18,10 +19,13 @@ async def recommend_crops(
     current_user=Depends(get_current_user),
 ):
     try:
-        result = await recommend_crops_flow(
-            lat, lon, depth, top_k, past_days, forecast_days
-        )
+        with deadline(REQUEST_DEADLINE):
+            result = await recommend_crops_flow(
+                lat, lon, depth, top_k, past_days, forecast_days
+            )
         return {"status": "success", **result}
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -47,17 +51,20 @@ async def recommend_fertilizer(
     current_user=Depends(get_current_user),
 ):
     try:
-        result = await recommend_fertilizer_flow(
-            lat,
-            lon,
-            target_crop,
-            depth,
-            top_k,
-            past_days,
-            forecast_days,
-            previous_crop,
-            growth_stage,
-        )
+        with deadline(REQUEST_DEADLINE):
+            result = await recommend_fertilizer_flow(
+                lat,
+                lon,
+                target_crop,
+                depth,
+                top_k,
+                past_days,
+                forecast_days,
+                previous_crop,
+                growth_stage,
+            )
         return {"status": "success", **result}
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,5 +1,6 @@
 # routes/soil.py
 from fastapi import APIRouter, Query, HTTPException
+from src.ext_apis.resilience import REQUEST_DEADLINE, UpstreamUnavailable, deadline
 from src.ext_apis.soil_api import get_soil_summary_async
 
 router = APIRouter(prefix="/api/soil", tags=["Soil"])
@@ -13,7 +14,10 @@ async def get_soil_summary(
     top_k: int = Query(5, description="Number of top probable soil types to retrieve"),
 ):
     try:
-        summary = await get_soil_summary_async(lat, lon, depth, top_k)
+        with deadline(REQUEST_DEADLINE):
+            summary = await get_soil_summary_async(lat, lon, depth, top_k)
         return {"status": "success", "summary": summary}
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
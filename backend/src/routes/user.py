@@ -1,46 +1,63 @@
-from fastapi import APIRouter, HTTPException, Body, Depends
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Body, Depends
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from src.models.chat import User
-from src.db import SessionLocal
+from src.db import get_db, release_session, session_scope
 from src.db.chat_models import User as UserDB
 from src.auth.auth_utils import create_access_token, get_current_user
-from passlib.context import CryptContext
+from src.auth.passwords import password_hasher
+from src.auth.user_cache import user_cache
+from src.services.location_service import (
+    location_name_without_lookup,
+    update_user_location_name,
+)
 
 router = APIRouter(prefix="/api/user", tags=["User"])
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Columns a user can't change through their profile; the account tier is
+# set by the operators
+READ_ONLY_FIELDS = {"user_id", "password_hash", "account_tier", "created_at"}
 
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
-
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def set_location_name(db_user: UserDB, background_tasks: BackgroundTasks):
+    """
+    Store the place name for the user's location. Coordinates are geocoded in
+    a background task once the request has committed, so chat prompts can use
+    the stored name without geocoding.
+    """
+    db_user.location_name = location_name_without_lookup(db_user.location)
+    if db_user.location_name is None and db_user.location:
+        background_tasks.add_task(
+            update_user_location_name, db_user.user_id, db_user.location
+        )
 
 
 @router.post("/login")
-def login(user: dict):
-    db = SessionLocal()
-    db_user = db.query(UserDB).filter_by(email=user["email"]).first()
-    db.close()
+async def login(user: dict, db: AsyncSession = Depends(get_db)):
+    db_user = await db.scalar(select(UserDB).where(UserDB.email == user["email"]))
+    # Don't hold a connection while waiting for the password hasher
+    await release_session(db)
     if (
         not db_user
         or not db_user.password_hash
-        or not verify_password(user["password"], db_user.password_hash)
+        or not await password_hasher.verify(user["password"], db_user.password_hash)
     ):
         raise HTTPException(status_code=401, detail="Invalid email or password")
-    token = create_access_token(db_user.user_id)
+    token = create_access_token(db_user.user_id, db_user)
     return {"access_token": token, "token_type": "bearer"}
 
 
 @router.post("/complete-registration")
-def complete_user_registration(user_data: dict):
+async def complete_user_registration(
+    user_data: dict,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+):
     """
     Complete user registration with data from frontend onboarding flow
     """
 
-    db = SessionLocal()
-
     # Extract data from the request
     email = user_data.get("email")
     name = user_data.get("name")
@@ -54,14 +71,14 @@ def complete_user_registration(user_data: dict):
 
     # Validate required fields
     if not email or not password:
-        db.close()
         raise HTTPException(status_code=400, detail="Email and password are required")
 
     # Check if user already exists
-    existing = db.query(UserDB).filter_by(email=email).first()
+    existing = await db.scalar(select(UserDB).where(UserDB.email == email))
     if existing:
-        db.close()
         raise HTTPException(status_code=400, detail="Email already registered")
+    # Don't hold a connection while waiting for the password hasher
+    await release_session(db)
 
     # Convert crops_grown array to comma-separated string for database storage
     crops_grown_str = ",".join(crops_grown) if crops_grown else ""
@@ -83,7 +100,7 @@ def complete_user_registration(user_data: dict):
         user_type=user_type,
         years_experience=years_experience_int,
         main_goal=main_goal,
-        password_hash=hash_password(password),
+        password_hash=await password_hasher.hash(password),
     )
 
     print("💾 Saving user to database:")
@@ -98,16 +115,21 @@ def complete_user_registration(user_data: dict):
     print(f"🌾 Crops Grown (DB): {db_user.crops_grown}")
     print("=" * 50)
 
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    db.close()
+    try:
+        async with session_scope() as db:
+            db.add(db_user)
+            await db.flush()
+            await db.refresh(db_user)
+            set_location_name(db_user, background_tasks)
+    except IntegrityError:
+        # Registered concurrently while the password was being hashed
+        raise HTTPException(status_code=400, detail="Email already registered")
 
     # Convert back to array for API response
     crops_grown_array = db_user.crops_grown.split(",") if db_user.crops_grown else []
 
     # Create access token for the newly registered user
-    access_token = create_access_token(db_user.user_id)
+    access_token = create_access_token(db_user.user_id, db_user)
 
     return {
         "user": User(
@@ -115,11 +137,13 @@ def complete_user_registration(user_data: dict):
             name=db_user.name,
             email=db_user.email,
             location=db_user.location,
+            location_name=db_user.location_name,
             preferred_language=db_user.preferred_language,
             crops_grown=crops_grown_array,
             user_type=db_user.user_type,
             years_experience=db_user.years_experience,
             main_goal=db_user.main_goal,
+            account_tier=db_user.account_tier,
             created_at=db_user.created_at,
             updated_at=db_user.updated_at,
         ),
@@ -144,21 +168,25 @@ def get_current_user_profile(current_user=Depends(get_current_user)):
         name=current_user.name,
         email=current_user.email,
         location=current_user.location,
+        location_name=current_user.location_name,
         preferred_language=current_user.preferred_language,
         crops_grown=crops_grown_array,
         user_type=current_user.user_type,
         years_experience=current_user.years_experience,
         main_goal=current_user.main_goal,
+        account_tier=current_user.account_tier,
         created_at=current_user.created_at,
         updated_at=current_user.updated_at,
     )
 
 
 @router.get("/{user_id}")
-def get_user(user_id: str, current_user=Depends(get_current_user)):
-    db = SessionLocal()
-    db_user = db.query(UserDB).filter_by(user_id=user_id).first()
-    db.close()
+async def get_user(
+    user_id: str,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    db_user = await db.get(UserDB, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -170,19 +198,25 @@ def get_user(user_id: str, current_user=Depends(get_current_user)):
         name=db_user.name,
         email=db_user.email,
         location=db_user.location,
+        location_name=db_user.location_name,
         preferred_language=db_user.preferred_language,
         crops_grown=crops_grown_array,
         user_type=db_user.user_type,
         years_experience=db_user.years_experience,
         main_goal=db_user.main_goal,
+        account_tier=db_user.account_tier,
         created_at=db_user.created_at,
         updated_at=db_user.updated_at,
     )
 
 
 @router.patch("/{user_id}")
-def update_user(
-    user_id: str, user_data: dict = Body(...), current_user=Depends(get_current_user)
+async def update_user(
+    user_id: str,
+    background_tasks: BackgroundTasks,
+    user_data: dict = Body(...),
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
     print(f"🌱 Updating user {user_id}")
     print(f"📧 Received data: {user_data}")
@@ -196,10 +230,8 @@ def update_user(
             status_code=403, detail="Not authorized to update this user"
         )
 
-    db = SessionLocal()
-    db_user = db.query(UserDB).filter_by(user_id=user_id).first()
+    db_user = await db.get(UserDB, user_id)
     if not db_user:
-        db.close()
         raise HTTPException(status_code=404, detail="User not found")
 
     # Convert crops_grown array to string for database storage
@@ -209,12 +241,18 @@ def update_user(
 
     print(f"💾 Saving to database: {user_data}")
 
+    previous_location = db_user.location
     for field, value in user_data.items():
-        if hasattr(db_user, field):
+        if hasattr(db_user, field) and field not in READ_ONLY_FIELDS:
             setattr(db_user, field, value)
+    if db_user.location != previous_location:
+        set_location_name(db_user, background_tasks)
 
-    db.commit()
-    db.refresh(db_user)
+    await db.flush()
+    await db.refresh(db_user)
+    # Again after the commit, in case a concurrent request cached the old row
+    user_cache.invalidate(user_id)
+    background_tasks.add_task(user_cache.invalidate, user_id)
 
     print(f"✅ Updated user data:")
     print(f"   Name: {db_user.name}")
@@ -225,8 +263,6 @@ def update_user(
     print(f"   Main Goal: {db_user.main_goal}")
     print(f"   Crops Grown: {db_user.crops_grown}")
 
-    db.close()
-
     # Convert back to array for API response
     crops_grown_array = db_user.crops_grown.split(",") if db_user.crops_grown else []
 
@@ -235,24 +271,29 @@ def update_user(
         name=db_user.name,
         email=db_user.email,
         location=db_user.location,
+        location_name=db_user.location_name,
         preferred_language=db_user.preferred_language,
         crops_grown=crops_grown_array,
         user_type=db_user.user_type,
         years_experience=db_user.years_experience,
         main_goal=db_user.main_goal,
+        account_tier=db_user.account_tier,
         created_at=db_user.created_at,
         updated_at=db_user.updated_at,
     )
 
 
 @router.delete("/{user_id}")
-def delete_user(user_id: str, current_user=Depends(get_current_user)):
-    db = SessionLocal()
-    db_user = db.query(UserDB).filter_by(user_id=user_id).first()
+async def delete_user(
+    user_id: str,
+    background_tasks: BackgroundTasks,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    db_user = await db.get(UserDB, user_id)
     if not db_user:
-        db.close()
         raise HTTPException(status_code=404, detail="User not found")
-    db.delete(db_user)
-    db.commit()
-    db.close()
+    await db.delete(db_user)
+    user_cache.invalidate(user_id)
+    background_tasks.add_task(user_cache.invalidate, user_id)
     return {"detail": "User deleted successfully"}
@@ -1,153 +1,161 @@
 from fastapi import APIRouter, Query, HTTPException, Depends
+from src.ext_apis.resilience import REQUEST_DEADLINE, UpstreamUnavailable, deadline
 from src.ext_apis.weather_api import fetch_weather_summary, simplify_weather_response
 from src.auth.auth_utils import get_current_user
 from src.services.llm_service import llm_service
+from src.db import get_db, release_session, use_session
 from src.db.chat_models import WeatherCache, AITaskCache
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from src.db.chat_models import Base
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, delete, select
 import json
 from datetime import datetime, timedelta
+from typing import Optional
 import os
 
 router = APIRouter(prefix="/api/weather", tags=["Weather"])
 
 
-def get_db_session():
-    """Get database session"""
-    from src.db import SessionLocal
-
-    return SessionLocal()
-
-
-def get_cached_weather(user_id: str, lat: float, lon: float, days: int) -> dict:
+async def get_cached_weather(
+    user_id: str, lat: float, lon: float, days: int, db: Optional[AsyncSession] = None
+) -> dict:
     """Get cached weather data if available and not expired"""
-    db = get_db_session()
-    try:
-        # Check for existing cache entry
-        cache_entry = (
-            db.query(WeatherCache)
-            .filter(
-                WeatherCache.user_id == user_id,
-                WeatherCache.lat == str(lat),
-                WeatherCache.lon == str(lon),
-                WeatherCache.days == days,
-                WeatherCache.expires_at > datetime.utcnow(),
+    async with use_session(db) as db:
+        try:
+            # Check for existing cache entry
+            cache_entry = await db.scalar(
+                select(WeatherCache)
+                .where(
+                    WeatherCache.user_id == user_id,
+                    WeatherCache.lat == str(lat),
+                    WeatherCache.lon == str(lon),
+                    WeatherCache.days == days,
+                    WeatherCache.expires_at > datetime.utcnow(),
+                )
+                .limit(1)
             )
-            .first()
-        )
-
-        if cache_entry:
-            print(f"Using cached weather data for user {user_id}")
-            return json.loads(cache_entry.weather_data)
-        return None
-    except Exception as e:
-        print(f"Error getting cached weather: {e}")
-        return None
-    finally:
-        db.close()
 
-
-def save_weather_cache(
-    user_id: str, lat: float, lon: float, days: int, weather_data: dict
+            if cache_entry:
+                print(f"Using cached weather data for user {user_id}")
+                return json.loads(cache_entry.weather_data)
+            return None
+        except Exception as e:
+            print(f"Error getting cached weather: {e}")
+            return None
+
+
+async def save_weather_cache(
+    user_id: str,
+    lat: float,
+    lon: float,
+    days: int,
+    weather_data: dict,
+    db: Optional[AsyncSession] = None,
 ):
     """Save weather data to cache"""
-    db = get_db_session()
-    try:
-        # Remove old cache entries for this user/location
-        db.query(WeatherCache).filter(
-            WeatherCache.user_id == user_id,
-            WeatherCache.lat == str(lat),
-            WeatherCache.lon == str(lon),
-            WeatherCache.days == days,
-        ).delete()
-
-        # Create new cache entry
-        expires_at = datetime.utcnow() + timedelta(hours=6)  # Cache for 6 hours
-        cache_entry = WeatherCache(
-            user_id=user_id,
-            lat=str(lat),
-            lon=str(lon),
-            days=days,
-            weather_data=json.dumps(weather_data),
-            expires_at=expires_at,
-        )
+    async with use_session(db) as db:
+        try:
+            # Savepoint: a failed cache write must not undo the rest of the request
+            async with db.begin_nested():
+                # Remove old cache entries for this user/location
+                await db.execute(
+                    delete(WeatherCache).where(
+                        WeatherCache.user_id == user_id,
+                        WeatherCache.lat == str(lat),
+                        WeatherCache.lon == str(lon),
+                        WeatherCache.days == days,
+                    )
+                )
 
-        db.add(cache_entry)
-        db.commit()
-        print(f"Saved weather cache for user {user_id}")
-    except Exception as e:
-        print(f"Error saving weather cache: {e}")
-        db.rollback()
-    finally:
-        db.close()
+                # Create new cache entry
+                expires_at = datetime.utcnow() + timedelta(hours=6)  # Cache for 6 hours
+                cache_entry = WeatherCache(
+                    user_id=user_id,
+                    lat=str(lat),
+                    lon=str(lon),
+                    days=days,
+                    weather_data=json.dumps(weather_data),
+                    expires_at=expires_at,
+                )
+                db.add(cache_entry)
+            print(f"Saved weather cache for user {user_id}")
+        except Exception as e:
+            print(f"Error saving weather cache: {e}")
 
 
-def get_cached_ai_tasks(user_id: str, lat: float, lon: float, date: str) -> dict:
+async def get_cached_ai_tasks(
+    user_id: str, lat: float, lon: float, date: str, db: Optional[AsyncSession] = None
+) -> dict:
     """Get cached AI tasks if available and not expired"""
-    db = get_db_session()
-    try:
-        # Check for existing cache entry
-        cache_entry = (
-            db.query(AITaskCache)
-            .filter(
-                AITaskCache.user_id == user_id,
-                AITaskCache.lat == str(lat),
-                AITaskCache.lon == str(lon),
-                AITaskCache.date == date,
-                AITaskCache.expires_at > datetime.utcnow(),
+    async with use_session(db) as db:
+        try:
+            # Check for existing cache entry
+            cache_entry = await db.scalar(
+                select(AITaskCache)
+                .where(
+                    AITaskCache.user_id == user_id,
+                    AITaskCache.lat == str(lat),
+                    AITaskCache.lon == str(lon),
+                    AITaskCache.date == date,
+                    AITaskCache.expires_at > datetime.utcnow(),
+                )
+                .limit(1)
             )
-            .first()
-        )
 
-        if cache_entry:
-            print(f"Using cached AI tasks for user {user_id}, date {date}")
-            return {
-                "tasks": json.loads(cache_entry.tasks_data),
-                "weather_context": json.loads(cache_entry.weather_context),
-            }
-        return None
-    except Exception as e:
-        print(f"Error getting cached AI tasks: {e}")
-        return None
-    finally:
-        db.close()
-
-
-def save_ai_task_cache(
-    user_id: str, lat: float, lon: float, date: str, tasks: list, weather_context: dict
+            if cache_entry:
+                print(f"Using cached AI tasks for user {user_id}, date {date}")
+                return {
+                    "tasks": json.loads(cache_entry.tasks_data),
+                    "weather_context": json.loads(cache_entry.weather_context),
+                }
+            return None
+        except Exception as e:
+            print(f"Error getting cached AI tasks: {e}")
+            return None
+
+
+async def save_ai_task_cache(
+    user_id: str,
+    lat: float,
+    lon: float,
+    date: str,
+    tasks: list,
+    weather_context: dict,
+    db: Optional[AsyncSession] = None,
 ):
     """Save AI tasks to cache"""
-    db = get_db_session()
-    try:
-        # Remove old cache entries for this user/date
-        db.query(AITaskCache).filter(
-            AITaskCache.user_id == user_id,
-            AITaskCache.lat == str(lat),
-            AITaskCache.lon == str(lon),
-            AITaskCache.date == date,
-        ).delete()
-
-        # Create new cache entry
-        expires_at = datetime.utcnow() + timedelta(hours=24)  # Cache for 24 hours
-        cache_entry = AITaskCache(
-            user_id=user_id,
-            lat=str(lat),
-            lon=str(lon),
-            date=date,
-            tasks_data=json.dumps(tasks),
-            weather_context=json.dumps(weather_context),
-            expires_at=expires_at,
-        )
+    async with use_session(db) as db:
+        try:
+            # Savepoint: a failed cache write must not undo the rest of the request
+            async with db.begin_nested():
+                # Remove old cache entries for this user/date
+                await db.execute(
+                    delete(AITaskCache).where(
+                        AITaskCache.user_id == user_id,
+                        AITaskCache.lat == str(lat),
+                        AITaskCache.lon == str(lon),
+                        AITaskCache.date == date,
+                    )
+                )
 
-        db.add(cache_entry)
-        db.commit()
-        print(f"Saved AI task cache for user {user_id}, date {date}")
-    except Exception as e:
-        print(f"Error saving AI task cache: {e}")
-        db.rollback()
-    finally:
-        db.close()
+                # Create new cache entry
+                expires_at = datetime.utcnow() + timedelta(
+                    hours=24
+                )  # Cache for 24 hours
+                cache_entry = AITaskCache(
+                    user_id=user_id,
+                    lat=str(lat),
+                    lon=str(lon),
+                    date=date,
+                    tasks_data=json.dumps(tasks),
+                    weather_context=json.dumps(weather_context),
+                    expires_at=expires_at,
+                )
+                db.add(cache_entry)
+            print(f"Saved AI task cache for user {user_id}, date {date}")
+        except Exception as e:
+            print(f"Error saving AI task cache: {e}")
 
 
 @router.get("/forecast")
@@ -159,8 +167,11 @@ async def get_weather_forecast(
     current_user=Depends(get_current_user),
 ):
     try:
-        result = await fetch_weather_summary(lat, lon, past_days, forecast_days)
+        with deadline(REQUEST_DEADLINE):
+            result = await fetch_weather_summary(lat, lon, past_days, forecast_days)
         return result
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except RuntimeError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
@@ -173,6 +184,7 @@ async def get_calendar_weather(
     lon: float = Query(..., description="Longitude in decimal degrees"),
     days: int = Query(31, ge=1, le=90, description="Number of days to fetch"),
     current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Get daily weather data for calendar view
@@ -180,18 +192,22 @@ async def get_calendar_weather(
     """
     try:
         # Check for cached weather data first
-        cached_weather = get_cached_weather(current_user.user_id, lat, lon, days)
+        cached_weather = await get_cached_weather(
+            current_user.user_id, lat, lon, days, db=db
+        )
         if cached_weather:
             print(f"Returning cached weather data for user {current_user.user_id}")
             return cached_weather
+        await release_session(db)
 
         # Get weather data for the specified number of days
         # OpenMeteo requires at least one of past_days or forecast_days to be > 0
         # For calendar view, we'll get forecast data (max 16 days)
         forecast_days = min(days, 16)  # OpenMeteo max forecast is 16 days
-        weather_data = await fetch_weather_summary(
-            lat, lon, past_days=0, forecast_days=forecast_days
-        )
+        with deadline(REQUEST_DEADLINE):
+            weather_data = await fetch_weather_summary(
+                lat, lon, past_days=0, forecast_days=forecast_days
+            )
 
         # Map weather codes to human-readable descriptions and icons
         weather_code_mapping = {
@@ -368,10 +384,12 @@ async def get_calendar_weather(
         }
 
         # Save to cache for future requests
-        save_weather_cache(current_user.user_id, lat, lon, days, result)
+        await save_weather_cache(current_user.user_id, lat, lon, days, result)
 
         return result
 
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         print(f"Calendar weather error: {str(e)}")
         print(f"Parameters: lat={lat}, lon={lon}, days={days}")
@@ -386,6 +404,7 @@ async def get_ai_task_recommendations(
     lon: float = Query(..., description="Longitude in decimal degrees"),
     date: str = Query(..., description="Date in YYYY-MM-DD format"),
     current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Get AI-powered task recommendations for a specific date
@@ -393,7 +412,9 @@ async def get_ai_task_recommendations(
     """
     try:
         # Check for cached AI tasks first
-        cached_tasks = get_cached_ai_tasks(current_user.user_id, lat, lon, date)
+        cached_tasks = await get_cached_ai_tasks(
+            current_user.user_id, lat, lon, date, db=db
+        )
         if cached_tasks:
             print(
                 f"Returning cached AI tasks for user {current_user.user_id}, date {date}"
@@ -406,11 +427,13 @@ async def get_ai_task_recommendations(
                 "ai_generated": True,
                 "cached": True,
             }
+        await release_session(db)
 
         # Get weather data for the specific date
-        weather_data = await fetch_weather_summary(
-            lat, lon, past_days=0, forecast_days=16
-        )
+        with deadline(REQUEST_DEADLINE):
+            weather_data = await fetch_weather_summary(
+                lat, lon, past_days=0, forecast_days=16
+            )
 
         # Find weather data for the specific date
         target_date = None
@@ -528,7 +551,7 @@ Focus on practical, actionable advice that a farmer can implement immediately.
 """
 
         # Call LLM for task recommendations
-        llm_result = llm_service.send_message(prompt)
+        llm_result = await llm_service.asend_message(prompt)
         llm_response = llm_result.get("response", "")
 
         if not llm_response:
@@ -536,7 +559,9 @@ Focus on practical, actionable advice that a farmer can implement immediately.
             # Fallback to basic tasks
             tasks = create_fallback_tasks(target_date, user_crops)
             # Save fallback tasks to cache
-            save_ai_task_cache(current_user.user_id, lat, lon, date, tasks, target_date)
+            await save_ai_task_cache(
+                current_user.user_id, lat, lon, date, tasks, target_date
+            )
             return {
                 "status": "success",
                 "date": date,
@@ -558,7 +583,7 @@ Focus on practical, actionable advice that a farmer can implement immediately.
                 # Fallback: create basic tasks based on weather
                 tasks = create_fallback_tasks(target_date, user_crops)
                 # Save fallback tasks to cache
-                save_ai_task_cache(
+                await save_ai_task_cache(
                     current_user.user_id, lat, lon, date, tasks, target_date
                 )
 
@@ -568,10 +593,14 @@ Focus on practical, actionable advice that a farmer can implement immediately.
             # Fallback to basic tasks
             tasks = create_fallback_tasks(target_date, user_crops)
             # Save fallback tasks to cache
-            save_ai_task_cache(current_user.user_id, lat, lon, date, tasks, target_date)
+            await save_ai_task_cache(
+                current_user.user_id, lat, lon, date, tasks, target_date
+            )
 
         # Save to cache for future requests
-        save_ai_task_cache(current_user.user_id, lat, lon, date, tasks, target_date)
+        await save_ai_task_cache(
+            current_user.user_id, lat, lon, date, tasks, target_date
+        )
 
         return {
             "status": "success",
@@ -581,6 +610,8 @@ Focus on practical, actionable advice that a farmer can implement immediately.
             "ai_generated": True,
         }
 
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         print(f"AI task recommendation error: {str(e)}")
         raise HTTPException(
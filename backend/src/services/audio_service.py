@@ -1,129 +1,61 @@
-import os
-import base64
-import json
-import tempfile
+import io
+import threading
+import time
 import logging
-from typing import Optional, Dict, Any
-from google.cloud import speech_v1
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional, Dict, Any, List
 from pathlib import Path
 from dotenv import load_dotenv
+from src.services.gcp_credentials import LazyGCPClient
 from src.services.transalation_service import (
     translation_service,
     translation_fallback_service,
 )
 
+if TYPE_CHECKING:
+    import numpy as np
+    from google.cloud import speech_v1
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Uploads are decoded locally and sent to Speech-to-Text as 16 kHz mono LINEAR16
+TARGET_SAMPLE_RATE = 16000
+# Energy-based voice activity detection settings
+VAD_FRAME_MS = 30
+VAD_PADDING_MS = 200
+VAD_THRESHOLD_DB = 12.0  # above the estimated noise floor
+VAD_MIN_ENERGY_DB = 30.0
+# Only the first few seconds are needed to detect the spoken language
+LANGUAGE_SAMPLE_SECONDS = 5
+# Synchronous recognize() only accepts about a minute of audio; longer clips
+# are split at quiet points and the chunks are recognized in parallel
+SYNC_RECOGNIZE_MAX_SECONDS = 55
+STT_CHUNK_SECONDS = 50
+STT_CHUNK_SEARCH_SECONDS = 5
+STT_MAX_PARALLEL_CHUNKS = 4
 
-class AudioService:
-    def __init__(self):
-        self.speech_client = None
-        self.key_file_path = None
-        self._initialize_client()
-
-    def _initialize_client(self):
-        """Initialize Google Cloud Speech client with proper error handling"""
-        try:
-            # First try environment variable (for Railway deployment)
-            key_b64 = os.getenv("GCP_CREDENTIALS_B64")
-
-            if key_b64:
-                # Decode base64 credentials
-                try:
-                    key_json = base64.b64decode(key_b64).decode("utf-8")
-                    # Validate JSON
-                    json.loads(key_json)
-
-                    # Create temporary file with proper encoding
-                    temp_file = tempfile.NamedTemporaryFile(
-                        delete=False, suffix=".json", mode="w", encoding="utf-8"
-                    )
-                    temp_file.write(key_json)
-                    temp_file.close()
-                    self.key_file_path = temp_file.name
-                    logger.info(
-                        "Using credentials from GCP_CREDENTIALS_B64 environment variable"
-                    )
-
-                    # Initialize Google Cloud client
-                    try:
-                        self.speech_client = (
-                            speech_v1.SpeechClient.from_service_account_json(
-                                self.key_file_path
-                            )
-                        )
-                        logger.info(
-                            "Google Cloud Speech client initialized successfully"
-                        )
-                        return
-                    except Exception as e:
-                        logger.error(
-                            f"Failed to initialize Google Cloud Speech client: {e}"
-                        )
-                        self.speech_client = None
-
-                except Exception as e:
-                    logger.error(f"Failed to decode base64 credentials: {e}")
-
-            # If environment variable fails, try local file (for development)
-            key_path = os.path.join(os.path.dirname(__file__), "../../", "gcp_key.json")
-            key_path = os.path.abspath(key_path)
-
-            if os.path.exists(key_path):
-                try:
-                    # Validate JSON
-                    with open(key_path, "r", encoding="utf-8") as f:
-                        json.load(f)
-                    self.key_file_path = key_path
-                    logger.info(f"Using credentials from local file: {key_path}")
-
-                    # Initialize Google Cloud client
-                    try:
-                        self.speech_client = (
-                            speech_v1.SpeechClient.from_service_account_json(
-                                self.key_file_path
-                            )
-                        )
-                        logger.info(
-                            "Google Cloud Speech client initialized successfully"
-                        )
-                        return
-                    except Exception as e:
-                        logger.error(
-                            f"Failed to initialize Google Cloud Speech client: {e}"
-                        )
-                        self.speech_client = None
-
-                except Exception as e:
-                    logger.error(f"Error reading local credentials file: {e}")
-
-            # If both fail, log warning
-            logger.warning(
-                "No valid Google Cloud credentials found. Speech-to-text will not work."
-            )
-            return
 
+def _create_speech_client(credentials):
+    from google.cloud import speech_v1
 
-        except Exception as e:
-            logger.error(
-                f"Unexpected error during Google Cloud Speech initialization: {e}"
-            )
-            self.speech_client = None
+    return speech_v1.SpeechClient(credentials=credentials)
 
-    def __del__(self):
-        """Clean up temporary file on object destruction"""
-        if self.key_file_path and os.path.exists(self.key_file_path):
-            # Only delete if it's a temporary file (not a local credential file)
-            if self.key_file_path.startswith(tempfile.gettempdir()):
-                try:
-                    os.unlink(self.key_file_path)
-                except Exception as e:
-                    logger.warning(
-                        f"Failed to clean up temporary credentials file: {e}"
-                    )
 
-    def detect_audio_language(self, audio_content: bytes) -> str:
+class AudioService:
+    def __init__(self):
+        self._speech_client = LazyGCPClient(
+            "Google Cloud Speech", _create_speech_client
+        )
+
+    @property
+    def speech_client(self):
+        """Speech client, constructed on first use with the shared credentials"""
+        return self._speech_client.get()
+
+    def detect_audio_language(
+        self, audio_content: bytes, format_type: str = "webm_opus"
+    ) -> str:
         """
         Detect the language of audio content
         """
@@ -132,7 +64,7 @@ class AudioService:
                 logger.warning("Speech client not initialized, defaulting to English")
                 return "en"
 
-            sample_text = self._extract_sample_text(audio_content)
+            sample_text = self._extract_sample_text(audio_content, format_type)
             if sample_text:
                 print(f"📝 Sample text for language detection: '{sample_text}'")
                 try:
@@ -151,7 +83,9 @@ class AudioService:
             print(f"Error detecting audio language: {e}")
             return "en"
 
-    def _extract_sample_text(self, audio_content: bytes) -> Optional[str]:
+    def _extract_sample_text(
+        self, audio_content: bytes, format_type: str = "webm_opus"
+    ) -> Optional[str]:
         """
         Extract a small sample of text from audio for language detection
         """
@@ -159,17 +93,13 @@ class AudioService:
             if not self.speech_client:
                 return None
 
+            from google.cloud import speech_v1
+
             # Create audio object
             audio = speech_v1.RecognitionAudio(content=audio_content)
 
-            # Configure recognition for a short sample
-            config = speech_v1.RecognitionConfig(
-                encoding=speech_v1.RecognitionConfig.AudioEncoding.WEBM_OPUS,
-                sample_rate_hertz=48000,  # WebM OPUS typically uses 48kHz
-                language_code="en-US",  # Start with English
-                max_alternatives=1,
-                enable_automatic_punctuation=True,
-            )
+            # Configure recognition for a short sample, starting with English
+            config = self._build_recognition_config(format_type, "en-US")
 
             response = self.speech_client.recognize(config=config, audio=audio)
 
@@ -200,6 +130,8 @@ class AudioService:
                     "confidence": 0.0,
                 }
 
+            from google.cloud import speech_v1
+
             # Create audio object
             audio = speech_v1.RecognitionAudio(content=audio_content)
 
@@ -254,17 +186,26 @@ class AudioService:
             print(f"Error in speech_to_text: {e}")
             return {"success": False, "error": str(e), "text": "", "confidence": 0.0}
 
-    def process_audio_message(self, audio_content: bytes) -> Dict[str, Any]:
+    def process_audio_message(
+        self, audio_content: bytes, stop: Optional[threading.Event] = None
+    ) -> Dict[str, Any]:
         """
         Process audio message: detect language and convert to text
         Args:
             audio_content: Raw audio bytes
+            stop: Set by the caller to skip the remaining recognition work
         Returns:
             Dict with transcribed text, detected language, and confidence
         """
         try:
+            pcm_audio = self._preprocess_audio(audio_content)
+
             # First, try to detect language from a small sample
-            detected_lang = self.detect_audio_language(audio_content)
+            if pcm_audio is not None:
+                sample = pcm_audio[: TARGET_SAMPLE_RATE * 2 * LANGUAGE_SAMPLE_SECONDS]
+                detected_lang = self.detect_audio_language(sample, "linear16")
+            else:
+                detected_lang = self.detect_audio_language(audio_content)
             print(f"🌍 Detected language: {detected_lang}")
 
             # Map detected language to Speech API language codes
@@ -280,22 +221,9 @@ class AudioService:
             speech_lang_code = lang_mapping.get(detected_lang, "en-US")
             print(f"🎤 Using speech language code: {speech_lang_code}")
 
-            # Try WebM OPUS format with detected language
-            result = self._try_speech_recognition(
-                audio_content, "webm_opus", speech_lang_code
-            )
-
-            if not result["success"]:
-                # Fallback to LINEAR16 format with detected language
-                result = self._try_speech_recognition(
-                    audio_content, "linear16", speech_lang_code
-                )
-
-            if not result["success"]:
-                # Final fallback to FLAC format with detected language
-                result = self._try_speech_recognition(
-                    audio_content, "flac", speech_lang_code
-                )
+            if stop is not None and stop.is_set():
+                return self._cancelled_result(detected_lang)
+            result = self._recognize(audio_content, pcm_audio, speech_lang_code, stop)
 
             # Add detected language to result
             result["detected_language"] = detected_lang
@@ -314,13 +242,17 @@ class AudioService:
 
 
     def process_audio_message_with_language(
-        self, audio_content: bytes, language: str
+        self,
+        audio_content: bytes,
+        language: str,
+        stop: Optional[threading.Event] = None,
     ) -> Dict[str, Any]:
         """
         Process audio message with specified language
         Args:
             audio_content: Raw audio bytes
             language: Language code (en, am, no, sw, es, id)
+            stop: Set by the caller to skip the remaining recognition work
         Returns:
             Dict with transcribed text, detected language, and confidence
         """
@@ -338,22 +270,11 @@ class AudioService:
             speech_lang_code = lang_mapping.get(language, "en-US")
             print(f"🎤 Using specified language code: {speech_lang_code}")
 
-            # Try WebM OPUS format with specified language
-            result = self._try_speech_recognition(
-                audio_content, "webm_opus", speech_lang_code
-            )
+            pcm_audio = self._preprocess_audio(audio_content)
 
-            if not result["success"]:
-                # Fallback to LINEAR16 format with specified language
-                result = self._try_speech_recognition(
-                    audio_content, "linear16", speech_lang_code
-                )
-
-            if not result["success"]:
-                # Final fallback to FLAC format with specified language
-                result = self._try_speech_recognition(
-                    audio_content, "flac", speech_lang_code
-                )
+            if stop is not None and stop.is_set():
+                return self._cancelled_result(language)
+            result = self._recognize(audio_content, pcm_audio, speech_lang_code, stop)
 
             # Add specified language to result
             result["detected_language"] = language
@@ -370,6 +291,261 @@ class AudioService:
                 "detected_language": language,
             }
 
+    def _cancelled_result(self, language: str) -> Dict[str, Any]:
+        return {
+            "success": False,
+            "error": "Cancelled",
+            "text": "",
+            "confidence": 0.0,
+            "detected_language": language,
+        }
+
+    def _recognize(
+        self,
+        audio_content: bytes,
+        pcm_audio: Optional[bytes],
+        language_code: str,
+        stop: Optional[threading.Event] = None,
+    ) -> Dict[str, Any]:
+        """
+        Recognize preprocessed PCM when available, otherwise fall back to
+        trying the raw upload with each supported encoding
+        """
+        if pcm_audio is not None:
+            duration = len(pcm_audio) / (TARGET_SAMPLE_RATE * 2)
+            if duration <= SYNC_RECOGNIZE_MAX_SECONDS:
+                return self._try_speech_recognition(
+                    pcm_audio, "linear16", language_code
+                )
+            return self._recognize_long_audio(pcm_audio, language_code, stop)
+
+        # Try WebM OPUS format first
+        result = self._try_speech_recognition(audio_content, "webm_opus", language_code)
+
+        if not result["success"]:
+            # Fallback to LINEAR16 format
+            result = self._try_speech_recognition(
+                audio_content, "linear16", language_code
+            )
+
+        if not result["success"]:
+            # Final fallback to FLAC format
+            result = self._try_speech_recognition(audio_content, "flac", language_code)
+
+        return result
+
+    def _recognize_long_audio(
+        self,
+        pcm_audio: bytes,
+        language_code: str,
+        stop: Optional[threading.Event] = None,
+    ) -> Dict[str, Any]:
+        """
+        Recognize audio longer than the synchronous limit by splitting it into
+        chunks and recognizing them in parallel. Chunks not yet started when
+        `stop` is set are skipped.
+        """
+        chunks = self._split_pcm(pcm_audio)
+        print(
+            f"✂️ Long recording ({len(pcm_audio) / (TARGET_SAMPLE_RATE * 2):.1f}s), "
+            f"recognizing {len(chunks)} chunks in parallel"
+        )
+
+        with ThreadPoolExecutor(
+            max_workers=min(len(chunks), STT_MAX_PARALLEL_CHUNKS)
+        ) as executor:
+            results = list(
+                executor.map(
+                    lambda chunk: (
+                        self._cancelled_result(language_code)
+                        if stop is not None and stop.is_set()
+                        else self._try_speech_recognition(
+                            chunk, "linear16", language_code
+                        )
+                    ),
+                    chunks,
+                )
+            )
+
+        recognized = [
+            (result, len(chunk))
+            for result, chunk in zip(results, chunks)
+            if result["success"]
+        ]
+        # A chunk without speech is fine, any other failure leaves a gap
+        failed = [
+            result["error"]
+            for result in results
+            if not result["success"] and result.get("error") != "No speech detected"
+        ]
+        if failed:
+            print(f"❌ {len(failed)} of {len(chunks)} chunks failed: {failed[0]}")
+            return {
+                "success": False,
+                "error": f"{len(failed)} of {len(chunks)} chunks failed: {failed[0]}",
+                "text": " ".join(result["text"].strip() for result, _ in recognized),
+                "confidence": 0.0,
+                "partial": bool(recognized),
+                "chunks": len(chunks),
+            }
+        if not recognized:
+            return results[0]
+
+        # Weight each chunk's confidence by its length
+        total_length = sum(length for _, length in recognized)
+        return {
+            "success": True,
+            "text": " ".join(result["text"].strip() for result, _ in recognized),
+            "confidence": sum(
+                result["confidence"] * length for result, length in recognized
+            )
+            / total_length,
+            "format_used": "linear16",
+            "chunks": len(chunks),
+        }
+
+    def _split_pcm(self, pcm_audio: bytes) -> List[bytes]:
+        """
+        Split LINEAR16 audio into chunks of at most STT_CHUNK_SECONDS, cutting at
+        the quietest frame near each boundary so words are not split
+        """
+        import numpy as np
+
+        samples = np.frombuffer(pcm_audio, dtype="<i2")
+        frame_len = TARGET_SAMPLE_RATE * VAD_FRAME_MS // 1000
+        max_len = STT_CHUNK_SECONDS * TARGET_SAMPLE_RATE
+        search_len = STT_CHUNK_SEARCH_SECONDS * TARGET_SAMPLE_RATE
+
+        chunks = []
+        start = 0
+        while len(samples) - start > max_len:
+            search_start = start + max_len - search_len
+            window = samples[search_start : start + max_len].astype(np.float32)
+            n_frames = len(window) // frame_len
+            energy = np.mean(
+                window[: n_frames * frame_len].reshape(n_frames, frame_len) ** 2,
+                axis=1,
+            )
+            cut = search_start + int(np.argmin(energy)) * frame_len + frame_len // 2
+            chunks.append(samples[start:cut].tobytes())
+            start = cut
+        chunks.append(samples[start:].tobytes())
+        return chunks
+
+    def _preprocess_audio(self, audio_content: bytes) -> Optional[bytes]:
+        """
+        Decode the upload, downmix to 16 kHz mono and trim leading/trailing silence.
+        Returns LINEAR16 bytes, or None if the audio could not be decoded locally.
+        """
+        pcm = self._decode_to_pcm(audio_content)
+        if pcm is None:
+            return None
+
+        trimmed = self._trim_silence(pcm)
+        if len(trimmed) == 0:
+            # Soft or far-field speech can sit below the VAD threshold
+            # throughout; let Speech-to-Text decide instead of dropping it
+            print("🎚️ No frame above the VAD threshold, keeping the whole clip")
+            trimmed = pcm
+        pcm_bytes = trimmed.astype("<i2").tobytes()
+        print(
+            f"🎚️ Preprocessed audio: {len(audio_content)} bytes upload -> "
+            f"{len(pcm_bytes)} bytes PCM "
+            f"({len(pcm) / TARGET_SAMPLE_RATE:.1f}s -> {len(trimmed) / TARGET_SAMPLE_RATE:.1f}s)"
+        )
+        return pcm_bytes
+
+    def _decode_to_pcm(self, audio_content: bytes) -> Optional["np.ndarray"]:
+        """
+        Decode any container/codec ffmpeg understands (WebM/OPUS, OGG, WAV, MP3, ...)
+        into 16 kHz mono int16 samples
+        """
+        import numpy as np
+
+        try:
+            import av
+        except ImportError:
+            logger.warning("PyAV not installed, sending audio to STT unprocessed")
+            return None
+
+        try:
+            chunks = []
+            with av.open(io.BytesIO(audio_content)) as container:
+                resampler = av.AudioResampler(
+                    format="s16", layout="mono", rate=TARGET_SAMPLE_RATE
+                )
+                for frame in container.decode(audio=0):
+                    for resampled in resampler.resample(frame):
+                        chunks.append(resampled.to_ndarray().reshape(-1))
+                # Flush samples buffered inside the resampler
+                for resampled in resampler.resample(None):
+                    chunks.append(resampled.to_ndarray().reshape(-1))
+
+            if not chunks:
+                return None
+            return np.concatenate(chunks).astype(np.int16)
+        except Exception as e:
+            logger.warning(f"Local audio decoding failed: {e}")
+            return None
+
+    def _trim_silence(self, pcm: "np.ndarray") -> "np.ndarray":
+        """
+        Trim leading and trailing silence using frame energy relative to the
+        recording's noise floor
+        """
+        import numpy as np
+
+        frame_len = TARGET_SAMPLE_RATE * VAD_FRAME_MS // 1000
+        n_frames = len(pcm) // frame_len
+        if n_frames == 0:
+            return pcm
+
+        samples = pcm[: n_frames * frame_len].astype(np.float32)
+        # The first difference acts as a cheap high-pass filter, so low-frequency
+        # wind rumble does not count as speech
+        emphasized = np.diff(samples, prepend=samples[:1])
+        frames = emphasized.reshape(n_frames, frame_len)
+        energy_db = 10 * np.log10(np.mean(frames**2, axis=1) + 1e-9)
+
+        noise_floor = np.percentile(energy_db, 10)
+        threshold = max(noise_floor + VAD_THRESHOLD_DB, VAD_MIN_ENERGY_DB)
+        voiced = np.flatnonzero(energy_db > threshold)
+        if voiced.size == 0:
+            return pcm[:0]
+
+        padding = VAD_PADDING_MS // VAD_FRAME_MS
+        start = max(voiced[0] - padding, 0) * frame_len
+        end = min((voiced[-1] + padding + 1) * frame_len, len(pcm))
+        return pcm[start:end]
+
+    def _build_recognition_config(
+        self, format_type: str, language_code: str
+    ) -> Optional["speech_v1.RecognitionConfig"]:
+        """Build a recognition config for the given audio format"""
+        from google.cloud import speech_v1
+
+        encodings = {
+            "webm_opus": (speech_v1.RecognitionConfig.AudioEncoding.WEBM_OPUS, 48000),
+            "linear16": (
+                speech_v1.RecognitionConfig.AudioEncoding.LINEAR16,
+                TARGET_SAMPLE_RATE,
+            ),
+            "flac": (speech_v1.RecognitionConfig.AudioEncoding.FLAC, 16000),
+        }
+        if format_type not in encodings:
+            return None
+
+        encoding, sample_rate = encodings[format_type]
+        return speech_v1.RecognitionConfig(
+            encoding=encoding,
+            sample_rate_hertz=sample_rate,
+            language_code=language_code,
+            max_alternatives=1,
+            enable_automatic_punctuation=True,
+            enable_word_time_offsets=False,
+            enable_word_confidence=True,
+        )
+
     def _try_speech_recognition(
         self, audio_content: bytes, format_type: str, language_code: str = "en-US"
     ) -> Dict[str, Any]:
@@ -385,6 +561,8 @@ class AudioService:
                     "confidence": 0.0,
                 }
 
+            from google.cloud import speech_v1
+
             # Create audio object
             audio = speech_v1.RecognitionAudio(content=audio_content)
 
@@ -392,41 +570,17 @@ class AudioService:
 
 
             # Configure based on format type
-            if format_type == "webm_opus":
-                config = speech_v1.RecognitionConfig(
-                    encoding=speech_v1.RecognitionConfig.AudioEncoding.WEBM_OPUS,
-                    sample_rate_hertz=48000,
-                    language_code=language_code,
-                    max_alternatives=1,
-                    enable_automatic_punctuation=True,
-                    enable_word_time_offsets=False,
-                    enable_word_confidence=True,
-                )
-            elif format_type == "linear16":
-                config = speech_v1.RecognitionConfig(
-                    encoding=speech_v1.RecognitionConfig.AudioEncoding.LINEAR16,
-                    sample_rate_hertz=16000,
-                    language_code=language_code,
-                    max_alternatives=1,
-                    enable_automatic_punctuation=True,
-                    enable_word_time_offsets=False,
-                    enable_word_confidence=True,
-                )
-            elif format_type == "flac":
-                config = speech_v1.RecognitionConfig(
-                    encoding=speech_v1.RecognitionConfig.AudioEncoding.FLAC,
-                    sample_rate_hertz=16000,
-                    language_code=language_code,
-                    max_alternatives=1,
-                    enable_automatic_punctuation=True,
-                    enable_word_time_offsets=False,
-                    enable_word_confidence=True,
-                )
-            else:
+            config = self._build_recognition_config(format_type, language_code)
+            if config is None:
                 return {"success": False, "error": f"Unsupported format: {format_type}"}
 
             # Perform recognition
+            started = time.perf_counter()
             response = self.speech_client.recognize(config=config, audio=audio)
+            print(
+                f"⏱️ STT {format_type}: sent {len(audio_content)} bytes, "
+                f"latency {time.perf_counter() - started:.2f}s"
+            )
 
             if not response.results:
                 return {
@@ -436,13 +590,23 @@ class AudioService:
                     "confidence": 0.0,
                 }
 
-            # Get the best result
+            # Each result covers a consecutive portion of the audio
             result = response.results[0]
             is_final = getattr(result, "is_final", True)
 
             if is_final:
-                transcript = result.alternatives[0].transcript
-                confidence = result.alternatives[0].confidence
+                alternatives = [
+                    r.alternatives[0] for r in response.results if r.alternatives
+                ]
+                if not alternatives:
+                    return {
+                        "success": False,
+                        "error": "No speech detected",
+                        "text": "",
+                        "confidence": 0.0,
+                    }
+                transcript = " ".join(a.transcript.strip() for a in alternatives)
+                confidence = sum(a.confidence for a in alternatives) / len(alternatives)
 
                 print(f"✅ Success with format: {format_type}")
                 print(f"📝 Transcript: {transcript}")
@@ -1,24 +1,34 @@
 import uuid
 from datetime import datetime
-from typing import Dict, Optional, List
+from typing import Optional, List
 from src.models.chat import ChatSession, ChatMessage
-from sqlalchemy.orm import Session
-from src.db import SessionLocal
-from src.db.chat_models import ChatSessionDB, ChatMessageDB
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.db import use_session
+from src.db.chat_models import ChatSessionDB, ChatMessageDB, ChatSummaryDB
 
 
 class ChatSessionManager:
-    def start_session(self, user_id: Optional[str] = None) -> ChatSession:
-        db: Session = SessionLocal()
+    """
+    Every method takes an optional `db` session. When given (the request
+    session from get_db) changes are committed by its owner; otherwise the
+    call runs in its own unit of work.
+    """
+
+    async def start_session(
+        self, user_id: Optional[str] = None, db: Optional[AsyncSession] = None
+    ) -> ChatSession:
         session_id = str(uuid.uuid4())
         now = datetime.utcnow()
-        db_session = ChatSessionDB(
-            session_id=session_id, created_at=now, updated_at=now, user_id=user_id
-        )
-        db.add(db_session)
-        db.commit()
-        db.refresh(db_session)
-        db.close()
+        async with use_session(db) as db:
+            db.add(
+                ChatSessionDB(
+                    session_id=session_id,
+                    created_at=now,
+                    updated_at=now,
+                    user_id=user_id,
+                )
+            )
         return ChatSession(
             session_id=session_id,
             messages=[],
@@ -27,74 +37,96 @@ class ChatSessionManager:
             user_id=user_id,
         )
 
-    def get_session(self, session_id: str) -> Optional[ChatSession]:
-        db: Session = SessionLocal()
-        db_session = db.query(ChatSessionDB).filter_by(session_id=session_id).first()
-        if not db_session:
-            db.close()
-            return None
-        messages = [
+    async def _load_messages(
+        self, db: AsyncSession, session_id: str, limit: Optional[int] = None
+    ) -> List[ChatMessage]:
+        """
+        Load messages oldest-first. With a limit only the latest `limit` rows are
+        fetched, using the (session_id, timestamp) index.
+        """
+        query = select(ChatMessageDB).where(ChatMessageDB.session_id == session_id)
+        if limit is None:
+            rows = list(await db.scalars(query.order_by(ChatMessageDB.timestamp)))
+        else:
+            rows = list(
+                await db.scalars(
+                    query.order_by(ChatMessageDB.timestamp.desc()).limit(limit)
+                )
+            )
+            rows.reverse()
+        return [
             ChatMessage(sender=m.sender, message=m.message, timestamp=m.timestamp)
-            for m in db_session.messages
+            for m in rows
         ]
-        session = ChatSession(
-            session_id=db_session.session_id,
-            messages=messages,
-            created_at=db_session.created_at,
-            updated_at=db_session.updated_at,
-            user_id=db_session.user_id,
-        )
-        db.close()
-        return session
 
-    def add_message(
-        self, session_id: str, sender: str, message: str
+    async def get_session(
+        self,
+        session_id: str,
+        message_limit: Optional[int] = None,
+        db: Optional[AsyncSession] = None,
     ) -> Optional[ChatSession]:
-        db: Session = SessionLocal()
-        db_session = db.query(ChatSessionDB).filter_by(session_id=session_id).first()
-        if not db_session:
-            db.close()
-            return None
-        msg = ChatMessageDB(
-            id=str(uuid.uuid4()),
-            session_id=session_id,
-            sender=sender,
-            message=message,
-            timestamp=datetime.utcnow(),
-        )
-        db_session.messages.append(msg)
-        db_session.updated_at = datetime.utcnow()
-        db.add(msg)
-        db.commit()
-        db.refresh(db_session)
-        messages = [
-            ChatMessage(sender=m.sender, message=m.message, timestamp=m.timestamp)
-            for m in db_session.messages
-        ]
-        session = ChatSession(
-            session_id=db_session.session_id,
-            messages=messages,
-            created_at=db_session.created_at,
-            updated_at=db_session.updated_at,
-            user_id=db_session.user_id,
-        )
-        db.close()
-        return session
-
-    def get_history(self, session_id: str) -> Optional[List[ChatMessage]]:
-        db: Session = SessionLocal()
-        db_session = db.query(ChatSessionDB).filter_by(session_id=session_id).first()
-        if not db_session:
-            db.close()
-            return None
-        messages = [
-            ChatMessage(sender=m.sender, message=m.message, timestamp=m.timestamp)
-            for m in db_session.messages
-        ]
-        db.close()
-        return messages
+        """
+        Get a session with its most recent `message_limit` messages
+        (the full history if no limit is given) and its rolling summary.
+        """
+        async with use_session(db) as db:
+            db_session = await db.get(ChatSessionDB, session_id)
+            if not db_session:
+                return None
+            db_summary = await db.get(ChatSummaryDB, session_id)
+            return ChatSession(
+                session_id=db_session.session_id,
+                messages=await self._load_messages(db, session_id, message_limit),
+                created_at=db_session.created_at,
+                updated_at=db_session.updated_at,
+                user_id=db_session.user_id,
+                summary=db_summary.summary if db_summary else None,
+            )
 
+    async def add_message(
+        self,
+        session_id: str,
+        sender: str,
+        message: str,
+        db: Optional[AsyncSession] = None,
+    ) -> Optional[ChatMessage]:
+        """
+        Append a message to the session. Returns None if the session does not
+        exist. Nothing is written until the unit of work commits, so a request
+        does not hold a write lock while it waits on the LLM.
+        """
+        now = datetime.utcnow()
+        async with use_session(db) as db:
+            db_session = await db.get(ChatSessionDB, session_id)
+            if not db_session:
+                return None
+            db_session.updated_at = now
+            db.add(
+                ChatMessageDB(
+                    id=str(uuid.uuid4()),
+                    session_id=session_id,
+                    sender=sender,
+                    message=message,
+                    timestamp=now,
+                )
+            )
+        return ChatMessage(sender=sender, message=message, timestamp=now)
 
-chat_session_manager = ChatSessionManager()
+    async def get_history(
+        self,
+        session_id: str,
+        limit: Optional[int] = None,
+        db: Optional[AsyncSession] = None,
+    ) -> Optional[List[ChatMessage]]:
+        async with use_session(db) as db:
+            exists = await db.scalar(
+                select(ChatSessionDB.session_id).where(
+                    ChatSessionDB.session_id == session_id
+                )
+            )
+            if not exists:
+                return None
+            return await self._load_messages(db, session_id, limit)
 
 
+chat_session_manager = ChatSessionManager()
@@ -0,0 +1,149 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import Iterable, List, Optional
+from dotenv import load_dotenv
+from sqlalchemy import select
+from src.db import session_scope
+from src.db.chat_models import ChatMessageDB, ChatSummaryDB
+from src.ext_apis.rate_limiter import BACKGROUND, priority
+from src.services.llm_service import llm_service
+
+load_dotenv()
+
+# Prompt budget for summary + recent messages, in estimated tokens
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "800"))
+# Fold new messages into the summary once this many turns (user + llm) piled up
+CHAT_SUMMARY_EVERY_TURNS = int(os.getenv("CHAT_SUMMARY_EVERY_TURNS", "4"))
+# Upper bound on messages folded per update, keeps the summary prompt small
+SUMMARY_MAX_NEW_MESSAGES = 40
+SUMMARY_MAX_WORDS = 120
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+class ConversationMemory:
+    """
+    Keeps a per-session rolling summary of the conversation and builds the
+    history part of the prompt from that summary plus the latest messages,
+    trimmed to a token budget.
+    """
+
+    def __init__(self, token_budget: int = CHAT_HISTORY_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self._pending = {}  # session_id -> running update task
+
+    def format_history(self, summary: Optional[str], lines: Iterable[str]) -> str:
+        """
+        Summary first, then as many of the most recent lines as fit the budget.
+        Lines are "sender: message" strings, oldest first.
+        """
+        remaining = self.token_budget
+        parts = []
+        if summary:
+            remaining -= estimate_tokens(summary)
+            parts.append(f"Summary of earlier conversation:\n{summary}")
+
+        recent: List[str] = []
+        for line in reversed(list(lines)):
+            cost = estimate_tokens(line)
+            if cost > remaining:
+                break
+            remaining -= cost
+            recent.append(line)
+        if recent:
+            parts.append("Recent messages:\n" + "\n".join(reversed(recent)))
+        return "\n\n".join(parts)
+
+    def history_for_session(self, session) -> str:
+        """format_history for a ChatSession loaded with a message window."""
+        return self.format_history(
+            session.summary, (f"{m.sender}: {m.message}" for m in session.messages)
+        )
+
+    def schedule_update(self, session_id: str) -> Optional[asyncio.Task]:
+        """
+        Refresh the session summary in a background task. At most one update
+        per session runs at a time; returns None if one is already in progress.
+        """
+        if session_id in self._pending:
+            return None
+        task = asyncio.create_task(self._run_update(session_id))
+        self._pending[session_id] = task
+        return task
+
+    async def run_update(self, session_id: str) -> Optional[str]:
+        """Awaitable schedule_update, e.g. for FastAPI BackgroundTasks."""
+        task = self.schedule_update(session_id)
+        return await task if task is not None else None
+
+    async def _run_update(self, session_id: str) -> Optional[str]:
+        try:
+            return await self.update_summary(session_id)
+        except Exception as e:
+            print(f"⚠️ Summary update failed for session {session_id}: {e}")
+            return None
+        finally:
+            self._pending.pop(session_id, None)
+
+    async def update_summary(self, session_id: str) -> Optional[str]:
+        """
+        Fold messages newer than the stored summary into it once at least
+        CHAT_SUMMARY_EVERY_TURNS turns have accumulated. Returns the new summary,
+        or None if nothing was updated.
+        """
+        async with session_scope() as db:
+            db_summary = await db.get(ChatSummaryDB, session_id)
+            query = select(ChatMessageDB).where(ChatMessageDB.session_id == session_id)
+            if db_summary and db_summary.summarized_until:
+                query = query.where(
+                    ChatMessageDB.timestamp > db_summary.summarized_until
+                )
+            new_messages = list(
+                await db.scalars(
+                    query.order_by(ChatMessageDB.timestamp).limit(
+                        SUMMARY_MAX_NEW_MESSAGES
+                    )
+                )
+            )
+        if len(new_messages) < CHAT_SUMMARY_EVERY_TURNS * 2:
+            return None
+
+        # No connection is held while the model writes the summary
+        previous = db_summary.summary if db_summary else ""
+        transcript = "\n".join(f"{m.sender}: {m.message}" for m in new_messages)
+        prompt = f"""You maintain the running memory of a conversation between a farmer and an agricultural assistant.
+Update the summary with the new messages. Keep facts that matter for future advice: crops, location, symptoms, diagnoses, advice given, the farmer's plans and open questions.
+Write at most {SUMMARY_MAX_WORDS} words of plain text, no preamble.
+
+Current summary:
+{previous or "(none)"}
+
+New messages:
+{transcript}"""
+
+        with priority(BACKGROUND):
+            result = await llm_service.asend_message(
+                prompt, temperature=0.0, max_output_tokens=320
+            )
+        summary = (result.get("response") or "").strip()
+        if not summary:
+            return None
+
+        async with session_scope() as db:
+            await db.merge(
+                ChatSummaryDB(
+                    session_id=session_id,
+                    summary=summary,
+                    summarized_until=new_messages[-1].timestamp,
+                    updated_at=datetime.utcnow(),
+                )
+            )
+        print(f"📝 Summarized {len(new_messages)} messages for session {session_id}")
+        return summary
+
+
+conversation_memory = ConversationMemory()
@@ -0,0 +1,210 @@
+import asyncio
+import copy
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import delete, select
+from src.db import session_scope
+from src.db.chat_models import DiagnosisCache
+from src.services.image_service import NormalizedImage, hamming_distance
+
+load_dotenv()
+
+# Seconds a diagnosis is reused for a resent or near-identical photo (0 disables)
+DIAGNOSIS_CACHE_TTL = float(os.getenv("DIAGNOSIS_CACHE_TTL", str(24 * 3600)))
+# Largest pHash + dHash Hamming distance (of 128 bits) still treated as the same
+# photo. Recompressed or re-brightened resends are 0-2, burst shots about 10,
+# different leaves 50+.
+DIAGNOSIS_CACHE_MAX_DISTANCE = int(os.getenv("DIAGNOSIS_CACHE_MAX_DISTANCE", "12"))
+# Location is rounded to this many decimals (1 ≈ 11 km) before matching
+DIAGNOSIS_CACHE_LOCATION_DECIMALS = int(
+    os.getenv("DIAGNOSIS_CACHE_LOCATION_DECIMALS", "1")
+)
+
+
+class _LeaderCancelled(Exception):
+    """The request a coalesced waiter was waiting on was cancelled."""
+
+
+class DiagnosisResultCache:
+    """
+    Reuses diagnosis_flow results (provider results plus the LLM insight) for
+    photos whose perceptual hashes are within DIAGNOSIS_CACHE_MAX_DISTANCE of
+    one diagnosed at the same rounded location. Identical requests arriving
+    while the first one is still running wait for its result; if that request
+    is cancelled, one of them runs the diagnosis instead.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DIAGNOSIS_CACHE_TTL,
+        max_distance: int = DIAGNOSIS_CACHE_MAX_DISTANCE,
+        location_decimals: int = DIAGNOSIS_CACHE_LOCATION_DECIMALS,
+    ):
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.location_decimals = location_decimals
+        self._inflight: Dict[str, List[Tuple[int, int, asyncio.Future]]] = {}
+        self.hits = 0
+        self.near_hits = 0  # hits on a similar but not identical photo
+        self.coalesced = 0
+        self.misses = 0
+
+    def location_key(
+        self, latitude: Optional[float], longitude: Optional[float]
+    ) -> str:
+        if latitude is None or longitude is None:
+            return ""
+        d = self.location_decimals
+        return f"{round(latitude, d):.{d}f},{round(longitude, d):.{d}f}"
+
+    def distance(self, image: NormalizedImage, phash: int, dhash: int) -> int:
+        return hamming_distance(image.phash, phash) + hamming_distance(
+            image.dhash, dhash
+        )
+
+    async def lookup(self, image: NormalizedImage, location_key: str) -> Optional[dict]:
+        """Result of the closest unexpired entry within max_distance, if any."""
+        try:
+            async with session_scope() as db:
+                entries = list(
+                    await db.scalars(
+                        select(DiagnosisCache).where(
+                            DiagnosisCache.location_key == location_key,
+                            DiagnosisCache.expires_at > datetime.utcnow(),
+                        )
+                    )
+                )
+        except Exception as e:
+            print(f"Error reading diagnosis cache: {e}")
+            return None
+
+        best, best_distance = None, self.max_distance + 1
+        for entry in entries:
+            distance = self.distance(image, int(entry.phash, 16), int(entry.dhash, 16))
+            if distance < best_distance:
+                best, best_distance = entry, distance
+        if best is None:
+            return None
+        self.hits += 1
+        if best_distance > 0:
+            self.near_hits += 1
+        print(f"♻️ Reusing cached diagnosis (hash distance {best_distance})")
+        return json.loads(best.result_data)
+
+    @staticmethod
+    def cacheable(result: dict) -> bool:
+        """
+        False for a result without an LLM insight (the call failed or was rate
+        limited) or with providers that failed, were skipped or timed out; a
+        retry may well do better.
+        """
+        if result.get("structured_insight") is None and result.get("insight") is None:
+            return False
+        return not result.get("raw_results", {}).get("unavailable")
+
+    async def store(self, image: NormalizedImage, location_key: str, result: dict):
+        """Cache `result` for similar photos, unless it is not cacheable."""
+        if not self.cacheable(result):
+            return
+        try:
+            async with session_scope() as db:
+                now = datetime.utcnow()
+                await db.execute(
+                    delete(DiagnosisCache).where(
+                        DiagnosisCache.location_key == location_key,
+                        DiagnosisCache.expires_at <= now,
+                    )
+                )
+                db.add(
+                    DiagnosisCache(
+                        location_key=location_key,
+                        phash=f"{image.phash:016x}",
+                        dhash=f"{image.dhash:016x}",
+                        result_data=json.dumps(result),
+                        expires_at=now + timedelta(seconds=self.ttl),
+                    )
+                )
+        except Exception as e:
+            print(f"Error saving diagnosis cache: {e}")
+
+    async def get_or_run(
+        self,
+        image: NormalizedImage,
+        latitude: Optional[float],
+        longitude: Optional[float],
+        run: Callable[[], Awaitable[dict]],
+    ) -> dict:
+        """Cached result for a similar photo, or the result of `run()` (then cached)."""
+        if self.ttl <= 0:
+            return await run()
+        location_key = self.location_key(latitude, longitude)
+        cached = await self.lookup(image, location_key)
+        if cached is not None:
+            return cached
+
+        while True:
+            inflight = self._inflight.setdefault(location_key, [])
+            future = next(
+                (
+                    future
+                    for phash, dhash, future in inflight
+                    if self.distance(image, phash, dhash) <= self.max_distance
+                ),
+                None,
+            )
+            if future is None:
+                break
+            self.coalesced += 1
+            try:
+                return copy.deepcopy(await asyncio.shield(future))
+            except _LeaderCancelled:
+                # The request we waited on went away; run it ourselves (or
+                # wait on whichever waiter got there first)
+                self.coalesced -= 1
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting; don't warn about an unretrieved exception
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        entry = (image.phash, image.dhash, future)
+        inflight.append(entry)
+        try:
+            result = await run()
+        except asyncio.CancelledError:
+            # Waiters are not cancelled with us, they retry
+            future.set_exception(_LeaderCancelled())
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            inflight.remove(entry)
+            if not inflight:
+                self._inflight.pop(location_key, None)
+
+        await self.store(image, location_key, result)
+        return result
+
+    def metrics(self) -> dict:
+        requests = self.hits + self.coalesced + self.misses
+        return {
+            "requests": requests,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": (
+                round((self.hits + self.coalesced) / requests, 4) if requests else 0.0
+            ),
+            "ttl_seconds": self.ttl,
+            "max_distance": self.max_distance,
+            "location_decimals": self.location_decimals,
+        }
+
+
+diagnosis_cache = DiagnosisResultCache()
@@ -0,0 +1,207 @@
+import csv
+import gzip
+import io
+import math
+import os
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Tuple
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    import numpy as np
+
+load_dotenv()
+
+# Populated places with their admin areas for the countries we serve, from the
+# GeoNames cities1000 dump (CC BY 4.0): lat,lon,name,admin1,admin2,country_code
+GAZETTEER_PATH = os.getenv(
+    "GAZETTEER_PATH", str(Path(__file__).parent.parent / "data" / "gazetteer.csv.gz")
+)
+# Points farther than this from every gazetteer entry go to the online geocoder
+GAZETTEER_MAX_DISTANCE_KM = float(os.getenv("GAZETTEER_MAX_DISTANCE_KM", "50"))
+
+EARTH_RADIUS_KM = 6371.0
+COUNTRY_NAMES = {
+    "ES": "Spain",
+    "ET": "Ethiopia",
+    "ID": "Indonesia",
+    "KE": "Kenya",
+    "NO": "Norway",
+    "RW": "Rwanda",
+    "TZ": "Tanzania",
+    "UG": "Uganda",
+}
+
+
+def to_unit_vectors(lat, lon) -> "np.ndarray":
+    """Degrees to points on the unit sphere, so straight-line distance ranks like great-circle distance."""
+    import numpy as np
+
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    return np.column_stack(
+        (np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat))
+    )
+
+
+def chord_to_km(chord_sq: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_sq) / 2))
+
+
+def km_to_chord_sq(km: float) -> float:
+    return (2 * math.sin(min(math.pi / 2, km / EARTH_RADIUS_KM / 2))) ** 2
+
+
+class KDTree:
+    """
+    Static k-d tree over 3-D points. Built with NumPy into an implicit layout:
+    the node of a range [lo, hi) is the median at (lo + hi) // 2, splitting on
+    the axis stored for it. Small ranges are leaf buckets scanned directly.
+    """
+
+    LEAF_SIZE = 8
+
+    def __init__(self, points: "np.ndarray"):
+        import numpy as np
+
+        n = len(points)
+        self.order = np.arange(n)
+        axes = np.zeros(n, dtype=np.int8)
+        ranges = [(0, n)]
+        while ranges:
+            lo, hi = ranges.pop()
+            if hi - lo <= self.LEAF_SIZE:
+                continue
+            idx = self.order[lo:hi]
+            pts = points[idx]
+            axis = int(np.argmax(np.ptp(pts, axis=0)))
+            mid = (lo + hi) // 2
+            self.order[lo:hi] = idx[np.argpartition(pts[:, axis], mid - lo)]
+            axes[mid] = axis
+            ranges.append((lo, mid))
+            ranges.append((mid + 1, hi))
+        # Plain lists: per-element access is much faster than on arrays
+        self._points: List[List[float]] = points[self.order].tolist()
+        self._axes: List[int] = axes.tolist()
+
+    def nearest(
+        self, query: Tuple[float, float, float], max_sq: float = math.inf
+    ) -> Tuple[int, float]:
+        """
+        Index (into the input points) of the nearest point and its squared
+        distance. Only points closer than sqrt(max_sq) are considered, which
+        prunes most of the tree; returns (-1, max_sq) if there are none.
+        """
+        points, axes, leaf = self._points, self._axes, self.LEAF_SIZE
+        qx, qy, qz = query
+        best, best_sq = -1, max_sq
+        stack = [(0, len(points), 0.0)]
+        while stack:
+            lo, hi, bound_sq = stack.pop()
+            if bound_sq >= best_sq:
+                continue
+            if hi - lo <= leaf:
+                for i in range(lo, hi):
+                    x, y, z = points[i]
+                    d = (x - qx) ** 2 + (y - qy) ** 2 + (z - qz) ** 2
+                    if d < best_sq:
+                        best, best_sq = i, d
+                continue
+            mid = (lo + hi) // 2
+            x, y, z = points[mid]
+            d = (x - qx) ** 2 + (y - qy) ** 2 + (z - qz) ** 2
+            if d < best_sq:
+                best, best_sq = mid, d
+            diff = query[axes[mid]] - points[mid][axes[mid]]
+            if diff < 0:
+                near, far = (lo, mid), (mid + 1, hi)
+            else:
+                near, far = (mid + 1, hi), (lo, mid)
+            stack.append((*far, diff * diff))
+            stack.append((*near, 0.0))
+        if best < 0:
+            return -1, max_sq
+        return int(self.order[best]), best_sq
+
+
+class Gazetteer:
+    """
+    Offline reverse geocoder: nearest populated place from the local
+    gazetteer, loaded once into a k-d tree.
+    """
+
+    def __init__(
+        self,
+        path: str = GAZETTEER_PATH,
+        max_distance_km: float = GAZETTEER_MAX_DISTANCE_KM,
+    ):
+        self.path = path
+        self.max_distance_km = max_distance_km
+        self.places: List[Tuple[str, str, str, str]] = []
+        self._tree: Optional[KDTree] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._tree is not None
+
+    def load(self):
+        """Read the gazetteer and build the tree. Safe to call more than once."""
+        with self._lock:
+            if self._tree is not None:
+                return
+            # numpy is slow to import, load it only when needed
+            import numpy as np
+
+            with gzip.open(self.path, "rb") as f:
+                reader = csv.DictReader(io.TextIOWrapper(f, encoding="utf-8"))
+                rows = list(reader)
+            coords = np.array(
+                [(float(r["lat"]), float(r["lon"])) for r in rows], dtype=np.float64
+            )
+            self.places = [
+                (r["name"], r["admin1"], r["admin2"], r["country_code"]) for r in rows
+            ]
+            self._tree = KDTree(to_unit_vectors(coords[:, 0], coords[:, 1]))
+            print(f"🗺️ Gazetteer loaded with {len(rows)} places")
+
+    def reverse_geocode(self, lat: float, lon: float) -> Optional[dict]:
+        """
+        Nearest gazetteer place within max_distance_km, or None. Requires
+        load() to have run.
+        """
+        if self._tree is None:
+            return None
+        lat_r, lon_r = math.radians(lat), math.radians(lon)
+        query = (
+            math.cos(lat_r) * math.cos(lon_r),
+            math.cos(lat_r) * math.sin(lon_r),
+            math.sin(lat_r),
+        )
+        index, chord_sq = self._tree.nearest(
+            query, km_to_chord_sq(self.max_distance_km)
+        )
+        if index < 0:
+            return None
+        distance_km = chord_to_km(chord_sq)
+        name, admin1, admin2, country_code = self.places[index]
+        return {
+            "name": name,
+            "admin1": admin1,
+            "admin2": admin2,
+            "country_code": country_code,
+            "country": COUNTRY_NAMES.get(country_code, country_code),
+            "distance_km": round(distance_km, 2),
+        }
+
+    def place_name(self, lat: float, lon: float) -> Optional[str]:
+        """Readable "place, district, country" like format_place_name for Photon."""
+        place = self.reverse_geocode(lat, lon)
+        if place is None:
+            return None
+        parts = [place["name"], place["admin2"] or place["admin1"], place["country"]]
+        return ", ".join(p for p in parts if p)
+
+
+gazetteer = Gazetteer()
@@ -0,0 +1,106 @@
+import os
+import base64
+import json
+import logging
+import threading
+from typing import Any, Callable, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+LOCAL_KEY_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "../../", "gcp_key.json")
+)
+
+
+class GCPCredentialProvider:
+    """
+    Loads the Google Cloud service account once, on first use, and shares the
+    credentials between the Speech, Text-to-Speech and Translate clients.
+    Credentials are built in memory, no key file is written to disk.
+    """
+
+    def __init__(self):
+        self._credentials = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def get_credentials(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._credentials = self._load_credentials()
+                    self._loaded = True
+        return self._credentials
+
+    def _load_credentials(self):
+        from google.oauth2 import service_account
+
+        # First try environment variable (for Railway deployment)
+        key_b64 = os.getenv("GCP_CREDENTIALS_B64")
+        if key_b64:
+            try:
+                info = json.loads(base64.b64decode(key_b64).decode("utf-8"))
+                credentials = service_account.Credentials.from_service_account_info(
+                    info
+                )
+                logger.info(
+                    "Using credentials from GCP_CREDENTIALS_B64 environment variable"
+                )
+                return credentials
+            except Exception as e:
+                logger.error(f"Failed to decode base64 credentials: {e}")
+
+        # If environment variable fails, try local file (for development)
+        if os.path.exists(LOCAL_KEY_PATH):
+            try:
+                credentials = service_account.Credentials.from_service_account_file(
+                    LOCAL_KEY_PATH
+                )
+                logger.info(f"Using credentials from local file: {LOCAL_KEY_PATH}")
+                return credentials
+            except Exception as e:
+                logger.error(f"Error reading local credentials file: {e}")
+
+        logger.warning("No valid Google Cloud credentials found.")
+        return None
+
+
+class LazyGCPClient:
+    """
+    Constructs a Google Cloud client with the shared credentials the first time
+    it is needed. get() returns None if no credentials are available or the
+    client could not be created.
+    """
+
+    def __init__(self, name: str, factory: Callable[[Any], Any]):
+        self.name = name
+        self._factory = factory
+        self._client = None
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[Any]:
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    self._client = self._create()
+                    self._initialized = True
+        return self._client
+
+    def _create(self) -> Optional[Any]:
+        credentials = gcp_credentials.get_credentials()
+        if credentials is None:
+            logger.warning(f"{self.name} client not available without credentials")
+            return None
+        try:
+            client = self._factory(credentials)
+            logger.info(f"{self.name} client initialized successfully")
+            return client
+        except Exception as e:
+            logger.error(f"Failed to initialize {self.name} client: {e}")
+            return None
+
+
+gcp_credentials = GCPCredentialProvider()
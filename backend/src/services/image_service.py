@@ -0,0 +1,237 @@
+import io
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+
+load_dotenv()
+
+# Resolution window accepted by all diagnosis providers (DeepLeaf needs at least
+# 200 px on the short side; larger images only add upload time)
+IMAGE_MIN_SIDE = int(os.getenv("IMAGE_MIN_SIDE", "200"))
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1600"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# Refuse decompression bombs before decoding
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))
+
+# Local photo quality gate, run before any provider call
+IMAGE_QUALITY_CHECK = os.getenv("IMAGE_QUALITY_CHECK", "true").lower() == "true"
+QUALITY_SAMPLE_SIDE = 400  # checks run on a copy reduced to about this size
+QUALITY_MIN_SIDE = int(os.getenv("QUALITY_MIN_SIDE", "160"))
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", "40"))
+QUALITY_MIN_LEAF_FRACTION = float(os.getenv("QUALITY_MIN_LEAF_FRACTION", "0.05"))
+QUALITY_DARK_LEVEL, QUALITY_BRIGHT_LEVEL = 50, 215  # mean brightness bounds
+QUALITY_MAX_CLIPPED_FRACTION = 0.4  # share of pure black or white pixels
+
+
+@dataclass(frozen=True)
+class NormalizedImage:
+    """An upload decoded once, upright, resized into the window and JPEG-encoded."""
+
+    data: bytes
+    width: int
+    height: int
+    original_size: int  # bytes of the upload
+    phash: int  # 64-bit perceptual hashes, see perceptual_hashes
+    dhash: int
+
+    content_type = "image/jpeg"
+    filename = "image.jpg"
+
+
+def _target_size(width: int, height: int) -> tuple:
+    scale = 1.0
+    if max(width, height) > IMAGE_MAX_SIDE:
+        scale = IMAGE_MAX_SIDE / max(width, height)
+    elif min(width, height) < IMAGE_MIN_SIDE:
+        scale = min(
+            IMAGE_MIN_SIDE / min(width, height), IMAGE_MAX_SIDE / max(width, height)
+        )
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix(n: int) -> "np.ndarray":
+    import numpy as np
+
+    k = np.arange(n)[:, None]
+    return np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+
+
+def _bits_to_int(bits: "np.ndarray") -> int:
+    import numpy as np
+
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+
+def perceptual_hashes(img: "Image.Image") -> tuple:
+    """
+    64-bit pHash (sign of the low DCT frequencies against their median) and
+    dHash (horizontal gradient signs) of an image. Resends and burst shots of
+    the same leaf differ in only a few bits; see hamming_distance.
+    """
+    import numpy as np
+    from PIL import Image
+
+    gray = img.convert("L")
+    pixels = np.asarray(gray.resize((32, 32), Image.LANCZOS), dtype=np.float64)
+    dct = _dct_matrix(32)
+    low = (dct @ pixels @ dct.T)[:8, :8]
+    phash = _bits_to_int(low > np.median(low))
+    pixels = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    dhash = _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+    return phash, dhash
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class ImageQualityError(ValueError):
+    """The photo is unusable for diagnosis; `issues` says how to retake it."""
+
+    def __init__(self, issues: list):
+        self.issues = issues
+        super().__init__(" ".join(issue["message"] for issue in issues))
+
+    @property
+    def detail(self) -> dict:
+        """Response detail asking for a retake, one hint per failed check."""
+        return {"message": str(self), "retake": True, "issues": self.issues}
+
+
+def assess_image_quality(img: "Image.Image", original_size: tuple) -> list:
+    """
+    Cheap checks for photos no provider can diagnose: too small, blurry,
+    badly exposed or with hardly any leaf-coloured area. Works on a downscaled
+    copy with NumPy. Returns a list of {"code", "message", "value"} issues.
+    """
+    import numpy as np
+
+    issues = []
+    if min(original_size) < QUALITY_MIN_SIDE:
+        issues.append(
+            {
+                "code": "low_resolution",
+                "message": "The photo is too small. Take it with the full camera resolution.",
+                "value": min(original_size),
+            }
+        )
+
+    factor = max(1, max(img.size) // QUALITY_SAMPLE_SIDE)
+    sample = img.reduce(factor) if factor > 1 else img
+    gray = np.asarray(sample.convert("L"), dtype=np.float32)
+
+    brightness = float(gray.mean())
+    clipped_dark = float((gray <= 5).mean())
+    clipped_bright = float((gray >= 250).mean())
+    exposure_ok = False
+    if brightness < QUALITY_DARK_LEVEL or clipped_dark > QUALITY_MAX_CLIPPED_FRACTION:
+        issues.append(
+            {
+                "code": "too_dark",
+                "message": "The photo is too dark. Take it in daylight or move out of the shade.",
+                "value": round(brightness, 1),
+            }
+        )
+    elif (
+        brightness > QUALITY_BRIGHT_LEVEL
+        or clipped_bright > QUALITY_MAX_CLIPPED_FRACTION
+    ):
+        issues.append(
+            {
+                "code": "overexposed",
+                "message": "The photo is too bright. Avoid direct sunlight on the leaf or the flash.",
+                "value": round(brightness, 1),
+            }
+        )
+    else:
+        exposure_ok = True
+    if not exposure_ok:
+        # Edges and colours of a badly exposed photo say nothing; retake first
+        return issues
+
+    # Variance of the Laplacian: low when there are no sharp edges
+    laplacian = (
+        gray[:-2, 1:-1]
+        + gray[2:, 1:-1]
+        + gray[1:-1, :-2]
+        + gray[1:-1, 2:]
+        - 4 * gray[1:-1, 1:-1]
+    )
+    sharpness = float(laplacian.var())
+    if sharpness < QUALITY_MIN_SHARPNESS:
+        issues.append(
+            {
+                "code": "blurry",
+                "message": "The photo is blurry. Hold the phone steady and tap the leaf to focus.",
+                "value": round(sharpness, 1),
+            }
+        )
+
+    # Green, yellow and brown hues with some saturation: healthy and diseased
+    # leaf tissue. PIL hue runs 0-255 over the colour wheel.
+    hsv = np.asarray(sample.convert("HSV"))
+    hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    leaf = (hue >= 12) & (hue <= 130) & (saturation >= 40) & (value >= 30)
+    leaf_fraction = float(leaf.mean())
+    if leaf_fraction < QUALITY_MIN_LEAF_FRACTION:
+        issues.append(
+            {
+                "code": "no_leaf",
+                "message": "No leaf is visible. Fill the frame with the affected leaf or plant.",
+                "value": round(leaf_fraction, 3),
+            }
+        )
+    return issues
+
+
+def normalize_image(data: bytes) -> NormalizedImage:
+    """
+    Decode an uploaded photo in memory, apply its EXIF orientation, fit it into
+    the providers' resolution window and re-encode it as JPEG. CPU-bound; call
+    it from a worker thread. Raises ValueError for data that is not an image
+    and ImageQualityError for photos that fail the quality gate.
+    """
+    # PIL is slow to import, load it only when a photo comes in
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        original_size = img.size
+        if img.width * img.height > IMAGE_MAX_PIXELS:
+            raise ValueError("Image is too large")
+        size = _target_size(img.width, img.height)
+        if size[0] < img.width and img.format == "JPEG":
+            # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding
+            img.draft("RGB", size)
+        img = ImageOps.exif_transpose(img)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ValueError("Unsupported or corrupt image") from e
+
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if IMAGE_QUALITY_CHECK:
+        issues = assess_image_quality(img, original_size)
+        if issues:
+            raise ImageQualityError(issues)
+    size = _target_size(img.width, img.height)
+    if size != img.size:
+        img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+    phash, dhash = perceptual_hashes(img)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    return NormalizedImage(
+        data=buffer.getvalue(),
+        width=img.width,
+        height=img.height,
+        original_size=len(data),
+        phash=phash,
+        dhash=dhash,
+    )
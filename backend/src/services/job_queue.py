@@ -0,0 +1,338 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.db import session_scope
+from src.db.chat_models import JobDB
+from src.ext_apis.rate_limiter import BATCH, priority
+from src.ext_apis.resilience import deadline
+from src.services.llm_scheduler import llm_caller
+
+load_dotenv()
+
+# Seconds a job (and its result) is kept after it was submitted
+JOB_TTL = float(os.getenv("JOB_TTL", str(24 * 3600)))
+# Jobs of a type running at once in this process: "type:limit,..."; types not
+# listed get one worker
+JOB_CONCURRENCY = os.getenv(
+    "JOB_CONCURRENCY", "diagnosis:4,recommend_crops:2,recommend_fertilizer:2"
+)
+# A run taking longer fails; a job left "running" twice as long (its process
+# died) is queued again, up to JOB_MAX_ATTEMPTS runs in total
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+# How often idle workers look for jobs submitted by other processes
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+JobHandler = Callable[[dict, Optional[bytes]], Awaitable[dict]]
+
+
+def parse_concurrency(spec: str) -> Dict[str, int]:
+    limits = {}
+    for item in spec.split(","):
+        job_type, _, limit = item.partition(":")
+        if job_type.strip() and limit.strip():
+            limits[job_type.strip()] = max(1, int(limit))
+    return limits
+
+
+def job_response(job: JobDB) -> dict:
+    """Status (and result or error, once finished) of a job for the API."""
+    response = {
+        "job_id": job.job_id,
+        "job_type": job.job_type,
+        "status": job.status,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "expires_at": job.expires_at,
+    }
+    if job.status == "succeeded":
+        response["result"] = json.loads(job.result_data)
+    elif job.status == "failed":
+        response["error"] = job.error
+    return response
+
+
+class JobQueue:
+    """
+    Persistent job queue for flows that take longer than a flaky mobile
+    connection stays open. Jobs are rows in the jobs table, so a client can
+    poll or resubscribe after reconnecting and results survive restarts.
+    Each registered job type gets its own workers in this process, which
+    bounds how many runs of that type hit the upstreams at once.
+    """
+
+    def __init__(
+        self,
+        ttl: float = JOB_TTL,
+        concurrency: str = JOB_CONCURRENCY,
+        timeout: float = JOB_TIMEOUT,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        poll_interval: float = JOB_POLL_INTERVAL,
+    ):
+        self.ttl = ttl
+        self.limits = parse_concurrency(concurrency)
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._handlers: Dict[str, JobHandler] = {}
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._changed: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def register(self, job_type: str, handler: JobHandler):
+        """Run `handler(params, payload)` for jobs of this type; it returns the result."""
+        self._handlers[job_type] = handler
+
+    async def submit(
+        self,
+        user_id: str,
+        job_type: str,
+        params: dict,
+        payload: Optional[bytes] = None,
+        idempotency_key: Optional[str] = None,
+        account_tier: Optional[str] = None,
+    ) -> JobDB:
+        """
+        Queue a job. A retried submission with the same idempotency key
+        returns the job of the first one instead of running the flow again.
+        The run's LLM calls queue as `user_id` with `account_tier`.
+        """
+        if job_type not in self._handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        now = datetime.utcnow()
+        try:
+            async with session_scope() as db:
+                if idempotency_key:
+                    existing = await self._find(db, user_id, idempotency_key)
+                    if existing is not None:
+                        return existing
+                    # An expired job not deleted yet would hold the key
+                    await db.execute(
+                        delete(JobDB).where(
+                            JobDB.user_id == user_id,
+                            JobDB.idempotency_key == idempotency_key,
+                            JobDB.expires_at <= now,
+                        )
+                    )
+                job = JobDB(
+                    user_id=user_id,
+                    job_type=job_type,
+                    account_tier=account_tier,
+                    status="queued",
+                    idempotency_key=idempotency_key,
+                    params=json.dumps(params),
+                    payload=payload,
+                    attempts=0,
+                    created_at=now,
+                    expires_at=now + timedelta(seconds=self.ttl),
+                )
+                db.add(job)
+        except IntegrityError:
+            if not idempotency_key:
+                raise
+            # A concurrent retry with the same key inserted its job first
+            async with session_scope() as db:
+                existing = await self._find(db, user_id, idempotency_key)
+            if existing is None:
+                raise
+            return existing
+        self._wake(job_type)
+        return job
+
+    async def _find(
+        self, db: AsyncSession, user_id: str, idempotency_key: str
+    ) -> Optional[JobDB]:
+        """The user's unexpired job submitted with this idempotency key."""
+        return await db.scalar(
+            select(JobDB).where(
+                JobDB.user_id == user_id,
+                JobDB.idempotency_key == idempotency_key,
+                JobDB.expires_at > datetime.utcnow(),
+            )
+        )
+
+    async def get(self, job_id: str, user_id: str) -> Optional[JobDB]:
+        async with session_scope() as db:
+            return await db.scalar(
+                select(JobDB).where(
+                    JobDB.job_id == job_id,
+                    JobDB.user_id == user_id,
+                    JobDB.expires_at > datetime.utcnow(),
+                )
+            )
+
+    async def wait_for_change(self, timeout: float):
+        """Return when a job of this process changes status, or after timeout."""
+        try:
+            async with self._condition():
+                await asyncio.wait_for(self._condition().wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def start(self):
+        """Start the workers of every registered job type."""
+        # Wake-up events belong to the running event loop
+        self._wakeups = {}
+        self._changed = None
+        for job_type in self._handlers:
+            for _ in range(self.limits.get(job_type, 1)):
+                self._tasks.append(asyncio.create_task(self._worker(job_type)))
+        self._tasks.append(asyncio.create_task(self._maintenance()))
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _condition(self) -> asyncio.Condition:
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    async def _notify(self):
+        async with self._condition():
+            self._condition().notify_all()
+
+    def _wake(self, job_type: str):
+        self._wakeups.setdefault(job_type, asyncio.Event()).set()
+
+    async def _claim(self, job_type: str) -> Optional[JobDB]:
+        """Oldest queued job of the type, marked running by this worker."""
+        async with session_scope() as db:
+            while True:
+                job = await db.scalar(
+                    select(JobDB)
+                    .where(JobDB.job_type == job_type, JobDB.status == "queued")
+                    .order_by(JobDB.created_at)
+                    .limit(1)
+                )
+                if job is None:
+                    return None
+                # Conditional update: another worker (or process) may have
+                # claimed the same row in the meantime
+                claimed = await db.execute(
+                    update(JobDB)
+                    .where(JobDB.job_id == job.job_id, JobDB.status == "queued")
+                    .values(
+                        status="running",
+                        started_at=datetime.utcnow(),
+                        attempts=JobDB.attempts + 1,
+                    )
+                )
+                if claimed.rowcount == 1:
+                    await db.commit()
+                    await db.refresh(job)
+                    return job
+
+    async def _finish(self, job_id: str, **values):
+        async with session_scope() as db:
+            await db.execute(
+                update(JobDB)
+                .where(JobDB.job_id == job_id)
+                .values(finished_at=datetime.utcnow(), payload=None, **values)
+            )
+        await self._notify()
+
+    async def _worker(self, job_type: str):
+        handler = self._handlers[job_type]
+        wakeup = self._wakeups.setdefault(job_type, asyncio.Event())
+        while True:
+            try:
+                job = await self._claim(job_type)
+            except Exception as e:
+                print(f"Error claiming {job_type} job: {e}")
+                job = None
+            if job is None:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._notify()
+            print(f"⚙️ Running {job_type} job {job.job_id}")
+            try:
+                # Upstream calls of the run share its deadline, and queue
+                # behind interactive requests for rate-limited upstreams and
+                # as the submitting user for the LLM
+                with (
+                    deadline(self.timeout),
+                    priority(BATCH),
+                    llm_caller(job.user_id, job.account_tier),
+                ):
+                    result = await asyncio.wait_for(
+                        handler(json.loads(job.params), job.payload), self.timeout
+                    )
+            except asyncio.CancelledError:
+                # Shutting down: let the next start pick the job up again
+                await asyncio.shield(self._requeue(job.job_id))
+                raise
+            except asyncio.TimeoutError:
+                await self._finish(
+                    job.job_id, status="failed", error="The job took too long"
+                )
+            except Exception as e:
+                print(f"{job_type} job {job.job_id} failed: {e}")
+                await self._finish(job.job_id, status="failed", error=str(e))
+            else:
+                await self._finish(
+                    job.job_id, status="succeeded", result_data=json.dumps(result)
+                )
+
+    async def _requeue(self, job_id: str):
+        async with session_scope() as db:
+            await db.execute(
+                update(JobDB)
+                .where(JobDB.job_id == job_id, JobDB.status == "running")
+                .values(status="queued", attempts=JobDB.attempts - 1)
+            )
+
+    async def _maintenance(self):
+        """Requeue jobs of processes that died, and delete expired jobs."""
+        while True:
+            try:
+                now = datetime.utcnow()
+                stale = [
+                    JobDB.status == "running",
+                    JobDB.started_at < now - timedelta(seconds=2 * self.timeout),
+                ]
+                async with session_scope() as db:
+                    await db.execute(
+                        update(JobDB)
+                        .where(*stale, JobDB.attempts < self.max_attempts)
+                        .values(status="queued")
+                    )
+                    await db.execute(
+                        update(JobDB)
+                        .where(*stale, JobDB.attempts >= self.max_attempts)
+                        .values(
+                            status="failed",
+                            error="The job was interrupted",
+                            finished_at=now,
+                            payload=None,
+                        )
+                    )
+                    await db.execute(
+                        delete(JobDB).where(
+                            JobDB.expires_at <= now, JobDB.status != "running"
+                        )
+                    )
+                for job_type in self._handlers:
+                    self._wake(job_type)
+            except Exception as e:
+                print(f"Error maintaining job queue: {e}")
+            await asyncio.sleep(max(self.timeout / 2, self.poll_interval))
+
+
+job_queue = JobQueue()
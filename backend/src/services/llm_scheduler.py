@@ -0,0 +1,310 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Gemini calls running at once in this process, and per user
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "16"))
+LLM_USER_MAX_IN_FLIGHT = int(os.getenv("LLM_USER_MAX_IN_FLIGHT", "2"))
+# Share of the LLM capacity a user of each account tier gets while others
+# are waiting too, as "tier:weight,..."; users without a tier are "standard"
+LLM_TIER_WEIGHTS = os.getenv("LLM_TIER_WEIGHTS", "standard:1,premium:2,enterprise:4")
+# Users whose queue wait statistics are kept (least recently seen dropped)
+LLM_METRICS_USERS = int(os.getenv("LLM_METRICS_USERS", "1000"))
+
+DEFAULT_ACCOUNT_TIER = "standard"
+# Calls made outside a user's request (startup, maintenance)
+SYSTEM_CALLER = "system"
+
+_caller: ContextVar[Tuple[str, Optional[str]]] = ContextVar(
+    "llm_caller", default=(SYSTEM_CALLER, None)
+)
+
+
+def set_llm_caller(user_id: str, account_tier: Optional[str] = None):
+    """Attribute the LLM calls of the rest of the current request to the user."""
+    _caller.set((user_id, account_tier))
+
+
+@contextmanager
+def llm_caller(user_id: str, account_tier: Optional[str] = None) -> Iterator[None]:
+    """Attribute the LLM calls made in the block to the user."""
+    token = _caller.set((user_id, account_tier))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def parse_tier_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        tier, _, weight = item.partition(":")
+        if tier.strip() and weight.strip():
+            weights[tier.strip()] = max(float(weight), 0.01)
+    return weights
+
+
+class _Request:
+    __slots__ = (
+        "user_id",
+        "tier",
+        "start",
+        "seq",
+        "granted",
+        "loop",
+        "future",
+        "event",
+    )
+
+    def __init__(self, user_id: str, tier: str, start: float, seq: int):
+        self.user_id = user_id
+        self.tier = tier
+        self.start = start
+        self.seq = seq
+        self.granted = False
+        self.loop = None
+        self.future = None
+        self.event = None
+
+    def wake(self):
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        if self.event is not None:
+            self.event.set()
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class LLMScheduler:
+    """
+    Weighted fair queue in front of the LLM. While all LLM_MAX_IN_FLIGHT
+    slots are busy, calls queue and a freed slot goes to the queued call with
+    the lowest start tag (start-time fair queuing): each call of a user is
+    tagged 1/weight of their tier after that user's previous one, so a user
+    firing hundreds of calls only gets their weighted share of the slots
+    and everyone else's next call still goes ahead of most of them. No user
+    holds more than LLM_USER_MAX_IN_FLIGHT slots at once.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = LLM_MAX_IN_FLIGHT,
+        user_max_in_flight: int = LLM_USER_MAX_IN_FLIGHT,
+        tier_weights: str = LLM_TIER_WEIGHTS,
+        metrics_users: int = LLM_METRICS_USERS,
+    ):
+        self.max_in_flight = max_in_flight
+        self.user_max_in_flight = user_max_in_flight
+        self.weights = parse_tier_weights(tier_weights)
+        self.metrics_users = metrics_users
+        self._lock = threading.Lock()
+        self._queue: List[_Request] = []
+        self._seq = itertools.count()
+        self._virtual = 0.0  # start tag of the last call given a slot
+        self._last_finish: Dict[str, float] = {}
+        self._in_flight: Dict[str, int] = {}
+        self.in_flight = 0
+        self.unscheduled = 0  # sync calls on the event loop thread, never queued
+        self._users: "OrderedDict[str, dict]" = OrderedDict()
+
+    def weight(self, tier: Optional[str]) -> float:
+        return self.weights.get(tier or DEFAULT_ACCOUNT_TIER, 1.0)
+
+    def _enqueue(self) -> _Request:
+        user_id, tier = _caller.get()
+        tier = tier or DEFAULT_ACCOUNT_TIER
+        with self._lock:
+            start = max(self._virtual, self._last_finish.get(user_id, 0.0))
+            self._last_finish[user_id] = start + 1 / self.weight(tier)
+            request = _Request(user_id, tier, start, next(self._seq))
+            self._queue.append(request)
+            self._stats(user_id, tier)["queued"] += 1
+            self._dispatch()
+            return request
+
+    def _dispatch(self):
+        """Give free slots to queued calls in start tag order. Holds the lock."""
+        while self.in_flight < self.max_in_flight:
+            eligible = [
+                request
+                for request in self._queue
+                if self._in_flight.get(request.user_id, 0) < self.user_max_in_flight
+            ]
+            if not eligible:
+                break
+            request = min(eligible, key=lambda r: (r.start, r.seq))
+            self._queue.remove(request)
+            self._take(request.user_id)
+            self._virtual = max(self._virtual, request.start)
+            self._stats(request.user_id, request.tier)["queued"] -= 1
+            request.granted = True
+            request.wake()
+        if len(self._last_finish) > self.metrics_users:
+            # Idle users would start at the virtual time anyway
+            self._last_finish = {
+                user_id: finish
+                for user_id, finish in self._last_finish.items()
+                if finish > self._virtual or user_id in self._in_flight
+            }
+
+    def _take(self, user_id: str):
+        self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+        self.in_flight += 1
+
+    def _release(self, user_id: str):
+        with self._lock:
+            self._in_flight[user_id] -= 1
+            if not self._in_flight[user_id]:
+                del self._in_flight[user_id]
+            self.in_flight -= 1
+            self._dispatch()
+
+    def _leave(self, request: _Request):
+        """A queued call gave up (cancelled); pass on a slot it got meanwhile."""
+        with self._lock:
+            if not request.granted:
+                self._queue.remove(request)
+                self._stats(request.user_id, request.tier)["queued"] -= 1
+                return
+        self._release(request.user_id)
+
+    def _stats(self, user_id: str, tier: str) -> dict:
+        stats = self._users.get(user_id)
+        if stats is None:
+            stats = {
+                "tier": tier,
+                "calls": 0,
+                "queued": 0,
+                "wait_total": 0.0,
+                "wait_max": 0.0,
+                "last_wait": 0.0,
+            }
+            self._users[user_id] = stats
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.metrics_users:
+            self._users.popitem(last=False)
+        stats["tier"] = tier
+        return stats
+
+    def _record(self, request: _Request, waited: float):
+        with self._lock:
+            stats = self._stats(request.user_id, request.tier)
+            stats["calls"] += 1
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+            stats["last_wait"] = waited
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold an LLM slot for the block, waiting for it without a thread."""
+        started = time.monotonic()
+        request = self._enqueue()
+        if not request.granted:
+            request.loop = asyncio.get_running_loop()
+            try:
+                while not request.granted:
+                    request.future = request.loop.create_future()
+                    if request.granted:
+                        break
+                    await request.future
+            except BaseException:
+                self._leave(request)
+                raise
+        self._record(request, time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self._release(request.user_id)
+
+    @contextmanager
+    def slot_sync(self) -> Iterator[None]:
+        """slot() for blocking code; on the event loop thread it never waits."""
+        if _on_event_loop():
+            user_id, _ = _caller.get()
+            with self._lock:
+                self._take(user_id)
+                self.unscheduled += 1
+            try:
+                yield
+            finally:
+                self._release(user_id)
+            return
+        started = time.monotonic()
+        request = self._enqueue()
+        if not request.granted:
+            request.event = threading.Event()
+            try:
+                while not request.granted:
+                    request.event.wait(1.0)
+            except BaseException:
+                self._leave(request)
+                raise
+        self._record(request, time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self._release(request.user_id)
+
+    def _user_metrics(self, user_id: str, stats: dict) -> dict:
+        return {
+            "tier": stats["tier"],
+            "calls": stats["calls"],
+            "queued": stats["queued"],
+            "in_flight": self._in_flight.get(user_id, 0),
+            "avg_wait_ms": (
+                round(stats["wait_total"] / stats["calls"] * 1000)
+                if stats["calls"]
+                else 0
+            ),
+            "max_wait_ms": round(stats["wait_max"] * 1000),
+            "last_wait_ms": round(stats["last_wait"] * 1000),
+        }
+
+    def metrics(self, user_id: Optional[str] = None) -> dict:
+        """
+        Process-wide counters, with the queue statistics of every user, or
+        only of `user_id` (under "user", None if it made no calls) if given.
+        """
+        with self._lock:
+            metrics = {
+                "max_in_flight": self.max_in_flight,
+                "user_max_in_flight": self.user_max_in_flight,
+                "tier_weights": self.weights,
+                "in_flight": self.in_flight,
+                "queued": len(self._queue),
+                "unscheduled": self.unscheduled,
+            }
+            if user_id is not None:
+                stats = self._users.get(user_id)
+                metrics["user"] = (
+                    None if stats is None else self._user_metrics(user_id, stats)
+                )
+                return metrics
+            metrics["users"] = {
+                user_id: self._user_metrics(user_id, stats)
+                for user_id, stats in self._users.items()
+            }
+            return metrics
+
+
+llm_scheduler = LLMScheduler()
@@ -1,40 +1,104 @@
+import asyncio
 import os
-from typing import Any, Dict, Optional
-from google import genai
+import threading
+from typing import Any, Dict, Iterator, Optional
 from pathlib import Path
 from dotenv import load_dotenv
+from src.ext_apis.rate_limiter import rate_limiter
+from src.services.llm_scheduler import LLMScheduler, llm_scheduler
 
 load_dotenv()
 
 
 class LLMService:
 
-    def __init__(self, model_name: str = "gemini-2.0-flash-001"):
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY environment variable not set.")
-        self.client = genai.Client(api_key=api_key)
+    def __init__(
+        self,
+        model_name: str = "gemini-2.0-flash-001",
+        scheduler: LLMScheduler = llm_scheduler,
+    ):
         self.model_name = model_name
-        self.chat = self.client.chats.create(model=self.model_name)
+        # Shares the LLM slots fairly between users; see services.llm_scheduler
+        self.scheduler = scheduler
+        self._client = None
+        self._lock = threading.Lock()
+        # Shared quota of the GOOGLE_API_KEY; see ext_apis.rate_limiter
+        self.limiter = rate_limiter("gemini")
+
+    @property
+    def client(self):
+        """Gemini client, constructed on first use."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # google.genai is slow to import, load it only when needed
+                    from google import genai
+
+                    api_key = os.getenv("GOOGLE_API_KEY")
+                    if not api_key:
+                        raise ValueError("GOOGLE_API_KEY environment variable not set.")
+                    self._client = genai.Client(api_key=api_key)
+        return self._client
 
     def send_message(self, prompt: str, **kwargs) -> Dict[str, Any]:
         """
-        Send a prompt to the model and return the response.
+        Send a prompt to the model and return the response. Calls are
+        stateless: conversation context must be part of the prompt.
+        Blocks while the caller's turn in the fair queue comes; async code
+        should await asend_message instead, which doesn't hold a thread then.
         Args:
             prompt: The prompt string to send.
             kwargs: Additional config for the model (temperature, max_output_tokens, etc.)
         Returns:
             Dict with the response text and any error encountered.
         """
+        with self.scheduler.slot_sync():
+            return self._generate(prompt, **kwargs)
+
+    async def asend_message(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        """send_message for async code: queues on the event loop, then calls the model in a thread."""
+        async with self.scheduler.slot():
+            return await asyncio.to_thread(self._generate, prompt, **kwargs)
+
+    def _generate(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        from google import genai
+
         try:
-            response = self.chat.send_message(
-                message=genai.types.Part.from_text(text=prompt),
+            if self.limiter is not None:
+                self.limiter.acquire_sync()
+            response = self.client.models.generate_content(
+                model=self.model_name,
+                contents=prompt,
                 config=genai.types.GenerateContentConfig(**kwargs),
             )
             return {"response": response.text}
         except Exception as e:
             print(f"Error in LLMService.send_message: {e}")
+            if self.limiter is not None and getattr(e, "code", None) == 429:
+                self.limiter.pause()
             return {"response": None, "error": str(e)}
 
+    def stream_message(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        Send a prompt to the model and yield the response text as it is generated.
+        Args:
+            prompt: The prompt string to send.
+            kwargs: Additional config for the model (temperature, max_output_tokens, etc.)
+        Yields:
+            Chunks of response text. Errors are raised to the caller.
+        """
+        from google import genai
+
+        with self.scheduler.slot_sync():
+            if self.limiter is not None:
+                self.limiter.acquire_sync()
+            for chunk in self.client.models.generate_content_stream(
+                model=self.model_name,
+                contents=prompt,
+                config=genai.types.GenerateContentConfig(**kwargs),
+            ):
+                if chunk.text:
+                    yield chunk.text
+
 
 llm_service = LLMService()
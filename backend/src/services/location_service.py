@@ -0,0 +1,196 @@
+import asyncio
+import json
+import os
+import re
+from collections import OrderedDict
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import select, update
+from src.auth.user_cache import user_cache
+from src.db import session_scope
+from src.db.chat_models import GeocodeCache, User as UserDB
+from src.ext_apis.geocoding_api import format_place_name, photon_reverse
+from src.services.gazetteer import gazetteer
+
+load_dotenv()
+
+# Coordinates are rounded to this many decimals before lookup (2 ≈ 1 km),
+# so nearby farms share one cache entry
+GEOCODE_GRID_DECIMALS = int(os.getenv("GEOCODE_GRID_DECIMALS", "2"))
+# Grid cells kept in memory in front of the geocode_cache table
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "4096"))
+# Pause between users in the startup backfill, keeps Photon usage polite
+GEOCODE_BACKFILL_DELAY = 1.0
+
+
+def parse_lat_lon_from_location(location: str) -> Optional[Tuple[float, float]]:
+    """Parse latitude and longitude from a location string like '9.145, 40.489'."""
+    if not location:
+        return None
+    m = re.search(r"([+-]?[0-9]*\.?[0-9]+)\s*,\s*([+-]?[0-9]*\.?[0-9]+)", location)
+    if not m:
+        return None
+    try:
+        return (float(m.group(1)), float(m.group(2)))
+    except ValueError:
+        return None
+
+
+def strip_coordinates(location: str) -> str:
+    """The location string with any GPS coordinates removed."""
+    if not location:
+        return ""
+    location = re.sub(r",?\s*lat:\s*[\d.-]+", "", location)
+    location = re.sub(r",?\s*lon:\s*[\d.-]+", "", location)
+    location = re.sub(r"\s*\([\d.-]+,\s*[\d.-]+\)", "", location)
+    location = re.sub(r"\s*[\d.-]+,\s*[\d.-]+", "", location)
+
+    # Clean up any remaining artifacts
+    location = re.sub(r"\s+", " ", location)
+    location = location.strip()
+    location = re.sub(r"^,\s*", "", location)
+    location = re.sub(r",\s*$", "", location)
+    return location
+
+
+def clean_location_for_display(location: str) -> str:
+    """Location without coordinates, for prompts. Never makes a network call."""
+    return strip_coordinates(location) or "Unknown location"
+
+
+def location_name_without_lookup(location: str) -> Optional[str]:
+    """
+    The place name when it can be known without geocoding: the text itself
+    for locations without coordinates, None for ones that need a lookup.
+    """
+    if not location or parse_lat_lon_from_location(location):
+        return None
+    return location.strip() or None
+
+
+class ReverseGeocoder:
+    """
+    Reverse geocoding from the offline gazetteer. Points with no gazetteer
+    place nearby fall back to Photon, behind two caches keyed by a rounded
+    coordinate grid: an in-memory LRU and the geocode_cache table, so each
+    grid cell is looked up online once.
+    """
+
+    def __init__(
+        self,
+        grid_decimals: int = GEOCODE_GRID_DECIMALS,
+        maxsize: int = GEOCODE_CACHE_SIZE,
+    ):
+        self.grid_decimals = grid_decimals
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def grid_key(self, lat: float, lon: float) -> str:
+        d = self.grid_decimals
+        return f"{round(lat, d):.{d}f},{round(lon, d):.{d}f}"
+
+    def _remember(self, key: str, place_name: Optional[str]):
+        self._entries[key] = place_name
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def place_name(self, lat: float, lon: float) -> Optional[str]:
+        """
+        Place name for the coordinates, None if there is no place there.
+        Raises if Photon could not be reached; failures are not cached.
+        """
+        if not gazetteer.loaded:
+            await asyncio.to_thread(gazetteer.load)
+        place_name = gazetteer.place_name(lat, lon)
+        if place_name:
+            self.hits += 1
+            return place_name
+
+        key = self.grid_key(lat, lon)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+        async with session_scope() as db:
+            cached = await db.get(GeocodeCache, key)
+        if cached is not None:
+            self.hits += 1
+            self._remember(key, cached.place_name)
+            return cached.place_name
+
+        self.misses += 1
+        grid_lat, grid_lon = (float(v) for v in key.split(","))
+        properties = await photon_reverse(grid_lat, grid_lon)
+        place_name = format_place_name(properties) if properties else None
+        async with session_scope() as db:
+            await db.merge(
+                GeocodeCache(
+                    grid_key=key,
+                    place_name=place_name,
+                    properties=json.dumps(properties or {}),
+                )
+            )
+        self._remember(key, place_name)
+        return place_name
+
+    async def resolve_location_name(self, location: str) -> Optional[str]:
+        """
+        Display name for a stored location string, or None if it could not be
+        resolved right now.
+        """
+        coords = parse_lat_lon_from_location(location)
+        if not coords:
+            return location_name_without_lookup(location)
+        try:
+            place_name = await self.place_name(*coords)
+        except Exception as e:
+            print(f"⚠️ Reverse geocoding failed for {coords}: {e}")
+            return None
+        return place_name or strip_coordinates(location) or None
+
+
+reverse_geocoder = ReverseGeocoder()
+
+
+async def update_user_location_name(user_id: str, location: str):
+    """
+    Resolve and store the place name for a user's location. Runs after the
+    request that changed the location has committed.
+    """
+    location_name = await reverse_geocoder.resolve_location_name(location)
+    if location_name is None:
+        return
+    async with session_scope() as db:
+        # Skip if the location changed again in the meantime
+        await db.execute(
+            update(UserDB)
+            .where(UserDB.user_id == user_id, UserDB.location == location)
+            .values(location_name=location_name)
+        )
+    user_cache.invalidate(user_id)
+
+
+async def backfill_location_names():
+    """Resolve place names for users stored before location_name existed."""
+    async with session_scope() as db:
+        rows = (
+            await db.execute(
+                select(UserDB.user_id, UserDB.location).where(
+                    UserDB.location_name.is_(None), UserDB.location.is_not(None)
+                )
+            )
+        ).all()
+    if not rows:
+        return
+    print(f"📍 Resolving place names for {len(rows)} users")
+    for user_id, location in rows:
+        try:
+            await update_user_location_name(user_id, location)
+        except Exception as e:
+            print(f"⚠️ Could not resolve location for user {user_id}: {e}")
+        if parse_lat_lon_from_location(location):
+            await asyncio.sleep(GEOCODE_BACKFILL_DELAY)
@@ -0,0 +1,220 @@
+import asyncio
+import importlib.util
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Optional
+from dotenv import load_dotenv
+from src.services.image_service import NormalizedImage
+
+if TYPE_CHECKING:
+    import numpy as np
+
+load_dotenv()
+
+# Optional local healthy/not-healthy classifier (ONNX, run with onnxruntime on
+# CPU). Unset, or without onnxruntime installed, every image goes to the
+# remote providers.
+PRESCREEN_MODEL_PATH = os.getenv("PRESCREEN_MODEL_PATH", "")
+# Images the model calls healthy with at least this probability are answered
+# locally; everything else is escalated to OpenEPI, Kindwise and DeepLeaf
+PRESCREEN_HEALTHY_THRESHOLD = float(os.getenv("PRESCREEN_HEALTHY_THRESHOLD", "0.9"))
+PRESCREEN_WORKERS = int(os.getenv("PRESCREEN_WORKERS", "1"))
+# Inference is skipped (and the image escalated) if it takes longer than this
+PRESCREEN_TIMEOUT = float(os.getenv("PRESCREEN_TIMEOUT", "2"))
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+DEFAULT_INPUT_SIDE = 224
+
+# Model session of a pool worker process, loaded by _init_worker
+_session = None
+
+
+def _init_worker(model_path: str):
+    global _session
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    # One thread per worker process; PRESCREEN_WORKERS sets the parallelism
+    options.intra_op_num_threads = 1
+    options.inter_op_num_threads = 1
+    _session = ort.InferenceSession(
+        model_path, sess_options=options, providers=["CPUExecutionProvider"]
+    )
+
+
+def _input_side(shape) -> tuple:
+    height, width = shape[2], shape[3]
+    if isinstance(height, int) and isinstance(width, int):
+        return width, height
+    return DEFAULT_INPUT_SIDE, DEFAULT_INPUT_SIDE
+
+
+def preprocess(jpeg: bytes, size: tuple) -> "np.ndarray":
+    """JPEG bytes to a 1x3xHxW float32 tensor, ImageNet-normalized."""
+    # Only pool workers run the model; the app never needs numpy or PIL here
+    import numpy as np
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(jpeg))
+    img.draft("RGB", size)
+    img = img.convert("RGB").resize(size, Image.BILINEAR)
+    pixels = np.asarray(img, dtype=np.float32) / 255.0
+    mean = np.array(IMAGENET_MEAN, dtype=np.float32)
+    std = np.array(IMAGENET_STD, dtype=np.float32)
+    pixels = (pixels - mean) / std
+    return pixels.transpose(2, 0, 1)[None]
+
+
+def healthy_probability_from_output(output: "np.ndarray") -> float:
+    """
+    Probability of "healthy" from the model output: one value (probability or
+    logit of healthy) or two (healthy, not healthy) like OpenEPI's HLT and
+    NOT_HLT, as probabilities or logits.
+    """
+    import numpy as np
+
+    values = np.asarray(output, dtype=np.float64).reshape(-1)
+    if values.size == 1:
+        value = float(values[0])
+        return value if 0.0 <= value <= 1.0 else float(1 / (1 + np.exp(-value)))
+    values = values[:2]
+    if values.min() < 0 or abs(values.sum() - 1) > 1e-3:
+        values = np.exp(values - values.max())
+        values /= values.sum()
+    return float(values[0])
+
+
+def predict_healthy(jpeg: bytes) -> float:
+    """Run in a pool worker: probability that the leaf in the JPEG is healthy."""
+    model_input = _session.get_inputs()[0]
+    tensor = preprocess(jpeg, _input_side(model_input.shape))
+    output = _session.run(None, {model_input.name: tensor})[0]
+    return healthy_probability_from_output(output)
+
+
+def _ready() -> bool:
+    return _session is not None
+
+
+class LocalPrescreen:
+    """
+    Answers clearly healthy leaves with a local ONNX model before any remote
+    provider is called. Inference runs in a dedicated process pool (the model
+    is loaded once per worker) so it never holds the GIL of the API worker.
+    Any failure escalates the image to the remote ensemble.
+    """
+
+    def __init__(
+        self,
+        model_path: str = PRESCREEN_MODEL_PATH,
+        threshold: float = PRESCREEN_HEALTHY_THRESHOLD,
+        workers: int = PRESCREEN_WORKERS,
+        timeout: float = PRESCREEN_TIMEOUT,
+    ):
+        self.model_path = model_path
+        self.threshold = threshold
+        self.workers = workers
+        self.timeout = timeout
+        self.enabled = (
+            bool(model_path)
+            and os.path.exists(model_path)
+            and importlib.util.find_spec("onnxruntime") is not None
+        )
+        self.answered = 0  # images answered locally
+        self.escalated = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn: forking a process that runs an event loop and
+                    # driver threads is not safe
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_worker,
+                        initargs=(self.model_path,),
+                    )
+        return self._executor
+
+    def load(self):
+        """Start the worker processes and load the model in each of them."""
+        if not self.enabled:
+            return
+        futures = [self.executor.submit(_ready) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+        print(f"🌿 Local pre-screen model loaded in {self.workers} worker(s)")
+
+    async def healthy_probability(self, image: NormalizedImage) -> Optional[float]:
+        """Model probability that the leaf is healthy, or None if unavailable."""
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await asyncio.wait_for(
+                loop.run_in_executor(self.executor, predict_healthy, image.data),
+                self.timeout,
+            )
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next call
+            self.errors += 1
+            self.shutdown(wait=False)
+        except Exception as e:
+            self.errors += 1
+            print(f"Local pre-screen failed: {e}")
+        finally:
+            self.total_seconds += time.perf_counter() - started
+        return None
+
+    async def screen(self, image: NormalizedImage) -> Optional[float]:
+        """
+        The healthy probability if the leaf is clearly healthy (at least
+        `threshold`), otherwise None: the image needs the remote providers.
+        """
+        probability = await self.healthy_probability(image)
+        if probability is None:
+            return None
+        if probability >= self.threshold:
+            self.answered += 1
+            return probability
+        self.escalated += 1
+        return None
+
+    def metrics(self) -> dict:
+        screened = self.answered + self.escalated
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "screened": screened,
+            "answered_locally": self.answered,
+            "escalated": self.escalated,
+            "errors": self.errors,
+            "local_rate": round(self.answered / screened, 4) if screened else 0.0,
+            "avg_ms": (
+                round(self.total_seconds / (screened + self.errors) * 1000, 2)
+                if screened + self.errors
+                else 0.0
+            ),
+        }
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+prescreen = LocalPrescreen()
@@ -1,10 +1,7 @@
-from google.cloud import translate_v2 as translate
-from deep_translator import GoogleTranslator, single_detection
 from dotenv import load_dotenv
+from src.ext_apis.rate_limiter import rate_limiter
+from src.services.gcp_credentials import LazyGCPClient
 import os
-import json
-import base64
-import tempfile
 import logging
 
 load_dotenv()
@@ -16,116 +13,51 @@ class TranslationServiceFallBack:
         pass
 
     def detect_language(self, text: str) -> str:
+        from deep_translator import single_detection
+
         return single_detection(text, api_key=os.getenv("DETECT_LANGUAGE_API"))
 
     def translate_to_english(self, text: str) -> str:
+        from deep_translator import GoogleTranslator
+
         return GoogleTranslator(source="auto", target="en").translate(text)
 
     def translate_from_english(self, text: str, dest_lang: str) -> str:
+        from deep_translator import GoogleTranslator
+
         return GoogleTranslator(source="en", target=dest_lang).translate(text)
 
 
 translation_fallback_service = TranslationServiceFallBack()
 
 
+def _create_translate_client(credentials):
+    from google.cloud import translate_v2 as translate
+
+    return translate.Client(credentials=credentials)
+
+
 class GoogleCloudTranslate:
     def __init__(self):
-        self.translate_client = None
-        self.key_file_path = None
-        self._initialize_client()
-
-    def _initialize_client(self):
-        """Initialize Google Cloud Translate client with proper error handling"""
-        try:
-            # First try environment variable (for Railway deployment)
-            key_b64 = os.getenv("GCP_CREDENTIALS_B64")
-
-            if key_b64:
-                # Decode base64 credentials
-                try:
-                    key_json = base64.b64decode(key_b64).decode("utf-8")
-                    # Validate JSON
-                    json.loads(key_json)
-
-                    # Create temporary file with proper encoding
-                    temp_file = tempfile.NamedTemporaryFile(
-                        delete=False, suffix=".json", mode="w", encoding="utf-8"
-                    )
-                    temp_file.write(key_json)
-                    temp_file.close()
-                    self.key_file_path = temp_file.name
-                    logger.info(
-                        "Using credentials from GCP_CREDENTIALS_B64 environment variable"
-                    )
-
-                    # Initialize Google Cloud client
-                    try:
-                        self.translate_client = (
-                            translate.Client.from_service_account_json(
-                                self.key_file_path
-                            )
-                        )
-                        logger.info(
-                            "Google Cloud Translate client initialized successfully"
-                        )
-                        return
-                    except Exception as e:
-                        logger.error(
-                            f"Failed to initialize Google Cloud Translate client: {e}"
-                        )
-                        self.translate_client = None
-
-                except Exception as e:
-                    logger.error(f"Failed to decode base64 credentials: {e}")
-
-            # If environment variable fails, try local file (for development)
-            key_path = os.path.join(os.path.dirname(__file__), "../../", "gcp_key.json")
-            key_path = os.path.abspath(key_path)
-
-            if os.path.exists(key_path):
-                try:
-                    # Validate JSON
-                    with open(key_path, "r", encoding="utf-8") as f:
-                        json.load(f)
-                    self.key_file_path = key_path
-                    logger.info(f"Using credentials from local file: {key_path}")
-
-
-                    # Initialize Google Cloud client
-                    try:
-                        self.translate_client = (
-                            translate.Client.from_service_account_json(
-                                self.key_file_path
-                            )
-                        )
-                        logger.info(
-                            "Google Cloud Translate client initialized successfully"
-                        )
-                        return
-                    except Exception as e:
-                        logger.error(
-                            f"Failed to initialize Google Cloud Translate client: {e}"
-                        )
-                        self.translate_client = None
-
-                except Exception as e:
-                    logger.error(f"Error reading local credentials file: {e}")
-
-            # If both fail, use fallback
-            logger.warning(
-                "No valid Google Cloud credentials found. Using fallback translation service."
-            )
-            return
-
-        except Exception as e:
-            logger.error(
-                f"Unexpected error during Google Cloud Translate initialization: {e}"
-            )
-            self.translate_client = None
+        self._translate_client = LazyGCPClient(
+            "Google Cloud Translate", _create_translate_client
+        )
+        # Over the quota, calls fall back to the free translator below
+        self.limiter = rate_limiter("google_translate")
+
+    @property
+    def translate_client(self):
+        """Translate client, constructed on first use with the shared credentials"""
+        return self._translate_client.get()
+
+    def acquire(self):
+        if self.limiter is not None:
+            self.limiter.acquire_sync()
 
     def detect_language(self, text: str) -> str:
         if self.translate_client:
             try:
+                self.acquire()
                 result = self.translate_client.detect_language(text)
                 return result["language"]
             except Exception as e:
@@ -137,6 +69,7 @@ class GoogleCloudTranslate:
     def translate_to_english(self, text: str) -> str:
         if self.translate_client:
             try:
+                self.acquire()
                 result = self.translate_client.translate(text, target_language="en")
                 return result["translatedText"]
             except Exception as e:
@@ -148,6 +81,7 @@ class GoogleCloudTranslate:
     def translate_from_english(self, text: str, dest_lang: str) -> str:
         if self.translate_client:
             try:
+                self.acquire()
                 result = self.translate_client.translate(
                     text, source_language="en", target_language=dest_lang
                 )
@@ -160,18 +94,6 @@ class GoogleCloudTranslate:
         else:
             return translation_fallback_service.translate_from_english(text, dest_lang)
 
-    def __del__(self):
-        """Clean up temporary file on object destruction"""
-        if self.key_file_path and os.path.exists(self.key_file_path):
-            # Only delete if it's a temporary file (not a local credential file)
-            if self.key_file_path.startswith(tempfile.gettempdir()):
-                try:
-                    os.unlink(self.key_file_path)
-                except Exception as e:
-                    logger.warning(
-                        f"Failed to clean up temporary credentials file: {e}"
-                    )
-
 
 # Initialize translation service with fallback handling
 try: